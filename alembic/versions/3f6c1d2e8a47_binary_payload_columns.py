@@ -0,0 +1,28 @@
+"""Binary payload columns
+
+Revision ID: 3f6c1d2e8a47
+Revises: 9b49dbc0b7a4
+Create Date: 2026-10-18 10:12:41.502317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "3f6c1d2e8a47"
+down_revision = "9b49dbc0b7a4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("items", sa.Column("encrypted_data_bin", sa.LargeBinary(), nullable=True))
+    op.add_column("items", sa.Column("cfrag_bin", sa.LargeBinary(), nullable=True))
+    op.add_column("items", sa.Column("sender_pkey_bin", sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.drop_column("sender_pkey_bin")
+        batch_op.drop_column("cfrag_bin")
+        batch_op.drop_column("encrypted_data_bin")
@@ -0,0 +1,99 @@
+"""Backfill binary payloads
+
+Converts the base64 strings of the items table into the binary columns
+added by 3f6c1d2e8a47, by batches of BATCH_SIZE rows, then replaces
+the string columns by the binary ones.
+
+Revision ID: 7a2b9e4c5d10
+Revises: 3f6c1d2e8a47
+Create Date: 2026-10-18 10:31:07.118964
+
+"""
+from base64 import b64decode, b64encode
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "7a2b9e4c5d10"
+down_revision = "3f6c1d2e8a47"
+branch_labels = None
+depends_on = None
+
+#: Number of rows converted per statement
+BATCH_SIZE = 1000
+
+PAYLOAD_COLUMNS = ["encrypted_data", "cfrag", "sender_pkey"]
+
+
+def convert_rows(src_type, dst_type, src_suffix: str, dst_suffix: str, convert):
+    items = sa.table(
+        "items",
+        sa.column("id", sa.Integer),
+        *[sa.column(name + src_suffix, src_type) for name in PAYLOAD_COLUMNS],
+        *[sa.column(name + dst_suffix, dst_type) for name in PAYLOAD_COLUMNS],
+    )
+    src_cols = [items.c[name + src_suffix] for name in PAYLOAD_COLUMNS]
+    stmt = items.update().where(items.c.id == sa.bindparam("b_id"))
+    stmt = stmt.values(
+        {name + dst_suffix: sa.bindparam("b_" + name) for name in PAYLOAD_COLUMNS}
+    )
+
+    bind = op.get_bind()
+    last_id = -1
+    while True:
+        rows = bind.execute(
+            sa.select(items.c.id, *src_cols)
+            .where(items.c.id > last_id)
+            .order_by(items.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if len(rows) == 0:
+            break
+
+        params = []
+        for row in rows:
+            param = {"b_id": row[0]}
+            for name, value in zip(PAYLOAD_COLUMNS, row[1:]):
+                param["b_" + name] = None if value is None else convert(value)
+            params.append(param)
+        bind.execute(stmt, params)
+
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    convert_rows(sa.String, sa.LargeBinary, "", "_bin", b64decode)
+
+    with op.batch_alter_table("items") as batch_op:
+        for name in PAYLOAD_COLUMNS:
+            batch_op.drop_column(name)
+        for name in PAYLOAD_COLUMNS:
+            batch_op.alter_column(
+                name + "_bin",
+                new_column_name=name,
+                existing_type=sa.LargeBinary(),
+                nullable=(name != "encrypted_data"),
+            )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("items") as batch_op:
+        for name in PAYLOAD_COLUMNS:
+            batch_op.alter_column(
+                name,
+                new_column_name=name + "_bin",
+                existing_type=sa.LargeBinary(),
+                nullable=True,
+            )
+
+    with op.batch_alter_table("items") as batch_op:
+        for name in PAYLOAD_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.String(), nullable=True))
+
+    convert_rows(
+        sa.LargeBinary, sa.String, "_bin", "", lambda raw: b64encode(raw).decode(encoding="ascii")
+    )
+
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("encrypted_data", existing_type=sa.String(), nullable=False)
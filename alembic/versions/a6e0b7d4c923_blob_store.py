@@ -0,0 +1,132 @@
+"""Store the ciphertexts in a content addressed blob store
+
+Moves the encrypted_data of the items into the blobs table, by batches
+of BATCH_SIZE rows, keyed by the SHA-256 hash of the ciphertext. The
+items shared without copy reference the blob of their source item.
+
+Revision ID: a6e0b7d4c923
+Revises: f2c9d3b6a810
+Create Date: 2026-10-18 21:05:38.415207
+
+"""
+from hashlib import sha256
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a6e0b7d4c923"
+down_revision = "f2c9d3b6a810"
+branch_labels = None
+depends_on = None
+
+#: Number of rows converted per statement
+BATCH_SIZE = 1000
+
+items = sa.table(
+    "items",
+    sa.column("id", sa.Integer),
+    sa.column("encrypted_data", sa.LargeBinary),
+    sa.column("blob_hash", sa.String),
+)
+blobs = sa.table(
+    "blobs",
+    sa.column("hash", sa.String),
+    sa.column("data", sa.LargeBinary),
+    sa.column("size", sa.Integer),
+    sa.column("refcount", sa.Integer),
+)
+shares = sa.table(
+    "shares",
+    sa.column("item_id", sa.Integer),
+    sa.column("source_item_id", sa.Integer),
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "blobs",
+        sa.Column("hash", sa.String(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("refcount", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("hash"),
+    )
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.add_column(sa.Column("blob_hash", sa.String(), nullable=True))
+        batch_op.create_index(batch_op.f("ix_items_blob_hash"), ["blob_hash"], unique=False)
+        batch_op.create_foreign_key("fk_items_blob_hash_blobs", "blobs", ["blob_hash"], ["hash"])
+
+    bind = op.get_bind()
+    update_item = (
+        items.update()
+        .where(items.c.id == sa.bindparam("b_id"))
+        .values(encrypted_data=None, blob_hash=sa.bindparam("b_hash"))
+    )
+    last_id = -1
+    while True:
+        rows = bind.execute(
+            sa.select(items.c.id, items.c.encrypted_data)
+            .where(items.c.id > last_id)
+            .where(items.c.encrypted_data.is_not(None))
+            .order_by(items.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if len(rows) == 0:
+            break
+
+        payloads = {sha256(row[1]).hexdigest(): row[1] for row in rows}
+        existing = set(
+            bind.execute(sa.select(blobs.c.hash).where(blobs.c.hash.in_(payloads.keys())))
+            .scalars()
+            .all()
+        )
+        new_blobs = [
+            {"hash": hash, "data": data, "size": len(data), "refcount": 0}
+            for hash, data in payloads.items()
+            if hash not in existing
+        ]
+        if len(new_blobs) > 0:
+            bind.execute(blobs.insert(), new_blobs)
+        bind.execute(
+            update_item, [{"b_id": row[0], "b_hash": sha256(row[1]).hexdigest()} for row in rows]
+        )
+
+        last_id = rows[-1][0]
+
+    source = items.alias("source")
+    bind.execute(
+        items.update()
+        .where(items.c.blob_hash.is_(None))
+        .where(items.c.id.in_(sa.select(shares.c.item_id)))
+        .values(
+            blob_hash=sa.select(source.c.blob_hash)
+            .where(source.c.id == shares.c.source_item_id)
+            .where(shares.c.item_id == items.c.id)
+            .scalar_subquery()
+        )
+    )
+    bind.execute(
+        blobs.update().values(
+            refcount=sa.select(sa.func.count(items.c.id))
+            .where(items.c.blob_hash == blobs.c.hash)
+            .scalar_subquery()
+        )
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        items.update()
+        .where(items.c.blob_hash.is_not(None))
+        .values(
+            encrypted_data=sa.select(blobs.c.data)
+            .where(blobs.c.hash == items.c.blob_hash)
+            .scalar_subquery()
+        )
+    )
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.drop_constraint("fk_items_blob_hash_blobs", type_="foreignkey")
+        batch_op.drop_index(batch_op.f("ix_items_blob_hash"))
+        batch_op.drop_column("blob_hash")
+    op.drop_table("blobs")
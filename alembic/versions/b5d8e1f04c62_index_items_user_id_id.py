@@ -0,0 +1,22 @@
+"""Index items on (user_id, id)
+
+Revision ID: b5d8e1f04c62
+Revises: 7a2b9e4c5d10
+Create Date: 2026-10-18 14:02:53.730418
+
+"""
+from alembic import op
+
+
+revision = "b5d8e1f04c62"
+down_revision = "7a2b9e4c5d10"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_items_user_id_id", "items", ["user_id", "id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_items_user_id_id", table_name="items")
@@ -0,0 +1,65 @@
+"""Record the changes of the items in a change feed
+
+The existing items are given an event, in the order of their ids,
+so that a first synchronization from sequence number 0 lists them all.
+
+Revision ID: b7e2c4f9a613
+Revises: d3f8a5c1b942
+Create Date: 2026-10-18 23:37:52.904611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "b7e2c4f9a613"
+down_revision = "d3f8a5c1b942"
+branch_labels = None
+depends_on = None
+
+items = sa.table("items", sa.column("id", sa.Integer), sa.column("user_id", sa.Integer))
+shares = sa.table("shares", sa.column("item_id", sa.Integer))
+item_changes = sa.table(
+    "item_changes",
+    sa.column("user_id", sa.Integer),
+    sa.column("item_id", sa.Integer),
+    sa.column("kind", sa.String),
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "item_changes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("item_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column(
+            "time_created",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_item_changes_user_id_id", "item_changes", ["user_id", "id"], unique=False)
+
+    kind = sa.case(
+        (items.c.id.in_(sa.select(shares.c.item_id)), sa.literal("shared")),
+        else_=sa.literal("created"),
+    )
+    op.execute(
+        item_changes.insert().from_select(
+            ["user_id", "item_id", "kind"],
+            sa.select(items.c.user_id, items.c.id, kind).order_by(items.c.id),
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_item_changes_user_id_id", table_name="item_changes")
+    op.drop_table("item_changes")
@@ -0,0 +1,35 @@
+"""Store the cfrags of items shared with a M of N threshold
+
+Revision ID: c81f4a9d2e35
+Revises: b5d8e1f04c62
+Create Date: 2026-10-18 16:21:07.184532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c81f4a9d2e35"
+down_revision = "b5d8e1f04c62"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "item_cfrags",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("item_id", sa.Integer(), nullable=False),
+        sa.Column("cfrag", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["item_id"],
+            ["items.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_item_cfrags_item_id"), "item_cfrags", ["item_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_item_cfrags_item_id"), table_name="item_cfrags")
+    op.drop_table("item_cfrags")
@@ -0,0 +1,55 @@
+"""Keep the large blobs outside of the database
+
+Adds the external flag to the blobs table. The data of an external blob is
+stored in the directory given by BLOB_STORAGE_DIR.
+
+Revision ID: d3f8a5c1b942
+Revises: a6e0b7d4c923
+Create Date: 2026-10-18 22:41:07.183529
+
+"""
+import os
+from pathlib import Path
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d3f8a5c1b942"
+down_revision = "a6e0b7d4c923"
+branch_labels = None
+depends_on = None
+
+blobs = sa.table(
+    "blobs",
+    sa.column("hash", sa.String),
+    sa.column("data", sa.LargeBinary),
+    sa.column("external", sa.Boolean),
+)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("blobs") as batch_op:
+        batch_op.add_column(
+            sa.Column("external", sa.Boolean(), nullable=False, server_default=sa.false())
+        )
+        batch_op.alter_column("data", existing_type=sa.LargeBinary(), nullable=True)
+
+
+def downgrade() -> None:
+    # The external blobs are read back into the database, one at a time
+    bind = op.get_bind()
+    hashes = bind.execute(sa.select(blobs.c.hash).where(blobs.c.external)).scalars().all()
+    if len(hashes) > 0:
+        root = os.environ.get("BLOB_STORAGE_DIR", "")
+        if root == "":
+            raise AssertionError("External blobs are stored, set BLOB_STORAGE_DIR to downgrade")
+        for hash in hashes:
+            data = (Path(root) / hash[:2] / hash[2:4] / hash).read_bytes()
+            bind.execute(
+                blobs.update().where(blobs.c.hash == hash).values(data=data, external=False)
+            )
+
+    with op.batch_alter_table("blobs") as batch_op:
+        batch_op.alter_column("data", existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_column("external")
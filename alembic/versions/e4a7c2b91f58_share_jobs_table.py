@@ -0,0 +1,52 @@
+"""Queue the shares re-encrypted by the proxy workers
+
+Revision ID: e4a7c2b91f58
+Revises: c81f4a9d2e35
+Create Date: 2026-10-18 17:46:32.509817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e4a7c2b91f58"
+down_revision = "c81f4a9d2e35"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "share_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("recipient_id", sa.Integer(), nullable=False),
+        sa.Column("source_item_id", sa.Integer(), nullable=False),
+        sa.Column("kfrags", sa.JSON(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("worker", sa.String(), nullable=True),
+        sa.Column("time_claimed", sa.Float(), nullable=True),
+        sa.Column("item_id", sa.Integer(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column(
+            "time_created",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(
+            ["sender_id"],
+            ["users.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["recipient_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_share_jobs_status"), "share_jobs", ["status"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_share_jobs_status"), table_name="share_jobs")
+    op.drop_table("share_jobs")
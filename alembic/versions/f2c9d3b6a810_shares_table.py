@@ -0,0 +1,82 @@
+"""Share items without copying their ciphertext
+
+Revision ID: f2c9d3b6a810
+Revises: e4a7c2b91f58
+Create Date: 2026-10-18 19:12:44.062391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f2c9d3b6a810"
+down_revision = "e4a7c2b91f58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "shares",
+        sa.Column("item_id", sa.Integer(), nullable=False),
+        sa.Column("source_item_id", sa.Integer(), nullable=False),
+        sa.Column("recipient_id", sa.Integer(), nullable=False),
+        sa.Column("cfrag", sa.LargeBinary(), nullable=True),
+        sa.Column("sender_pkey", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["item_id"],
+            ["items.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["source_item_id"],
+            ["items.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["recipient_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("item_id"),
+    )
+    op.create_index(op.f("ix_shares_source_item_id"), "shares", ["source_item_id"], unique=False)
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("encrypted_data", existing_type=sa.LargeBinary(), nullable=True)
+
+
+def downgrade() -> None:
+    # The shared items get back a copy of the ciphertext, cfrag and sender_pkey
+    items = sa.table(
+        "items",
+        sa.column("id", sa.Integer),
+        sa.column("encrypted_data", sa.LargeBinary),
+        sa.column("cfrag", sa.LargeBinary),
+        sa.column("sender_pkey", sa.LargeBinary),
+    )
+    source = items.alias("source")
+    shares = sa.table(
+        "shares",
+        sa.column("item_id", sa.Integer),
+        sa.column("source_item_id", sa.Integer),
+        sa.column("cfrag", sa.LargeBinary),
+        sa.column("sender_pkey", sa.LargeBinary),
+    )
+    op.execute(
+        items.update()
+        .where(items.c.id.in_(sa.select(shares.c.item_id)))
+        .values(
+            encrypted_data=sa.select(source.c.encrypted_data)
+            .where(source.c.id == shares.c.source_item_id)
+            .where(shares.c.item_id == items.c.id)
+            .scalar_subquery(),
+            cfrag=sa.select(shares.c.cfrag)
+            .where(shares.c.item_id == items.c.id)
+            .scalar_subquery(),
+            sender_pkey=sa.select(shares.c.sender_pkey)
+            .where(shares.c.item_id == items.c.id)
+            .scalar_subquery(),
+        )
+    )
+
+    with op.batch_alter_table("items") as batch_op:
+        batch_op.alter_column("encrypted_data", existing_type=sa.LargeBinary(), nullable=False)
+    op.drop_index(op.f("ix_shares_source_item_id"), table_name="shares")
+    op.drop_table("shares")
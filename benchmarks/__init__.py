@@ -0,0 +1,34 @@
+"""Micro-benchmarks of the transcoding and cryptographic primitives.
+
+They run offline, without server nor database:
+
+    python -m benchmarks run
+    python -m benchmarks run --pattern Encrypt --max-size 1000000
+
+The results are written as JSON in build/benchmarks/<commit>.json.
+Two runs are compared on the median duration of each benchmark with:
+
+    python -m benchmarks compare build/benchmarks/<base>.json build/benchmarks/<head>.json
+
+which exits with status 1 if a benchmark got slower than the threshold.
+See `benchmarks.runner` for the way the benchmarks are written
+
+"""
+import os
+
+
+#: Sizes of the payloads (bytes)
+PAYLOAD_SIZES = [100, 10_000, 1_000_000, 100_000_000]
+
+
+def check_size(size: int):
+    """Skip a benchmark whose payload is larger than the BENCHMARK_MAX_SIZE
+    environment variable, when it is set. Meant to be called by setup
+
+    Args:
+        size: Size of the payload of the benchmark (bytes)
+
+    """
+    max_size = int(os.environ.get("BENCHMARK_MAX_SIZE", "0"))
+    if max_size > 0 and size > max_size:
+        raise NotImplementedError(f"Payload of {size} bytes above BENCHMARK_MAX_SIZE")
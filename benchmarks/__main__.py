@@ -0,0 +1,98 @@
+import json
+import os
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+import typer
+
+from .runner import compare as compare_results
+from .runner import run_suite
+
+
+tapp = typer.Typer()
+
+#: Directory holding the benchmark modules
+BENCHMARKS_DIR = Path(__file__).parent
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+@tapp.command()
+def run(
+    pattern: str = typer.Option("", help="Only run the benchmarks whose name contains this"),
+    output: Path = typer.Option(
+        None, help="JSON file of the results. Defaults to build/benchmarks/<commit>.json"
+    ),
+    repeat: int = typer.Option(5, help="Number of samples per benchmark"),
+    min_time: float = typer.Option(0.05, help="Minimum duration of a sample (s)"),
+    max_size: int = typer.Option(
+        0, help="Skip the payloads larger than this size (bytes), 0 to run all of them"
+    ),
+):
+    "Run the benchmarks, and save their results"
+    # Read by benchmarks.check_size
+    os.environ["BENCHMARK_MAX_SIZE"] = str(max_size)
+    console = Console(soft_wrap=True)
+
+    def _progress(key: str, stats: dict):
+        if stats is None:
+            console.print(f"{key}: skipped")
+        else:
+            console.print(f"{key}: {format_time(stats['median'])} (x{stats['number']})")
+
+    results = run_suite(
+        BENCHMARKS_DIR, pattern=pattern, repeat=repeat, min_time=min_time, progress=_progress
+    )
+
+    if output is None:
+        output = Path("build/benchmarks") / f"{results['commit'][:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"Results saved in {output}")
+
+
+@tapp.command()
+def compare(
+    base: Path = typer.Argument(..., help="Results of the reference run"),
+    head: Path = typer.Argument(..., help="Results of the new run"),
+    threshold: float = typer.Option(1.1, help="Ratio of the durations reported as a change"),
+):
+    "Compare the results of two runs. Exits with status 1 if a benchmark got slower"
+    with open(base) as f:
+        base_results = json.load(f)
+    with open(head) as f:
+        head_results = json.load(f)
+
+    rows = compare_results(base_results, head_results, threshold=threshold)
+
+    table = Table(title=f"{base_results['commit'][:12]} -> {head_results['commit'][:12]}")
+    table.add_column("Benchmark")
+    table.add_column("Base", justify="right")
+    table.add_column("Head", justify="right")
+    table.add_column("Ratio", justify="right")
+    table.add_column("")
+    styles = {"slower": "red", "faster": "green", "": None}
+    for key, t_base, t_head, ratio, verdict in rows:
+        table.add_row(
+            key,
+            format_time(t_base),
+            format_time(t_head),
+            f"{ratio:.2f}",
+            verdict,
+            style=styles[verdict],
+        )
+    Console().print(table)
+
+    if any(row[4] == "slower" for row in rows):
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    tapp()
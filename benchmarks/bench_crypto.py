@@ -0,0 +1,134 @@
+import asyncio
+import os
+
+from network.backend import models
+from network.backend.crypto_executor import shutdown_executor
+from network.backend.Proxy import Proxy
+from network.backend.replay_store import MemoryReplayStore
+from network.frontend.User import User
+from network.schemas import UmbralMessage
+from network.transcoding import encodeKey, encrypted_to_raw, kfrag_to_json
+
+from . import PAYLOAD_SIZES, check_size
+
+
+class Encrypt(object):
+    """Encryption of an item, and its decryption by its owner and by a user it is shared with"""
+
+    params = [PAYLOAD_SIZES]
+    param_names = ["size"]
+
+    def setup(self, size: int):
+        check_size(size)
+        self.alice = User()
+        self.bob = User()
+        self.plaintext = os.urandom(size)
+        self.message = self.alice.encrypt(self.plaintext)
+
+        kfrag = self.alice.generate_kfrags(self.bob.public_key, threshold=1, shares=1)[0]
+        self.shared = UmbralMessage(
+            capsule=self.message.capsule,
+            ciphertext=self.message.ciphertext,
+            cfrag=Proxy().reencrypt(self.message.capsule, kfrag),
+            sender_pkey=self.alice.public_key,
+        )
+
+    def time_encrypt(self, size: int):
+        self.alice.encrypt(self.plaintext)
+
+    def time_decrypt(self, size: int):
+        self.alice.decrypt(self.message)
+
+    def time_decrypt_shared(self, size: int):
+        self.bob.decrypt(self.shared)
+
+
+class Challenge(object):
+    """Building of the authentication challenges"""
+
+    def setup(self):
+        self.user = User()
+
+    def time_build_challenge(self):
+        self.user.build_challenge()
+
+
+class CheckChallenge(object):
+    """Check of the authentication challenges by the server, with an in-memory replay store.
+    The signature is verified in the pool of `network.backend.crypto_executor`, as in the server.
+    Each challenge can be checked once, so a fixed number of calls is timed
+    and the challenges are built beforehand
+
+    """
+
+    number = 10
+    repeat = 20
+
+    def setup(self):
+        user = User()
+        user.id = 1
+        self.db_user = models.DbUser(
+            id=user.id,
+            public_key=encodeKey(user.public_key),
+            verifying_key=encodeKey(user.verifying_key),
+        )
+        self.replay_store = MemoryReplayStore()
+        self.loop = asyncio.new_event_loop()
+        challenges = [user.build_challenge() for _ in range(self.number * self.repeat + 1)]
+        self.challenges = iter([challenge.split(":")[1:] for challenge in challenges])
+
+        # The first check starts the pool, and validates the setup
+        status = self._check()
+        if status["status"] != 200:
+            raise AssertionError(status["message"])
+
+    def teardown(self):
+        self.loop.close()
+        shutdown_executor()
+
+    def _check(self) -> dict:
+        b64_hash, b64_sign = next(self.challenges)
+        return self.loop.run_until_complete(
+            self.db_user.check_challenge(self.replay_store, b64_hash, b64_sign, timeout=3600)
+        )
+
+    def time_check_challenge(self):
+        self._check()
+
+
+class Reencrypt(object):
+    """Re-encryption of a capsule by the proxy"""
+
+    def setup(self):
+        alice = User()
+        bob = User()
+        message = alice.encrypt(b"Benchmark")
+        self.capsule = message.capsule
+        self.kfrag = alice.generate_kfrags(bob.public_key, threshold=1, shares=1)[0]
+        self.raw = encrypted_to_raw(message.capsule, message.ciphertext)
+        self.capsule_bytes = bytes(message.capsule)
+        self.db_kfrag = kfrag_to_json(self.kfrag)["kfrag"]
+        self.proxy = Proxy()
+
+    def time_reencrypt(self):
+        self.proxy.reencrypt(self.capsule, self.kfrag)
+
+    def time_reencrypt_for_db(self):
+        self.proxy.reencrypt_for_db(self.raw, self.db_kfrag)
+
+    def time_reencrypt_capsule_for_db(self):
+        self.proxy.reencrypt_capsule_for_db(self.capsule_bytes, self.db_kfrag)
+
+
+class GenerateKfrags(object):
+    """Generation of the kfrags of a M of N share, with M = N // 2 + 1"""
+
+    params = [[1, 3, 10]]
+    param_names = ["shares"]
+
+    def setup(self, shares: int):
+        self.alice = User()
+        self.bob_pkey = User().public_key
+
+    def time_generate_kfrags(self, shares: int):
+        self.alice.generate_kfrags(self.bob_pkey, threshold=shares // 2 + 1, shares=shares)
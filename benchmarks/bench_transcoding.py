@@ -0,0 +1,119 @@
+from datetime import datetime
+import os
+
+from umbral import SecretKey, Signer, encrypt, generate_kfrags, pre
+
+from network.transcoding import (
+    cfrag_to_json,
+    cfrag_to_raw,
+    challenge_to_datetime,
+    datetime_to_challenge,
+    db_bytes_to_cfrag,
+    db_bytes_to_encrypted,
+    db_bytes_to_kfrag,
+    decodeKey,
+    encodeKey,
+    encrypted_to_json,
+    encrypted_to_raw,
+    kfrag_to_json,
+    pack_sized,
+    raw_to_cfrag,
+    raw_to_encrypted,
+    unpack_sized,
+)
+
+from . import PAYLOAD_SIZES, check_size
+
+
+class EncryptedData(object):
+    """Conversions of an encrypted item between umbral objects and database values"""
+
+    params = [PAYLOAD_SIZES]
+    param_names = ["size"]
+
+    def setup(self, size: int):
+        check_size(size)
+        capsule, _ = encrypt(SecretKey.random().public_key(), b"")
+        self.capsule = capsule
+        self.ciphertext = os.urandom(size)
+        self.raw = encrypted_to_raw(capsule, self.ciphertext)
+        self.db_data = encrypted_to_json(capsule, self.ciphertext)["encrypted_data"]
+
+    def time_pack_sized(self, size: int):
+        pack_sized(bytes(self.capsule), self.ciphertext)
+
+    def time_unpack_sized(self, size: int):
+        unpack_sized(self.raw, 2)
+
+    def time_encrypted_to_raw(self, size: int):
+        encrypted_to_raw(self.capsule, self.ciphertext)
+
+    def time_raw_to_encrypted(self, size: int):
+        raw_to_encrypted(self.raw)
+
+    def time_encrypted_to_json(self, size: int):
+        encrypted_to_json(self.capsule, self.ciphertext)
+
+    def time_db_bytes_to_encrypted(self, size: int):
+        db_bytes_to_encrypted(self.db_data)
+
+
+class Frags(object):
+    """Conversions of the kfrags and cfrags, whose size is fixed"""
+
+    def setup(self):
+        alice_sk = SecretKey.random()
+        bob_sk = SecretKey.random()
+        self.kfrag = generate_kfrags(
+            delegating_sk=alice_sk,
+            receiving_pk=bob_sk.public_key(),
+            signer=Signer(SecretKey.random()),
+            threshold=1,
+            shares=1,
+        )[0]
+        capsule, _ = encrypt(alice_sk.public_key(), b"")
+        self.cfrag = pre.reencrypt(capsule=capsule, kfrag=self.kfrag)
+
+        self.db_kfrag = kfrag_to_json(self.kfrag)["kfrag"]
+        self.raw_cfrag = cfrag_to_raw(self.cfrag)
+        self.db_cfrag = cfrag_to_json(self.cfrag)["cfrag"]
+
+    def time_kfrag_to_json(self):
+        kfrag_to_json(self.kfrag)
+
+    def time_db_bytes_to_kfrag(self):
+        db_bytes_to_kfrag(self.db_kfrag)
+
+    def time_cfrag_to_raw(self):
+        cfrag_to_raw(self.cfrag)
+
+    def time_raw_to_cfrag(self):
+        raw_to_cfrag(self.raw_cfrag)
+
+    def time_cfrag_to_json(self):
+        cfrag_to_json(self.cfrag)
+
+    def time_db_bytes_to_cfrag(self):
+        db_bytes_to_cfrag(self.db_cfrag)
+
+
+class Keys(object):
+    """Conversions of the public keys and of the challenge timestamps"""
+
+    def setup(self):
+        self.pkey = SecretKey.random().public_key()
+        self.db_key = encodeKey(self.pkey)
+        self.dt = datetime.now()
+        _, self.b64_hash = datetime_to_challenge(self.dt)
+
+    def time_encodeKey(self):
+        encodeKey(self.pkey)
+
+    def time_decodeKey(self):
+        decodeKey(self.db_key)
+
+    def time_datetime_to_challenge(self):
+        datetime_to_challenge(self.dt)
+
+    def time_challenge_to_datetime(self):
+        challenge_to_datetime(self.b64_hash)
@@ -0,0 +1,291 @@
+"""Discovery, timing and comparison of the benchmarks.
+
+A benchmark module is a file benchmarks/bench_*.py. It defines classes whose methods
+named time_* are the benchmarks, in the way of airspeed velocity (asv).
+The following class attributes are read:
+
+* params: List of the lists of values of the parameters of the benchmarks.
+  A benchmark is run for each combination of values, which are given to setup and to time_*
+* param_names: Names of the parameters
+* number: Number of calls timed by one sample. 0 (default) to choose it so that
+  a sample lasts at least the minimum sample time
+* repeat: Number of samples, the default one of `run_suite` if not set
+
+The setup and teardown methods, if defined, are called once per combination of parameters,
+and are not timed. A setup raising `NotImplementedError` skips the combination
+
+"""
+import importlib
+from itertools import product
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import umbral
+
+from network import get_network_version
+
+
+#: Version of the format of the results files
+RESULTS_VERSION = 1
+
+
+def discover(root: Path, pattern: str = "") -> Iterator[Tuple[str, type, str]]:
+    """List the benchmarks defined in a directory
+
+    Args:
+        root: The directory holding the bench_*.py modules
+        pattern: Only list the benchmarks whose name contains this string
+
+    Yields:
+        The name of the benchmark, its class and the name of its method
+
+    """
+    for path in sorted(Path(root).glob("bench_*.py")):
+        module = importlib.import_module(f"benchmarks.{path.stem}")
+        for cls_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for method in sorted(dir(cls)):
+                if not method.startswith("time_"):
+                    continue
+                name = f"{path.stem}.{cls_name}.{method}"
+                if pattern in name:
+                    yield name, cls, method
+
+
+def param_combinations(cls: type) -> List[tuple]:
+    """Get the combinations of parameters of the benchmarks of a class
+
+    Args:
+        cls: The class
+
+    Returns:
+        The combinations, a single empty one if the class has no params
+
+    """
+    params = getattr(cls, "params", [])
+    if len(params) > 0 and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    return list(product(*params))
+
+
+def time_function(
+    func: Callable, number: int, repeat: int, min_time: float
+) -> Tuple[int, List[float]]:
+    """Time a function
+
+    Args:
+        func: The function, called without argument
+        number: Number of calls timed by one sample, 0 to choose it
+            so that a sample lasts at least min_time
+        repeat: Number of samples
+        min_time: Minimum duration of a sample when number is 0 (s)
+
+    Returns:
+        The number of calls per sample
+        The duration of one call in each sample (s)
+
+    """
+
+    def _sample(n: int) -> float:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            func()
+        return time.perf_counter() - t0
+
+    if number == 0:
+        # Same progression as timeit.Timer.autorange. Also warms the caches up
+        scale = 1
+        while number == 0:
+            for n in (scale, 2 * scale, 5 * scale):
+                if _sample(n) >= min_time:
+                    number = n
+                    break
+            scale *= 10
+
+    samples = [_sample(number) / number for _ in range(repeat)]
+    return number, samples
+
+
+def run_benchmark(
+    cls: type, method: str, params: tuple, repeat: int, min_time: float
+) -> Union[dict, None]:
+    """Run a benchmark for one combination of parameters
+
+    Args:
+        cls: The class defining the benchmark
+        method: The name of the time_* method
+        params: The values of the parameters
+        repeat: Number of samples, if the class does not give it
+        min_time: Minimum duration of a sample (s)
+
+    Returns:
+        The statistics of the duration of one call (s), or None if the combination is skipped
+
+    """
+    bench = cls()
+    try:
+        if hasattr(bench, "setup"):
+            bench.setup(*params)
+    except NotImplementedError:
+        return None
+
+    try:
+        func = getattr(bench, method)
+        number, samples = time_function(
+            lambda: func(*params),
+            number=getattr(cls, "number", 0),
+            repeat=getattr(cls, "repeat", repeat),
+            min_time=min_time,
+        )
+    finally:
+        if hasattr(bench, "teardown"):
+            bench.teardown(*params)
+
+    return {
+        "number": number,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "samples": samples,
+    }
+
+
+def benchmark_key(name: str, cls: type, params: tuple) -> str:
+    """Build the key of a benchmark in the results file
+
+    Args:
+        name: The name of the benchmark
+        cls: The class defining the benchmark
+        params: The values of the parameters
+
+    Returns:
+        The key, e.g. bench_crypto.Encrypt.time_encrypt(size=100)
+
+    """
+    if len(params) == 0:
+        return name
+
+    names = getattr(cls, "param_names", [f"p{i}" for i in range(len(params))])
+    args = ", ".join(f"{n}={v!r}" for n, v in zip(names, params))
+    return f"{name}({args})"
+
+
+def get_commit() -> str:
+    """Get the git commit of the working tree, suffixed with '-dirty' if it has changes
+
+    Returns:
+        The commit, or 'unknown' outside of a git repository
+
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return commit + ("-dirty" if status.strip() != "" else "")
+
+
+def get_machine() -> dict:
+    """Describe the machine and the environment running the benchmarks
+
+    Returns:
+        A dictionary with keys node, platform, processor, cpu_count, python, umbral and network
+
+    """
+    return {
+        "node": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "umbral": getattr(umbral, "__version__", "unknown"),
+        "network": get_network_version(),
+    }
+
+
+def run_suite(
+    root: Path,
+    pattern: str = "",
+    repeat: int = 5,
+    min_time: float = 0.05,
+    progress: Callable[[str, Union[dict, None]], None] = None,
+) -> dict:
+    """Run the benchmarks defined in a directory
+
+    Args:
+        root: The directory holding the bench_*.py modules
+        pattern: Only run the benchmarks whose name contains this string
+        repeat: Number of samples of the benchmarks that do not give it
+        min_time: Minimum duration of a sample (s)
+        progress: Called with the key and the statistics of each benchmark once it has run
+
+    Returns:
+        A dictionary with keys version, commit, date, machine and results, the latter
+        giving the statistics of each benchmark, see `run_benchmark`
+
+    """
+    results: Dict[str, dict] = {}
+    for name, cls, method in discover(root, pattern):
+        for params in param_combinations(cls):
+            key = benchmark_key(name, cls, params)
+            stats = run_benchmark(cls, method, params, repeat=repeat, min_time=min_time)
+            if stats is not None:
+                results[key] = stats
+            if progress is not None:
+                progress(key, stats)
+
+    return {
+        "version": RESULTS_VERSION,
+        "commit": get_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": get_machine(),
+        "results": results,
+    }
+
+
+def compare(
+    base: dict, head: dict, threshold: float = 1.1
+) -> List[Tuple[str, float, float, float, str]]:
+    """Compare the results of two runs, on their median durations
+
+    Args:
+        base: The reference results, as returned by `run_suite`
+        head: The new results
+        threshold: Ratio of the durations above which a benchmark is considered
+            as slower, and below whose inverse it is considered as faster
+
+    Returns:
+        For each benchmark of both runs, its key, its median durations in base and head (s),
+        the ratio head / base and the verdict: 'slower', 'faster' or ''
+
+    """
+    rows = []
+    for key in sorted(set(base["results"]) & set(head["results"])):
+        t_base = base["results"][key]["median"]
+        t_head = head["results"][key]["median"]
+        ratio = t_head / t_base if t_base > 0 else float("inf")
+        if ratio > threshold:
+            verdict = "slower"
+        elif ratio < 1 / threshold:
+            verdict = "faster"
+        else:
+            verdict = ""
+        rows.append((key, t_base, t_head, ratio, verdict))
+
+    return rows
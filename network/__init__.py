@@ -24,6 +24,29 @@ Once the tests ran, the reports are generated. See the links below:
 
 [See coverage](../coverage/index.html)
 
+# Benchmarks
+
+The micro-benchmarks of the transcoding and cryptographic primitives are in the benchmarks
+folder. They are run offline, and their results saved in build/benchmarks/<commit>.json:
+
+    pdm bench
+
+Two runs are compared with:
+
+    python -m benchmarks compare build/benchmarks/<base>.json build/benchmarks/<head>.json
+
+# Load test
+
+The loadtest command creates users on a server, and drives it with a mix of uploads,
+reads, lists, shares and deletions. It reports the throughput and the latency percentiles
+of each operation and of each endpoint:
+
+    network_server loadtest --users 50 --operations 10000 --concurrency 64
+
+By default, a server is started in the same process on the database given by DATABASE_URI.
+To measure a server alone, e.g. with several workers, start it with run-server and give
+its --server-url and the --admin-key of one of its admins.
+
 # Building distribution
 
 The following command builds a wheel file in the dist folder:
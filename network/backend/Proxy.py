@@ -1,5 +1,7 @@
 from umbral import pre, VerifiedKeyFrag, VerifiedCapsuleFrag, Capsule
 
+from ..transcoding import cfrag_to_raw, db_bytes_to_kfrag, raw_to_encrypted
+
 
 class Proxy(object):
     """Proxy that can reencrypt a message sent by Alice to Bob,
@@ -23,3 +25,33 @@ class Proxy(object):
         """
         cfrag = pre.reencrypt(capsule=capsule, kfrag=kfrag)
         return cfrag
+
+    def reencrypt_for_db(self, encrypted_data: bytes, db_kfrag: str) -> bytes:
+        """Reencrypt an item as stored in the database
+
+        Args:
+            encrypted_data: The binary database value of the item
+            db_kfrag: The kfrag, as given by `network.frontend.User.User.generate_kfrags_for_db`
+
+        Returns:
+            The binary database value of the VerifiedCapsuleFrag
+
+        """
+        capsule, _ = raw_to_encrypted(encrypted_data)
+        return self.reencrypt_capsule_for_db(bytes(capsule), db_kfrag)
+
+    def reencrypt_capsule_for_db(self, capsule_bytes: bytes, db_kfrag: str) -> bytes:
+        """Reencrypt the capsule of an item, without the rest of its binary database value
+
+        Args:
+            capsule_bytes: The bytes of the capsule
+            db_kfrag: The kfrag, as given by `network.frontend.User.User.generate_kfrags_for_db`
+
+        Returns:
+            The binary database value of the VerifiedCapsuleFrag
+
+        """
+        capsule = Capsule.from_bytes(capsule_bytes)
+        kfrag = db_bytes_to_kfrag(db_kfrag)
+        cfrag = self.reencrypt(capsule, kfrag)
+        return cfrag_to_raw(cfrag)
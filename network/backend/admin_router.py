@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas
+from . import blob_store
+from .models import get_db
+from .auth_depend import challenge_auth
+from .user_cache import user_cache
+
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get(
+    "/blobs",
+    response_model=schemas.BlobStatsModel,
+    description="Reports the deduplication achieved by the blob store",
+)
+async def get_blob_stats(
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    issuer = await user_cache.load(db, user_id)
+    if issuer is None:
+        # The user has been deleted since the authentication
+        raise HTTPException(
+            status_code=401, detail="The user making the challenge could not be found"
+        )
+
+    if not issuer.admin:
+        raise HTTPException(status_code=403, detail="Only an admin can read the storage statistics")
+
+    stats = await blob_store.get_stats(db)
+
+    return schemas.BlobStatsModel(**stats)
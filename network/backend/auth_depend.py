@@ -1,19 +1,57 @@
-from fastapi import Request, HTTPException
+from fastapi import Depends, Request, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models import DbUser, get_connection
+from .models import check_challenge, get_db
+from .replay_store import ReplayStore, get_replay_store
+from .session_token import check_token
+from .user_cache import user_cache
 
 
 class ChallengeAuthentication(object):
     """This class can be used as a fastapi Depends
     for the endpoints that needs authentication.
+    The request shall have either a Challenge header, or an Authorization header
+    with a session token built by `network.backend.session_token.mint_token`
 
     Args:
         challenge_timeout: Timeout for the challenge (s)
+        replay_store: Store of the challenges already used.
+            Defaults to the one given by `network.backend.replay_store.get_replay_store`
+        accept_token: False to require a challenge, even if a session token is given
 
     """
 
-    def __init__(self, challenge_timeout: float):
+    def __init__(
+        self, challenge_timeout: float, replay_store: ReplayStore = None, accept_token: bool = True
+    ):
         self.challenge_timeout = challenge_timeout
+        if replay_store is None:
+            replay_store = get_replay_store()
+        self.replay_store = replay_store
+        self.accept_token = accept_token
+
+    @staticmethod
+    def analyse_token(headers: dict) -> dict:
+        """Analyse headers to find a session token, given as 'Authorization: Bearer <token>'.
+        If found and valid, return a dictionary whose key is:
+
+        * user_id: The id of the authenticating user
+
+        If not found, return an empty dictionary
+
+        Args:
+            headers: The headers dictionary as contained in fastapi Request objects
+
+        Returns:
+            The result of the check as a dictionary
+
+        """
+        authorization = headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or token == "":
+            return {}
+
+        return check_token(token)
 
     @staticmethod
     def analyse_header(headers: dict) -> dict:
@@ -58,7 +96,19 @@ class ChallengeAuthentication(object):
 
         return response
 
-    async def __call__(self, request: Request) -> int:
+    async def __call__(self, request: Request, db: AsyncSession = Depends(get_db)) -> int:
+        if self.accept_token:
+            response = self.analyse_token(request.headers)
+            if "status" in response.keys():
+                raise HTTPException(status_code=response["status"], detail=response["message"])
+            elif "user_id" in response.keys():
+                # The token outlives the user if it is deleted
+                if await user_cache.load(db, response["user_id"]) is None:
+                    raise HTTPException(
+                        status_code=401, detail="The user making the challenge could not be found"
+                    )
+                return response["user_id"]
+
         response = self.analyse_header(request.headers)
         if "status" in response.keys():
             raise HTTPException(status_code=response["status"], detail=response["message"])
@@ -67,24 +117,32 @@ class ChallengeAuthentication(object):
         b64_hash = response["b64_hash"]
         b64_sign = response["b64_sign"]
 
-        con = get_connection()
-        async with con() as session:
-            db_user: DbUser = await session.query(DbUser).filter(DbUser.id == user_id).first()
-            if db_user is None:
-                raise HTTPException(
-                    status_code=401, detail="The user making the challenge could not be found"
-                )
-
-            challenge_response = db_user.check_challenge(
-                session, b64_hash, b64_sign, timeout=self.challenge_timeout
+        cached_user = await user_cache.load(db, user_id)
+        if cached_user is None:
+            raise HTTPException(
+                status_code=401, detail="The user making the challenge could not be found"
             )
 
-            if challenge_response["status"] != 200:
-                raise HTTPException(
-                    status_code=challenge_response["status"], detail=challenge_response["message"]
-                )
+        challenge_response = await check_challenge(
+            self.replay_store,
+            user_id,
+            cached_user.verifying_key,
+            b64_hash,
+            b64_sign,
+            timeout=self.challenge_timeout,
+        )
+
+        if challenge_response["status"] != 200:
+            raise HTTPException(
+                status_code=challenge_response["status"], detail=challenge_response["message"]
+            )
 
         return user_id
 
 
 challenge_auth = ChallengeAuthentication(challenge_timeout=5)
+
+#: Same as `challenge_auth`, but refuses session tokens. Used to mint them
+challenge_only_auth = ChallengeAuthentication(
+    challenge_timeout=5, replay_store=challenge_auth.replay_store, accept_token=False
+)
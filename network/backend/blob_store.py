@@ -0,0 +1,494 @@
+"""Content addressed store of the ciphertexts of the items.
+
+Each distinct value of `encrypted_data` is stored once in the blobs table, keyed by its
+SHA-256 hash, with the number of items referencing it. Items uploaded twice or shared
+with several users reference the same blob, which is deleted once no item references it.
+
+The blobs larger than BLOB_INLINE_THRESHOLD bytes (default 1 MiB) are written outside
+of the database when the BLOB_STORAGE_DIR environment variable gives a directory,
+see `LocalBlobStorage`. Their row in the blobs table only keeps the metadata.
+The file of a blob is written and deleted under the lock given by `lock_blobs`, and only
+deleted if its row is still missing, so that a blob stored again while its last reference
+is being released keeps its file
+
+"""
+from abc import ABC, abstractmethod
+import asyncio
+from collections import Counter
+from hashlib import sha256
+import mmap
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import BinaryIO, Dict, List, Set, Union
+
+from sqlalchemy import delete, false, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+#: First key of the PostgreSQL advisory locks of the blobs, see `lock_blobs`
+BLOB_LOCK = 0x626C6F62
+
+
+class BlobStorage(ABC):
+    """Base class of the stores of the blobs kept outside of the database"""
+
+    @abstractmethod
+    def path(self, hash: str) -> Path:
+        """Get the path of the file holding a blob, to be served with a `FileResponse`
+
+        Args:
+            hash: The key of the blob
+
+        Returns:
+            The path of the file
+
+        """
+
+    @abstractmethod
+    def write(self, hash: str, data: Union[bytes, BinaryIO]):
+        """Store a blob. A blob that is already stored is replaced atomically
+
+        Args:
+            hash: The key of the blob
+            data: The content of the blob, or a binary file-like object to copy it from
+
+        """
+
+    @abstractmethod
+    def read(self, hash: str) -> mmap.mmap:
+        """Map a blob in memory, without reading it
+
+        Args:
+            hash: The key of the blob
+
+        Returns:
+            A read only memory map of the blob
+
+        """
+
+    @abstractmethod
+    def delete(self, hash: str):
+        """Delete a blob, if it is stored
+
+        Args:
+            hash: The key of the blob
+
+        """
+
+
+class LocalBlobStorage(BlobStorage):
+    """Store of blobs in a local directory, sharded in two levels of subdirectories
+    named after the first 4 hexadecimal digits of the hash of the blobs
+
+    Args:
+        root: The directory holding the blobs
+
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, hash: str) -> Path:
+        return self.root / hash[:2] / hash[2:4] / hash
+
+    def write(self, hash: str, data: bytes):
+        path = self.path(hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers never see a partial file, even if several requests store the same blob
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if hasattr(data, "read"):
+                    shutil.copyfileobj(data, f)
+                else:
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self, hash: str) -> mmap.mmap:
+        with open(self.path(hash), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def delete(self, hash: str):
+        try:
+            self.path(hash).unlink()
+        except FileNotFoundError:
+            pass
+
+
+#: Stores built by this process, indexed by directory
+_storages: Dict[str, BlobStorage] = {}
+
+
+def get_blob_storage() -> Union[BlobStorage, None]:
+    """Get the store of the blobs kept outside of the database,
+    whose directory is read from the BLOB_STORAGE_DIR environment variable
+
+    Returns:
+        The store, or None if BLOB_STORAGE_DIR is not set
+
+    """
+    root = os.environ.get("BLOB_STORAGE_DIR", "")
+    if root == "":
+        return None
+
+    if root not in _storages:
+        _storages[root] = LocalBlobStorage(Path(root))
+    return _storages[root]
+
+
+def get_external_storage(hash: str) -> BlobStorage:
+    """Get the store of an external blob
+
+    Args:
+        hash: The key of the blob
+
+    Returns:
+        The store
+
+    """
+    storage = get_blob_storage()
+    if storage is None:
+        raise AssertionError(f"Blob {hash} is stored outside of the database, set BLOB_STORAGE_DIR")
+    return storage
+
+
+def get_inline_threshold() -> int:
+    """Get the size above which the blobs are kept outside of the database,
+    read from the BLOB_INLINE_THRESHOLD environment variable
+
+    Returns:
+        The size (bytes)
+
+    """
+    return int(os.environ.get("BLOB_INLINE_THRESHOLD", str(1 << 20)))
+
+
+class BlobUpload(object):
+    """Ciphertext received in chunks, e.g. the body of a raw upload.
+    It is hashed as it is received, and spooled to a temporary file once larger
+    than the inline threshold, so that a large upload is not held in memory
+
+    """
+
+    def __init__(self):
+        #: Number of bytes received
+        self.size = 0
+        self._sha256 = sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=get_inline_threshold())
+
+    @property
+    def hash(self) -> str:
+        """The key of the ciphertext in the blob store, see `blob_hash`"""
+        return self._sha256.hexdigest()
+
+    def write(self, chunk: bytes):
+        """Append a chunk to the ciphertext
+
+        Args:
+            chunk: The chunk
+
+        """
+        self._sha256.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def read(self, offset: int = 0, size: int = -1) -> bytes:
+        """Read a part of the ciphertext
+
+        Args:
+            offset: Position of the first byte read
+            size: Number of bytes read, -1 to read up to the end
+
+        Returns:
+            The bytes read
+
+        """
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def open(self) -> BinaryIO:
+        """Get a file-like object to read the ciphertext from its start
+
+        Returns:
+            The file-like object
+
+        """
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        """Delete the temporary file"""
+        self._file.close()
+
+
+def read_payload(encrypted_data: Union[bytes, None], hash: Union[str, None]):
+    """Get the ciphertext of an item, from the database or from the store of external blobs
+
+    Args:
+        encrypted_data: The ciphertext read from the database, None for an external blob
+        hash: The key of the blob of the item
+
+    Returns:
+        The ciphertext, as bytes or as a read only memory map
+
+    """
+    if encrypted_data is not None or hash is None:
+        return encrypted_data
+
+    return get_external_storage(hash).read(hash)
+
+
+def blob_hash(encrypted_data: bytes) -> str:
+    """Compute the key of a ciphertext in the blob store
+
+    Args:
+        encrypted_data: Capsule and ciphertext, as given by `network.transcoding.encrypted_to_raw`
+
+    Returns:
+        The hexadecimal SHA-256 hash of the ciphertext
+
+    """
+    return sha256(encrypted_data).hexdigest()
+
+
+async def add_references(db: AsyncSession, hashes: List[str], sign: int = 1) -> Set[str]:
+    """Count new references to blobs already in the store.
+    One UPDATE is run per distinct number of references added
+
+    Args:
+        db: The database session
+        hashes: The keys of the blobs, repeated once per new reference
+        sign: -1 to remove the references instead
+
+    Returns:
+        The keys of the blobs whose references have been counted, i.e. the ones still in the
+        store, which may have been deleted by another transaction since they were looked up.
+        Only computed when adding references
+
+    """
+    by_count: Dict[int, List[str]] = {}
+    for hash, count in Counter(hashes).items():
+        by_count.setdefault(count, []).append(hash)
+
+    found: Set[str] = set()
+    for count, lhash in by_count.items():
+        stmt = (
+            update(models.Blob)
+            .where(models.Blob.hash.in_(lhash))
+            .values(refcount=models.Blob.refcount + sign * count)
+        )
+        if sign < 0:
+            await db.execute(stmt)
+        elif db.bind.dialect.full_returning:
+            stmt = stmt.returning(models.Blob.hash)
+            found.update((await db.execute(stmt)).scalars().all())
+        else:
+            await db.execute(stmt)
+            # The UPDATE took the write lock of the database (SQLite):
+            # the blobs cannot be deleted by another transaction anymore
+            found.update(await existing_blobs(db, lhash))
+
+    return found
+
+
+async def existing_blobs(db: AsyncSession, hashes: List[str]) -> Set[str]:
+    """Find the blobs that are in the store
+
+    Args:
+        db: The database session
+        hashes: The keys of the blobs
+
+    Returns:
+        The keys of the blobs in the store
+
+    """
+    stmt = select(models.Blob.hash).where(models.Blob.hash.in_(set(hashes)))
+    return set((await db.execute(stmt)).scalars().all())
+
+
+async def reference_blobs(db: AsyncSession, payloads: List[Union[bytes, BlobUpload]]) -> List[str]:
+    """Store ciphertexts, or count one more reference for the ones already stored.
+    The ciphertexts already stored are not sent again to the database
+
+    Args:
+        db: The database session
+        payloads: The ciphertexts. A `BlobUpload` stored outside of the database
+            is copied to its file without being read in memory
+
+    Returns:
+        The keys of the ciphertexts, in the order of payloads
+
+    """
+    hashes = [
+        payload.hash if isinstance(payload, BlobUpload) else blob_hash(payload)
+        for payload in payloads
+    ]
+    if len(hashes) == 0:
+        return hashes
+
+    existing = await existing_blobs(db, hashes)
+    if len(existing) > 0:
+        # release_blobs may delete some of them before they are updated,
+        # in which case they are stored again below
+        existing = await add_references(db, [hash for hash in hashes if hash in existing])
+
+    counts = Counter(hash for hash in hashes if hash not in existing)
+    if len(counts) == 0:
+        return hashes
+
+    payload_by_hash = dict(zip(hashes, payloads))
+    storage = get_blob_storage()
+    threshold = get_inline_threshold()
+    values = []
+    files = []
+    for hash, count in counts.items():
+        data = payload_by_hash[hash]
+        size = data.size if isinstance(data, BlobUpload) else len(data)
+        external = storage is not None and size > threshold
+        if isinstance(data, BlobUpload):
+            data = data.open() if external else data.read()
+        if external:
+            files.append((hash, data))
+        values.append(
+            {
+                "hash": hash,
+                "data": None if external else data,
+                "size": size,
+                "refcount": count,
+                "external": external,
+            }
+        )
+
+    dialect = db.bind.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        # Another request may have stored the same ciphertext in the meantime
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(models.Blob).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Blob.hash],
+            set_={"refcount": models.Blob.refcount + stmt.excluded.refcount},
+        )
+    else:
+        stmt = insert(models.Blob).values(values)
+    await db.execute(stmt)
+
+    if len(files) > 0:
+        # The file of a blob whose last reference has just been released may be deleted
+        # by `delete_files` until the lock is taken: it is written again
+        await lock_blobs(db, [hash for hash, _ in files])
+        loop = asyncio.get_running_loop()
+        for hash, data in files:
+            await loop.run_in_executor(None, storage.write, hash, data)
+
+    return hashes
+
+
+async def release_blobs(db: AsyncSession, hashes: List[str]) -> List[str]:
+    """Remove references to blobs, and delete the blobs that are not referenced anymore.
+    The files of the external blobs are to be deleted with `delete_files`
+    once the transaction is committed
+
+    Args:
+        db: The database session
+        hashes: The keys of the blobs, repeated once per removed reference.
+            None values are ignored
+
+    Returns:
+        The keys of the external blobs deleted
+
+    """
+    hashes = [hash for hash in hashes if hash is not None]
+    if len(hashes) == 0:
+        return []
+
+    await add_references(db, hashes, sign=-1)
+    unused = (
+        models.Blob.hash.in_(set(hashes)),
+        models.Blob.refcount <= 0,
+    )
+    stmt = select(models.Blob.hash).where(*unused).where(models.Blob.external)
+    external = list((await db.execute(stmt)).scalars().all())
+    await db.execute(delete(models.Blob).where(*unused))
+
+    return external
+
+
+async def lock_blobs(db: AsyncSession, hashes: List[str]):
+    """Lock blobs until the end of the transaction, to serialize the writes
+    and the deletions of their files.
+    With PostgreSQL, an advisory lock is taken per blob, in the order of their keys.
+    With SQLite, the write lock of the database is taken by an UPDATE matching no row
+
+    Args:
+        db: The database session
+        hashes: The keys of the blobs
+
+    """
+    if db.bind.dialect.name == "postgresql":
+        for hash in sorted(set(hashes)):
+            # The second key is the first 32 bits of the hash, as a signed integer
+            key = int(hash[:8], 16) - (1 << 31)
+            await db.execute(select(func.pg_advisory_xact_lock(BLOB_LOCK, key)))
+    else:
+        await db.execute(update(models.Blob).where(false()).values(refcount=models.Blob.refcount))
+
+
+async def delete_files(db: AsyncSession, hashes: List[str]):
+    """Delete the files of external blobs deleted by `release_blobs`, once the transaction
+    is committed. The blobs stored again by another transaction in the meantime keep their file
+
+    Args:
+        db: The database session
+        hashes: The keys of the blobs
+
+    """
+    storage = get_blob_storage()
+    if storage is None or len(hashes) == 0:
+        return
+
+    await lock_blobs(db, hashes)
+    stored = await existing_blobs(db, hashes)
+    for hash in hashes:
+        if hash not in stored:
+            storage.delete(hash)
+    await db.commit()
+
+
+async def get_stats(db: AsyncSession) -> dict:
+    """Measure the deduplication achieved by the blob store
+
+    Args:
+        db: The database session
+
+    Returns:
+        A dictionary with the following keys:
+
+        * blobs: Number of blobs stored
+        * references: Number of items referencing a blob
+        * stored_bytes: Size of the blobs
+        * logical_bytes: Size the blobs would take if each item had its own copy
+        * dedup_ratio: logical_bytes / stored_bytes, 1 when the store is empty
+
+    """
+    stmt = select(
+        func.count(models.Blob.hash),
+        func.coalesce(func.sum(models.Blob.refcount), 0),
+        func.coalesce(func.sum(models.Blob.size), 0),
+        func.coalesce(func.sum(models.Blob.size * models.Blob.refcount), 0),
+    )
+    blobs, references, stored_bytes, logical_bytes = (await db.execute(stmt)).one()
+    return {
+        "blobs": blobs,
+        "references": references,
+        "stored_bytes": stored_bytes,
+        "logical_bytes": logical_bytes,
+        "dedup_ratio": logical_bytes / stored_bytes if stored_bytes > 0 else 1.0,
+    }
@@ -0,0 +1,94 @@
+"""Feed of the changes of the items of each user.
+
+Each creation, share, update or deletion of an item adds an event to the item_changes table,
+in the same transaction as the change. A client reads the events that occurred since its
+last synchronization, in the order of their sequence numbers, instead of listing all its
+items, see GET /item/changes and `network.frontend.User.User.sync`.
+
+With PostgreSQL, sequence numbers are allocated before the transactions commit, so a client
+could see a number before a smaller one and skip an event. As a client only reads the events
+of its user, the transactions recording events for the same user are serialized by a
+transaction level advisory lock per user, taken when the events are recorded, just before
+the commit.
+
+Once committed, the changes are pushed to the clients connected to GET /notifications
+by the notifier given by `network.backend.notifier.get_notifier`.
+
+"""
+from typing import List, Tuple
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .notifier import get_notifier
+
+
+#: First key of the PostgreSQL advisory locks serializing the transactions that record
+#: events for a user, whose id is the second key
+CHANGE_FEED_LOCK = 0x6E657477
+
+#: Key of the info dictionary of a session holding the changes waiting for the commit
+PENDING_CHANGES = "network_item_changes"
+
+
+async def record_changes(db: AsyncSession, changes: List[Tuple[int, int, str]]):
+    """Record changes of items in the current transaction, which shall be committed soon after
+
+    Args:
+        db: The database session
+        changes: For each change, the id of the owner of the item, the id of the item
+            and the kind of change, see `network.backend.models.ItemChange`
+
+    """
+    if len(changes) == 0:
+        return
+
+    if db.bind.dialect.name == "postgresql":
+        # In the order of the ids, so that two transactions cannot wait for each other
+        for user_id in sorted(set(user_id for user_id, _, _ in changes)):
+            await db.execute(select(func.pg_advisory_xact_lock(CHANGE_FEED_LOCK, user_id)))
+
+    values = [
+        {"user_id": user_id, "item_id": item_id, "kind": kind} for user_id, item_id, kind in changes
+    ]
+    await db.execute(insert(models.ItemChange).values(values))
+    await get_notifier().record(db, values)
+    db.sync_session.info.setdefault(PENDING_CHANGES, []).extend(values)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session):
+    changes = session.info.pop(PENDING_CHANGES, [])
+    if len(changes) > 0:
+        get_notifier().publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(PENDING_CHANGES, None)
+
+
+async def list_changes(db: AsyncSession, user_id: int, since: int, limit: int) -> List[Row]:
+    """List the changes of the items of a user
+
+    Args:
+        db: The database session
+        user_id: The id of the user
+        since: Only list the changes whose sequence number is greater than this one
+        limit: Maximum number of changes listed
+
+    Returns:
+        The changes, with seq, item_id and kind columns, in increasing order of seq
+
+    """
+    stmt = (
+        select(models.ItemChange.id.label("seq"), models.ItemChange.item_id, models.ItemChange.kind)
+        .where(models.ItemChange.user_id == user_id)
+        .where(models.ItemChange.id > since)
+        .order_by(models.ItemChange.id)
+        .limit(limit)
+    )
+    return list((await db.execute(stmt)).all())
@@ -1,85 +1,588 @@
-from typing import List, Union
+import asyncio
+from base64 import b64decode
+from hashlib import sha256
+from typing import Dict, List, Union
 
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
 
 from network.backend.Proxy import Proxy
 
-from . import models
+from . import blob_store, change_feed, models
+from .crypto_executor import run_crypto
 from .. import schemas
-from ..transcoding import cfrag_to_json, db_bytes_to_encrypted, db_bytes_to_kfrag
+from ..transcoding import unpack_sized
 
 
-def list_items(db: Session, user_id: int) -> List[int]:
-    lores = db.query(models.Item).filter(models.Item.user_id == user_id).all()
-    res = [ores.id for ores in lores]
+async def get_user(db: AsyncSession, user_id: int) -> Union[models.DbUser, None]:
+    stmt = select(models.DbUser).where(models.DbUser.id == user_id)
+    res = await db.execute(stmt)
+    return res.scalars().first()
+
+
+async def list_items(
+    db: AsyncSession, user_id: int, after_id: int = None, limit: int = None
+) -> List[int]:
+    stmt = select(models.Item.id).where(models.Item.user_id == user_id)
+    if after_id is not None:
+        stmt = stmt.where(models.Item.id > after_id)
+    stmt = stmt.order_by(models.Item.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    res = (await db.execute(stmt)).scalars().all()
+    return list(res)
+
+
+async def get_db_item(db: AsyncSession, item_id: int) -> Union[models.Item, None]:
+    stmt = select(models.Item).where(models.Item.id == item_id)
+    res = await db.execute(stmt)
+    return res.scalars().first()
+
+
+async def get_user_item(db: AsyncSession, user_id: int, item_id: int) -> Union[models.Item, None]:
+    stmt = (
+        select(models.Item).where(models.Item.user_id == user_id).where(models.Item.id == item_id)
+    )
+    res = await db.execute(stmt)
+    return res.scalars().first()
+
+
+def select_items_data() -> Select:
+    """Select the items with their data. The ciphertext is read from the blob store,
+    or from the source item of an item shared without copy before the blob store.
+    The cfrag and sender_pkey of a shared item are read from its share.
+    The selected rows have the id, user_id, encrypted_data, cfrag, sender_pkey, blob_hash
+    columns of an item, and the source_item_id column which is the id of the shared item
+
+    Returns:
+        The select statement, to be completed with where clauses
+
+    """
+    source = aliased(models.Item)
+    return (
+        select(
+            models.Item.id,
+            models.Item.user_id,
+            func.coalesce(
+                models.Item.encrypted_data, models.Blob.data, source.encrypted_data
+            ).label("encrypted_data"),
+            func.coalesce(models.Item.cfrag, models.Share.cfrag).label("cfrag"),
+            func.coalesce(models.Item.sender_pkey, models.Share.sender_pkey).label("sender_pkey"),
+            models.Item.blob_hash,
+            func.coalesce(models.Share.source_item_id, models.Item.id).label("source_item_id"),
+        )
+        .outerjoin(models.Blob, models.Blob.hash == models.Item.blob_hash)
+        .outerjoin(models.Share, models.Share.item_id == models.Item.id)
+        .outerjoin(source, source.id == models.Share.source_item_id)
+    )
+
+
+def read_item_payload(ores: Row):
+    """Get the ciphertext of an item selected by `select_items_data`,
+    which may be kept outside of the database, see `network.backend.blob_store`
+
+    Args:
+        ores: The selected row
+
+    Returns:
+        The ciphertext, as bytes or as a read only memory map
+
+    """
+    return blob_store.read_payload(ores.encrypted_data, ores.blob_hash)
+
+
+async def get_item_data(db: AsyncSession, item_id: int) -> Union[Row, None]:
+    stmt = select_items_data().where(models.Item.id == item_id)
+    return (await db.execute(stmt)).first()
+
+
+async def get_user_item_data(db: AsyncSession, user_id: int, item_id: int) -> Union[Row, None]:
+    stmt = (
+        select_items_data().where(models.Item.user_id == user_id).where(models.Item.id == item_id)
+    )
+    return (await db.execute(stmt)).first()
+
+
+async def get_item(db: AsyncSession, user_id: int, item_id: int) -> Union[schemas.ItemModel, None]:
+    ores = await get_user_item_data(db, user_id, item_id)
+    if ores is None:
+        return None
+    cfrags = await get_items_cfrags(db, [ores])
+    res = schemas.ItemModel.fromORM(
+        ores, cfrags=cfrags.get(ores.id, None), encrypted_data=read_item_payload(ores)
+    )
     return res
 
 
-def get_item(db: Session, user_id: int, item_id: int) -> Union[schemas.ItemModel, None]:
-    ores: models.Item = (
-        db.query(models.Item)
-        .filter(models.Item.user_id == user_id)
-        .filter(models.Item.id == item_id)
-        .first()
-    )  # type: ignore
+def item_etag(db_item: Row, cfrags: Union[List[bytes], None]) -> Union[str, None]:
+    """Compute the entity tag of an item, which changes with its ciphertext
+    or with the cfrags it has been shared with
+
+    Args:
+        db_item: The item, with blob_hash, cfrag and sender_pkey columns
+        cfrags: The cfrags of the item, if it has been shared with a M of N threshold
+
+    Returns:
+        The quoted entity tag, or None for an item stored before the blob store
+
+    """
+    if db_item.blob_hash is None:
+        return None
+
+    h = sha256(db_item.blob_hash.encode())
+    for field in [db_item.cfrag, db_item.sender_pkey] + (cfrags or []):
+        h.update(b"\x00" if field is None else len(field).to_bytes(4, "little") + field)
+    return f'"{h.hexdigest()}"'
+
+
+async def get_user_item_etag(db: AsyncSession, user_id: int, item_id: int) -> Union[str, None]:
+    """Compute the entity tag of an item without reading its ciphertext,
+    to answer a conditional request
+
+    Args:
+        db: The database session
+        user_id: The id of the owner of the item
+        item_id: The id of the item
+
+    Returns:
+        The quoted entity tag, or None if the item is not found or has no entity tag
+
+    """
+    stmt = (
+        select(
+            models.Item.id,
+            models.Item.blob_hash,
+            func.coalesce(models.Item.cfrag, models.Share.cfrag).label("cfrag"),
+            func.coalesce(models.Item.sender_pkey, models.Share.sender_pkey).label("sender_pkey"),
+        )
+        .outerjoin(models.Share, models.Share.item_id == models.Item.id)
+        .where(models.Item.user_id == user_id)
+        .where(models.Item.id == item_id)
+    )
+    ores = (await db.execute(stmt)).first()
     if ores is None:
         return None
-    res = schemas.ItemModel.fromORM(ores)
+    cfrags = await get_items_cfrags(db, [ores])
+    return item_etag(ores, cfrags.get(ores.id, None))
+
+
+async def get_items_cfrags(db: AsyncSession, db_items: List[Row]) -> Dict[int, List[bytes]]:
+    """Load the cfrags of the items shared with a M of N threshold.
+    These items have a sender_pkey but no cfrag, the other ones cost no query
+
+    Args:
+        db: The database session
+        db_items: The items to get the cfrags of, as selected by `select_items_data`
+
+    Returns:
+        The cfrags, indexed by item id. Only the items shared with a M of N threshold are present
+
+    """
+    ids = [
+        db_item.id
+        for db_item in db_items
+        if db_item.cfrag is None and db_item.sender_pkey is not None
+    ]
+    if len(ids) == 0:
+        return {}
+
+    stmt = (
+        select(models.ItemCfrag.item_id, models.ItemCfrag.cfrag)
+        .where(models.ItemCfrag.item_id.in_(ids))
+        .order_by(models.ItemCfrag.id)
+    )
+    res = {}
+    for item_id, cfrag in (await db.execute(stmt)).all():
+        res.setdefault(item_id, []).append(cfrag)
     return res
 
 
-def delete_item(db: Session, user_id: int, item_id: int) -> bool:
-    ores: models.Item = (
-        db.query(models.Item)
-        .filter(models.Item.user_id == user_id)
-        .filter(models.Item.id == item_id)
-        .first()
-    )  # type: ignore
+async def delete_items_shares(db: AsyncSession, item_ids: List[int]):
+    """Delete the cfrags and the shares of the items, before they are deleted or overwritten.
+    The items shared from them are given their ciphertext by `detach_shares`
+
+    """
+    await detach_shares(db, item_ids)
+    await db.execute(delete(models.ItemCfrag).where(models.ItemCfrag.item_id.in_(item_ids)))
+    await db.execute(delete(models.Share).where(models.Share.item_id.in_(item_ids)))
+
+
+async def detach_shares(db: AsyncSession, item_ids: List[int]):
+    """Keep the ciphertext of items that are about to be deleted or overwritten, if other items
+    are shared from them. For each such item, the ciphertext is copied into the first item
+    shared from it, which becomes a plain shared item and the source of the other shares
+
+    Args:
+        db: The database session
+        item_ids: The ids of the items about to be deleted or overwritten
+
+    """
+    stmt = (
+        select(models.Share)
+        .where(models.Share.source_item_id.in_(item_ids))
+        .where(models.Share.item_id.not_in(item_ids))
+        .order_by(models.Share.item_id)
+    )
+    heirs: Dict[int, models.Share] = {}
+    for share in (await db.execute(stmt)).scalars().all():
+        heirs.setdefault(share.source_item_id, share)
+
+    for source_item_id, heir in heirs.items():
+        stmt = select(models.Item.encrypted_data).where(models.Item.id == source_item_id)
+        encrypted_data = (await db.execute(stmt)).scalar_one()
+        await db.execute(
+            update(models.Item)
+            .where(models.Item.id == heir.item_id)
+            .values(encrypted_data=encrypted_data, cfrag=heir.cfrag, sender_pkey=heir.sender_pkey)
+        )
+        await db.execute(delete(models.Share).where(models.Share.item_id == heir.item_id))
+        await db.execute(
+            update(models.Share)
+            .where(models.Share.source_item_id == source_item_id)
+            .values(source_item_id=heir.item_id)
+        )
+
+
+async def delete_item(db: AsyncSession, user_id: int, item_id: int) -> bool:
+    ores = await get_user_item(db, user_id, item_id)
     if ores is None:
         return False
-    db.delete(ores)
-    db.commit()
+    await delete_items_shares(db, [item_id])
+    await db.delete(ores)
+    external = await blob_store.release_blobs(db, [ores.blob_hash])
+    await change_feed.record_changes(db, [(user_id, item_id, models.ItemChange.DELETED)])
+    await db.commit()
+    await blob_store.delete_files(db, external)
     return True
 
 
-def create_item(
-    db: Session,
+async def store_items_data(db: AsyncSession, db_items: List[models.Item]):
+    """Move the ciphertext of new items to the blob store, see `network.backend.blob_store`
+
+    Args:
+        db: The database session
+        db_items: The items, not yet added to the session
+
+    """
+    hashes = await blob_store.reference_blobs(db, [db_item.encrypted_data for db_item in db_items])
+    for db_item, hash in zip(db_items, hashes):
+        db_item.blob_hash = hash
+        db_item.encrypted_data = None
+
+
+async def create_item(
+    db: AsyncSession,
     item: schemas.ItemModel,
 ) -> Union[schemas.ItemModel, None]:
-    db_item = models.Item(**item.dict())
+    db_item = item.toORM()
+    await store_items_data(db, [db_item])
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return schemas.ItemModel.fromORM(db_item)
+    await db.flush()
+    await change_feed.record_changes(db, [(db_item.user_id, db_item.id, models.ItemChange.CREATED)])
+    await db.commit()
+    res = schemas.ItemModel(
+        id=db_item.id,
+        user_id=db_item.user_id,
+        encrypted_data=item.encrypted_data,
+        cfrag=item.cfrag,
+        sender_pkey=item.sender_pkey,
+    )
+    return res
+
+
+async def create_items(db: AsyncSession, user_id: int, items: List[schemas.ItemModel]) -> List[int]:
+    db_items = [item.toORM() for item in items]
+    for db_item in db_items:
+        db_item.user_id = user_id
+    await store_items_data(db, db_items)
 
+    if db.bind.dialect.name == "postgresql":
+        # The rows of a multi-row INSERT ... RETURNING may not be returned in the order
+        # of the VALUES, so the ids are drawn from the sequence beforehand
+        table = models.Item.__table__
+        sequence = func.pg_get_serial_sequence(table.name, table.c.id.name)
+        stmt = select(func.nextval(sequence)).select_from(func.generate_series(1, len(db_items)))
+        res = list((await db.execute(stmt)).scalars().all())
+        for db_item, item_id in zip(db_items, res):
+            db_item.id = item_id
+        values = [
+            {col.name: getattr(db_item, col.name) for col in table.columns} for db_item in db_items
+        ]
+        await db.execute(insert(table).values(values))
+    else:
+        db.add_all(db_items)
+        await db.flush()
+        res = [db_item.id for db_item in db_items]
 
-def create_user(db: Session, user: schemas.UserModel) -> Union[schemas.UserModel, None]:
+    await change_feed.record_changes(
+        db, [(user_id, item_id, models.ItemChange.CREATED) for item_id in res]
+    )
+    await db.commit()
+    return res
+
+
+async def get_items(db: AsyncSession, user_id: int, item_ids: List[int]) -> List[schemas.ItemModel]:
+    stmt = (
+        select_items_data()
+        .where(models.Item.user_id == user_id)
+        .where(models.Item.id.in_(item_ids))
+        .order_by(models.Item.id)
+    )
+    lores = (await db.execute(stmt)).all()
+    cfrags = await get_items_cfrags(db, lores)
+    return [
+        schemas.ItemModel.fromORM(
+            ores, cfrags=cfrags.get(ores.id, None), encrypted_data=read_item_payload(ores)
+        )
+        for ores in lores
+    ]
+
+
+async def delete_items(db: AsyncSession, user_id: int, item_ids: List[int]) -> List[int]:
+    stmt = (
+        select(models.Item.id, models.Item.blob_hash)
+        .where(models.Item.user_id == user_id)
+        .where(models.Item.id.in_(item_ids))
+        .order_by(models.Item.id)
+    )
+    lres = (await db.execute(stmt)).all()
+    res = [item_id for item_id, _ in lres]
+    external = []
+    if len(res) > 0:
+        await delete_items_shares(db, res)
+        await db.execute(delete(models.Item).where(models.Item.id.in_(res)))
+        external = await blob_store.release_blobs(db, [hash for _, hash in lres])
+        await change_feed.record_changes(
+            db, [(user_id, item_id, models.ItemChange.DELETED) for item_id in res]
+        )
+    await db.commit()
+    await blob_store.delete_files(db, external)
+    return res
+
+
+async def create_raw_item(
+    db: AsyncSession, user_id: int, encrypted_data: Union[bytes, blob_store.BlobUpload]
+) -> int:
+    (hash,) = await blob_store.reference_blobs(db, [encrypted_data])
+    db_item = models.Item(user_id=user_id, blob_hash=hash)
+    db.add(db_item)
+    await db.flush()
+    await change_feed.record_changes(db, [(user_id, db_item.id, models.ItemChange.CREATED)])
+    await db.commit()
+    return db_item.id
+
+
+async def update_item_data(
+    db: AsyncSession,
+    user_id: int,
+    item_id: int,
+    encrypted_data: Union[bytes, blob_store.BlobUpload],
+) -> bool:
+    ores = await get_user_item(db, user_id, item_id)
+    if ores is None:
+        return False
+    # The new data is encrypted by its owner, the cfrag of a shared item does not apply anymore
+    await delete_items_shares(db, [item_id])
+    # The new blob is referenced first, in case it is the same as the old one
+    old_hash = ores.blob_hash
+    (ores.blob_hash,) = await blob_store.reference_blobs(db, [encrypted_data])
+    external = await blob_store.release_blobs(db, [old_hash])
+    ores.encrypted_data = None
+    ores.cfrag = None
+    ores.sender_pkey = None
+    await change_feed.record_changes(db, [(user_id, item_id, models.ItemChange.UPDATED)])
+    await db.commit()
+    await blob_store.delete_files(db, external)
+    return True
+
+
+async def create_user(db: AsyncSession, user: schemas.UserModel) -> Union[schemas.UserModel, None]:
     db_user = models.DbUser(public_key=user.public_key, verifying_key=user.verifying_key)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return schemas.UserModel.fromORM(db_user)
 
 
-def post_shared_item(
-    db: Session,
+async def reencrypt(encrypted_data: bytes, db_kfrags: List[str]) -> List[bytes]:
+    """Re-encrypt a capsule with each of the kfrags of a share, in parallel
+    through `network.backend.crypto_executor.run_crypto`
+
+    Args:
+        encrypted_data: Capsule and ciphertext of the item, as bytes or as a memory map
+        db_kfrags: The kfrags, as given by `network.transcoding.kfrag_to_json`
+
+    Returns:
+        The cfrags, in the order of the kfrags
+
+    """
+    # Only the capsule is sent to the pool, the ciphertext is neither copied nor pickled
+    capsule_bytes = bytes(unpack_sized(encrypted_data, 1)[0])
+    u = Proxy()
+    return list(
+        await asyncio.gather(
+            *[
+                run_crypto(u.reencrypt_capsule_for_db, capsule_bytes, db_kfrag)
+                for db_kfrag in db_kfrags
+            ]
+        )
+    )
+
+
+def build_shared_item(recipient_id: int, source_item: Row) -> models.Item:
+    """Build the record of an item shared with a user. It holds no ciphertext but references
+    the blob of the source item, its `network.backend.models.Share` is added
+    by `network.backend.crud.add_shares` once the record is flushed
+
+    """
+    return models.Item(user_id=recipient_id, encrypted_data=None, blob_hash=source_item.blob_hash)
+
+
+async def add_shares(
+    db: AsyncSession,
+    db_items: List[models.Item],
+    source_items: List[Row],
+    sender_pkey: bytes,
+    db_cfrags: List[List[bytes]],
+) -> bool:
+    """Add to the session the shares of flushed items built by `build_shared_item`,
+    count their references to the blob store, and record them in the change feed
+    of the recipients. The transaction shall be committed right after.
+    A single cfrag is stored in the share, several ones in the item_cfrags table
+
+    Args:
+        db: The database session
+        db_items: The items of the recipients
+        source_items: For each item, the shared item as selected by `select_items_data`
+        sender_pkey: Bytes of the public key of the user who shares the items
+        db_cfrags: For each item, the cfrags of the share
+
+    Returns:
+        False if a shared item has been deleted with its blob since it was read,
+        in which case the transaction shall be rolled back
+
+    """
+    hashes = [db_item.blob_hash for db_item in db_items if db_item.blob_hash is not None]
+    await blob_store.add_references(db, hashes)
+    # Once referenced here, the blobs cannot be deleted by a concurrent transaction
+    if len(await blob_store.existing_blobs(db, hashes)) < len(set(hashes)):
+        return False
+
+    for db_item, source_item, item_cfrags in zip(db_items, source_items, db_cfrags):
+        db.add(
+            models.Share(
+                item_id=db_item.id,
+                source_item_id=source_item.source_item_id,
+                recipient_id=db_item.user_id,
+                cfrag=item_cfrags[0] if len(item_cfrags) == 1 else None,
+                sender_pkey=sender_pkey,
+            )
+        )
+        if len(item_cfrags) > 1:
+            db.add_all(
+                [models.ItemCfrag(item_id=db_item.id, cfrag=db_cfrag) for db_cfrag in item_cfrags]
+            )
+    await change_feed.record_changes(
+        db, [(db_item.user_id, db_item.id, models.ItemChange.SHARED) for db_item in db_items]
+    )
+    return True
+
+
+async def post_shared_item(
+    db: AsyncSession,
     sender: schemas.UserModel,
     recipient: schemas.UserModel,
-    db_kfrag: str,
-    encrypted_data: str,
+    db_kfrags: List[str],
+    source_item: Row,
 ) -> Union[schemas.ItemModel, None]:
-    capsule, ciphertext = db_bytes_to_encrypted(encrypted_data)
-    kfrag = db_bytes_to_kfrag(db_kfrag)
-    u = Proxy()
-    cfrag = u.reencrypt(capsule, kfrag)
-    db_cfrag = cfrag_to_json(cfrag)
-    db_item = models.Item(
-        user_id=recipient.id,
-        encrypted_data=encrypted_data,
-        cfrag=db_cfrag["cfrag"],
-        sender_pkey=sender.public_key,
-    )
+    db_cfrags = await reencrypt(read_item_payload(source_item), db_kfrags)
+    db_item = build_shared_item(recipient.id, source_item)
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return schemas.ItemModel.fromORM(db_item)
+    await db.flush()
+    if not await add_shares(
+        db, [db_item], [source_item], b64decode(sender.public_key), [db_cfrags]
+    ):
+        await db.rollback()
+        return None
+    await db.commit()
+    return await get_item(db, recipient.id, db_item.id)
+
+
+async def get_user_items_by_id(
+    db: AsyncSession, user_id: int, item_ids: List[int]
+) -> Dict[int, Row]:
+    stmt = (
+        select_items_data()
+        .where(models.Item.user_id == user_id)
+        .where(models.Item.id.in_(item_ids))
+    )
+    lores = (await db.execute(stmt)).all()
+    return {ores.id: ores for ores in lores}
+
+
+async def get_users_by_id(db: AsyncSession, user_ids: List[int]) -> Dict[int, models.DbUser]:
+    stmt = select(models.DbUser).where(models.DbUser.id.in_(user_ids))
+    lores = (await db.execute(stmt)).scalars().all()
+    return {ores.id: ores for ores in lores}
+
+
+async def post_shared_items(
+    db: AsyncSession,
+    sender: schemas.UserModel,
+    shares: List[schemas.ShareModel],
+    db_items: Dict[int, Row],
+) -> Union[List[int], None]:
+    db_cfrags = await asyncio.gather(
+        *[
+            reencrypt(read_item_payload(db_items[share.item_id]), share.kfrag_list())
+            for share in shares
+        ]
+    )
+
+    new_items = [build_shared_item(share.recipient_id, db_items[share.item_id]) for share in shares]
+    db.add_all(new_items)
+    await db.flush()
+    if not await add_shares(
+        db,
+        new_items,
+        [db_items[share.item_id] for share in shares],
+        b64decode(sender.public_key),
+        db_cfrags,
+    ):
+        await db.rollback()
+        return None
+    res = [db_item.id for db_item in new_items]
+    await db.commit()
+    return res
+
+
+async def create_share_job(
+    db: AsyncSession, sender_id: int, share: schemas.ShareModel
+) -> schemas.ShareJobModel:
+    db_job = models.ShareJob(
+        sender_id=sender_id,
+        recipient_id=share.recipient_id,
+        source_item_id=share.item_id,
+        kfrags=share.kfrag_list(),
+        status=models.ShareJob.PENDING,
+    )
+    db.add(db_job)
+    await db.commit()
+    return schemas.ShareJobModel.fromORM(db_job)
+
+
+async def get_share_job(
+    db: AsyncSession, sender_id: int, job_id: int
+) -> Union[schemas.ShareJobModel, None]:
+    stmt = (
+        select(models.ShareJob)
+        .where(models.ShareJob.sender_id == sender_id)
+        .where(models.ShareJob.id == job_id)
+    )
+    ores = (await db.execute(stmt)).scalars().first()
+    if ores is None:
+        return None
+    return schemas.ShareJobModel.fromORM(ores)
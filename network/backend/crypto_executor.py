@@ -0,0 +1,89 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import os
+from typing import Any, Callable, Union
+
+from umbral import PublicKey
+
+from .. import logger
+
+
+#: Pool running the cryptographic operations of this process, built on first use
+_executor: Union[Executor, None] = None
+
+
+def get_executor_kind() -> str:
+    """Get the kind of pool that runs the cryptographic operations,
+    read from the CRYPTO_EXECUTOR environment variable: 'thread' (default) or 'process'
+
+    Returns:
+        The kind of pool
+
+    """
+    kind = os.environ.get("CRYPTO_EXECUTOR", "thread")
+    if kind not in ("thread", "process"):
+        raise AssertionError(f"CRYPTO_EXECUTOR shall be 'thread' or 'process'. Got '{kind}'")
+    return kind
+
+
+def get_executor() -> Executor:
+    """Get the pool that runs the cryptographic operations.
+    Its size is read from the CRYPTO_WORKERS environment variable,
+    0 or unset letting `concurrent.futures` choose
+
+    Returns:
+        The pool
+
+    """
+    global _executor
+
+    if _executor is None:
+        workers = int(os.environ.get("CRYPTO_WORKERS", "0")) or None
+        kind = get_executor_kind()
+        if kind == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crypto")
+        logger.info(f"Running cryptographic operations in a {kind} pool (workers={workers})")
+
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the pool that runs the cryptographic operations. Meant to be called at shutdown"""
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def portable_key(key: PublicKey) -> Union[PublicKey, bytes]:
+    """Prepare a key to be given to a function run by `run_crypto`.
+    umbral objects cannot be pickled, so they are sent as bytes to a process pool
+
+    Args:
+        key: The key
+
+    Returns:
+        The key itself for a thread pool, its bytes for a process pool
+
+    """
+    if get_executor_kind() == "process":
+        return bytes(key)
+    return key
+
+
+async def run_crypto(func: Callable, *args) -> Any:
+    """Run a cryptographic operation in the pool, without blocking the event loop
+
+    Args:
+        func: The function to run. Shall be picklable if the pool is a process pool
+        args: The arguments of func
+
+    Returns:
+        The value returned by func
+
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), func, *args)
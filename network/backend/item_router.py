@@ -1,31 +1,293 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Path, Request
-from sqlalchemy.orm import Session
+import binascii
+from typing import AsyncIterator, List, Union
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from umbral import Capsule
+from umbral.openssl import ErrorInvalidCompressedPoint, ErrorInvalidPointEncoding
 
 from .. import schemas
-from . import crud
+from . import blob_store, change_feed, crud
 from .models import get_db
 from .auth_depend import challenge_auth
+from ..transcoding import raw_to_encrypted
+
+
+#: Media type of the raw endpoints
+OCTET_STREAM = "application/octet-stream"
+
+#: Default number of ids in a page of GET /item/
+DEFAULT_PAGE_SIZE = 1000
+
+#: Maximum number of ids in a page of GET /item/
+MAX_PAGE_SIZE = 10000
+
+#: Maximum number of items in one request to the batch endpoints
+MAX_BATCH_SIZE = 1000
+
+#: Errors raised by the decoding of an invalid encrypted message
+DECODING_ERRORS = (ValueError, TypeError, ErrorInvalidCompressedPoint, ErrorInvalidPointEncoding)
+
+
+def check_batch_size(size: int):
+    if size > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Batch too large ({size} > {MAX_BATCH_SIZE} items)"
+        )
+
+
+async def read_raw_body(request: Request) -> AsyncIterator[blob_store.BlobUpload]:
+    """Read the body of a raw upload as it is received, without holding it in memory,
+    and check that it starts with the capsule of an encrypted message
+    as given by `network.transcoding.encrypted_to_raw`
+
+    Args:
+        request: The fastapi request
+
+    Yields:
+        The body, deleted once the request is handled
+
+    """
+    upload = blob_store.BlobUpload()
+    try:
+        async for chunk in request.stream():
+            upload.write(chunk)
+
+        capsule_size = Capsule.serialized_size()
+        head = upload.read(0, 4 + capsule_size)
+        try:
+            if int.from_bytes(head[:4], "little") != capsule_size:
+                raise ValueError("Invalid capsule size")
+            raw_to_encrypted(head)
+        except DECODING_ERRORS:
+            raise HTTPException(status_code=422, detail="Body is not a valid encrypted message")
+
+        yield upload
+    finally:
+        upload.close()
+
+
+async def check_not_modified(
+    request: Request, db: AsyncSession, user_id: int, item_id: int
+) -> Union[Response, None]:
+    """Answer a conditional GET of an item whose entity tag is given in the If-None-Match
+    header, without reading the ciphertext of the item
+
+    Args:
+        request: The fastapi request
+        db: The database session
+        user_id: The id of the user
+        item_id: The id of the requested item
+
+    Returns:
+        A 304 response if the item did not change, None otherwise
+
+    """
+    if_none_match = request.headers.get("If-None-Match", None)
+    if if_none_match is None:
+        return None
+
+    etag = await crud.get_user_item_etag(db, user_id, item_id)
+    if etag is None:
+        return None
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags or etag in tags or f"W/{etag}" in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return None
 
 
 router = APIRouter(prefix="/item", tags=["item"])
 
 
+@router.get(
+    "/changes",
+    response_model=schemas.ItemChangesModel,
+    description=(
+        "List the changes of the items of user (created, shared, updated, deleted)"
+        " in increasing order of sequence number. The next changes are obtained"
+        " with since set to the last_seq of the response"
+    ),
+)
+async def list_item_changes(
+    request: Request,
+    since: int = Query(0, ge=0, description="Only list the changes after this sequence number"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    changes = await change_feed.list_changes(db, user_id, since=since, limit=limit)
+    return schemas.ItemChangesModel(
+        changes=[
+            schemas.ItemChangeModel(seq=seq, item_id=item_id, kind=kind)
+            for seq, item_id, kind in changes
+        ],
+        last_seq=changes[-1].seq if len(changes) > 0 else since,
+    )
+
+
 @router.get(
     "/{item_id}",
     response_model=schemas.ItemModel,
-    description="Retrive one item data for user",
+    responses={304: {"description": "The item matches the entity tag given in If-None-Match"}},
+    description=(
+        "Retrive one item data for user. The ETag header of the response can be given"
+        " in the If-None-Match header of the next requests, which get an empty 304 response"
+        " while the item does not change"
+    ),
 )
 async def read_item_data(
     request: Request,
+    response: Response,
     item_id: int = Path(description="ID of the item to retrieve"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
-    db_data = crud.get_item(db, user_id, item_id)
-    if db_data is None:
+    not_modified = await check_not_modified(request, db, user_id, item_id)
+    if not_modified is not None:
+        return not_modified
+
+    db_item = await crud.get_user_item_data(db, user_id, item_id)
+    if db_item is None:
         raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
-    return db_data
+
+    cfrags = (await crud.get_items_cfrags(db, [db_item])).get(item_id, None)
+    etag = crud.item_etag(db_item, cfrags)
+    if etag is not None:
+        response.headers["ETag"] = etag
+    return schemas.ItemModel.fromORM(
+        db_item, cfrags=cfrags, encrypted_data=crud.read_item_payload(db_item)
+    )
+
+
+@router.post(
+    "/batch",
+    response_model=List[schemas.ItemIdModel],
+    description="Creates several items data for user in one transaction",
+)
+async def create_items(
+    items: List[schemas.ItemModel],
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    check_batch_size(len(items))
+    try:
+        item_ids = await crud.create_items(db, user_id, items)
+    except binascii.Error:
+        raise HTTPException(status_code=422, detail="Item data is not valid base64")
+    return [schemas.ItemIdModel(id=item_id, user_id=user_id) for item_id in item_ids]
+
+
+@router.post(
+    "/batch-get",
+    response_model=List[schemas.ItemModel],
+    description="Retrive several items data for user. The ids not found are ignored",
+)
+async def read_items_data(
+    item_ids: List[int] = Body(description="IDs of the items to retrieve"),
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    check_batch_size(len(item_ids))
+    return await crud.get_items(db, user_id, item_ids)
+
+
+@router.post(
+    "/batch-delete",
+    response_model=List[int],
+    description="Delete several items data for user. Returns the ids actually deleted",
+)
+async def delete_items_data(
+    item_ids: List[int] = Body(description="IDs of the items to delete"),
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    check_batch_size(len(item_ids))
+    return await crud.delete_items(db, user_id, item_ids)
+
+
+@router.get(
+    "/{item_id}/raw",
+    response_class=Response,
+    responses={200: {"content": {OCTET_STREAM: {}}}},
+    description=(
+        "Retrive one item data for user as raw bytes. The cfrag and sender_pkey of a shared item"
+        " are given base64 encoded in the Item-Cfrag and Item-Sender-Pkey headers."
+        " The cfrags of an item shared with a M of N threshold are given comma separated"
+        " in the Item-Cfrags header. The large items are sent from the disk of the server."
+        " Conditional requests are supported as for GET /item/{item_id}"
+    ),
+)
+async def read_raw_item_data(
+    request: Request,
+    item_id: int = Path(description="ID of the item to retrieve"),
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    not_modified = await check_not_modified(request, db, user_id, item_id)
+    if not_modified is not None:
+        return not_modified
+
+    db_item = await crud.get_user_item_data(db, user_id, item_id)
+    if db_item is None:
+        raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
+
+    cfrags = (await crud.get_items_cfrags(db, [db_item])).get(item_id, None)
+    # The ciphertext is sent as is, it is not needed to build the headers
+    item = schemas.ItemModel.fromORM(db_item, cfrags=cfrags, encrypted_data=b"")
+    headers = {}
+    etag = crud.item_etag(db_item, cfrags)
+    if etag is not None:
+        headers["ETag"] = etag
+    if item.cfrag is not None:
+        headers["Item-Cfrag"] = item.cfrag
+    if item.cfrags is not None:
+        headers["Item-Cfrags"] = ",".join(item.cfrags)
+    if item.sender_pkey is not None:
+        headers["Item-Sender-Pkey"] = item.sender_pkey
+
+    if db_item.encrypted_data is None and db_item.blob_hash is not None:
+        # External blob, sent with sendfile when the server supports it
+        storage = blob_store.get_external_storage(db_item.blob_hash)
+        return FileResponse(
+            storage.path(db_item.blob_hash), media_type=OCTET_STREAM, headers=headers
+        )
+
+    return Response(content=db_item.encrypted_data, media_type=OCTET_STREAM, headers=headers)
+
+
+@router.put(
+    "/{item_id}/raw",
+    response_model=schemas.ItemIdModel,
+    description="Replaces one item data for user with the raw bytes of the body",
+)
+async def update_raw_item_data(
+    item_id: int = Path(description="ID of the item to replace"),
+    # Declared first, so that the body is read only once the user is authenticated
+    user_id: int = Depends(challenge_auth),
+    encrypted_data: blob_store.BlobUpload = Depends(read_raw_body),
+    db: AsyncSession = Depends(get_db),
+):
+    ok = await crud.update_item_data(db, user_id, item_id, encrypted_data)
+    if not ok:
+        raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
+    return schemas.ItemIdModel(id=item_id, user_id=user_id)
+
+
+@router.post(
+    "/raw",
+    response_model=schemas.ItemIdModel,
+    description="Creates one item data for user from the raw bytes of the body",
+)
+async def create_raw_item(
+    # Declared first, so that the body is read only once the user is authenticated
+    user_id: int = Depends(challenge_auth),
+    encrypted_data: blob_store.BlobUpload = Depends(read_raw_body),
+    db: AsyncSession = Depends(get_db),
+):
+    item_id = await crud.create_raw_item(db, user_id, encrypted_data)
+    return schemas.ItemIdModel(id=item_id, user_id=user_id)
 
 
 @router.delete(
@@ -35,10 +297,10 @@ async def read_item_data(
 async def delete_item_data(
     request: Request,
     item_id: int = Path(description="ID of the item to retrieve"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
-    ok = crud.delete_item(db, user_id, item_id)
+    ok = await crud.delete_item(db, user_id, item_id)
     if not ok:
         raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
 
@@ -46,14 +308,19 @@ async def delete_item_data(
 @router.get(
     "/",
     response_model=List[int],
-    description="Retrive the list of item data for user",
+    description=(
+        "Retrive one page of the sorted list of item ids for user."
+        " The next page is obtained with after_id set to the last id of the page"
+    ),
 )
 async def list_items(
     request: Request,
-    db: Session = Depends(get_db),
+    after_id: int = Query(None, description="Only list the ids greater than this one"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
-    db_data = crud.list_items(db, user_id)
+    db_data = await crud.list_items(db, user_id, after_id=after_id, limit=limit)
     return db_data
 
 
@@ -65,9 +332,12 @@ async def list_items(
 async def create_item(
     request: Request,
     item: schemas.ItemModel = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
     item.user_id = user_id
 
-    return crud.create_item(db=db, item=item)
+    try:
+        return await crud.create_item(db=db, item=item)
+    except binascii.Error:
+        raise HTTPException(status_code=422, detail="Item data is not valid base64")
@@ -0,0 +1,349 @@
+"""Load generator driving a server with the traffic of many users.
+
+A `LoadTest` registers users through an admin, gives each of them a few items,
+then runs a number of operations picked at random according to a mix, for example
+"upload=2,read=5,list=1,share=1,delete=1". The operations are:
+
+* upload: POST /item/ of a new item
+* read: GET /item/{item_id} of one of the user's items, including the ones shared with the user
+* list: GET /item/ of the ids of all the items of the user
+* share: POST /share/batch of one of the items uploaded by the user, with another user.
+  The items shared with the user are not shared again, as they can only be decrypted
+  by the recipients of their owner
+* delete: DELETE /item/{item_id} of one of the items uploaded by the user. The items
+  being read or shared are not deleted, so that the operations do not fail
+
+A user without any item uploads one instead of reading, sharing or deleting.
+
+Each user has its own `network.frontend.AsyncUser.AsyncUser`, and a fixed number of
+operations are in flight at once. The latencies are measured per operation, from the client
+point of view (encryption included), and per endpoint, up to the reception of the headers
+of the response. See the loadtest command of `network.backend.main`
+
+"""
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+import math
+import os
+from pathlib import Path
+import random
+import re
+import tempfile
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import httpx
+from rich.console import Console
+from rich.table import Table
+
+from .. import logger
+from ..frontend.AsyncAdmin import AsyncAdmin
+from ..frontend.AsyncUser import AsyncUser
+
+
+#: Operations of a load test
+OPERATIONS = ["upload", "read", "list", "share", "delete"]
+
+#: Default mix of the operations
+DEFAULT_MIX = "upload=2,read=5,list=1,share=1,delete=1"
+
+#: Key of the extensions of a request holding the time it was sent
+_START_KEY = "network_loadtest_start"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse a mix of operations
+
+    Args:
+        mix: Comma separated list of operation=weight, e.g. "upload=2,read=5"
+
+    Returns:
+        The weights, indexed by operation
+
+    """
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}, expected one of {OPERATIONS}")
+        weights[name] = float(weight or "1")
+
+    if sum(weights.values()) <= 0:
+        raise ValueError(f"The weights of the mix {mix!r} shall not be all zero")
+
+    return weights
+
+
+def endpoint_name(request: httpx.Request) -> str:
+    """Name the endpoint of a request, the ids in its path being replaced by {id}
+
+    Args:
+        request: The request
+
+    Returns:
+        The method and the path, e.g. GET /item/{id}
+
+    """
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", request.url.path)
+    return f"{request.method} {path}"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Compute a percentile with the nearest rank method
+
+    Args:
+        values: The values, sorted in increasing order
+        q: The percentile, between 0 and 100
+
+    Returns:
+        The percentile
+
+    """
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+class LatencyRecorder(object):
+    """Latencies and errors of operations, grouped by name"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, name: str, latency: float, ok: bool = True):
+        """Record an operation
+
+        Args:
+            name: The name of the operation
+            latency: The duration of the operation (s)
+            ok: False if the operation failed
+
+        """
+        self.latencies.setdefault(name, []).append(latency)
+        self.errors.setdefault(name, 0)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        """Compute the statistics of the operations
+
+        Args:
+            elapsed: The duration of the test (s)
+
+        Returns:
+            For each name, a dictionary with keys count, errors, throughput (operations per
+            second), mean, p50, p90, p99 and max (s)
+
+        """
+        res = {}
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            res[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "throughput": len(values) / elapsed if elapsed > 0 else 0.0,
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+        return res
+
+
+class LoadTest(object):
+    """Load test of a server
+
+    Args:
+        server_url: URL of the server
+        admin_key: The .topsecret file of an admin registered on the server
+        users: Number of users created
+        concurrency: Number of operations in flight at once
+        mix: Weights of the operations, see `parse_mix`
+        item_size: Size of the items uploaded (bytes)
+        seed_items: Number of items uploaded by each user before the test
+        seed: Seed of the random choices of the operations
+
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        admin_key: Path,
+        users: int = 10,
+        concurrency: int = 32,
+        mix: str = DEFAULT_MIX,
+        item_size: int = 1024,
+        seed_items: int = 10,
+        seed: int = None,
+    ):
+        self.server_url = server_url
+        self.admin_key = admin_key
+        self.nb_users = users
+        self.concurrency = concurrency
+        self.weights = parse_mix(mix)
+        self.item_size = item_size
+        self.seed_items = seed_items
+        self.random = random.Random(seed)
+
+        self.users: List[AsyncUser] = []
+        self.uploaded: Dict[int, List[int]] = {}
+        self.received: Dict[int, List[int]] = {}
+        # Number of operations in flight on each item
+        self.in_use: Counter = Counter()
+        self.operations = LatencyRecorder()
+        self.endpoints = LatencyRecorder()
+
+    async def _on_request(self, request: httpx.Request):
+        request.extensions[_START_KEY] = time.perf_counter()
+
+    async def _on_response(self, response: httpx.Response):
+        request = response.request
+        latency = time.perf_counter() - request.extensions[_START_KEY]
+        self.endpoints.record(endpoint_name(request), latency, ok=response.status_code < 400)
+
+    async def setup(self):
+        """Create the users, and upload their first items"""
+        async with AsyncAdmin(server_url=self.server_url, config_file=self.admin_key) as admin:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                for _ in range(self.nb_users):
+                    user = AsyncUser(server_url=self.server_url, pool_size=self.concurrency)
+                    public_file = Path(tmp_dir) / "user.public"
+                    user.to_public_file(public_file)
+                    user.id = await admin.createUser(public_file)
+                    user.client.event_hooks["request"].append(self._on_request)
+                    user.client.event_hooks["response"].append(self._on_response)
+                    self.users.append(user)
+        logger.info(f"Created {self.nb_users} users")
+
+        for user in self.users:
+            items = [os.urandom(self.item_size) for _ in range(self.seed_items)]
+            self.uploaded[user.id] = await user.saveItems(items)
+            self.received[user.id] = []
+        logger.info(f"Uploaded {self.seed_items} items per user")
+
+    async def close(self):
+        """Close the connections of the users"""
+        for user in self.users:
+            await user.close()
+
+    @contextmanager
+    def _use(self, item_ids: List[int]) -> Iterator[int]:
+        item_id = self.random.choice(item_ids)
+        self.in_use[item_id] += 1
+        try:
+            yield item_id
+        finally:
+            self.in_use[item_id] -= 1
+
+    async def _upload(self, user: AsyncUser):
+        item_id = await user.saveItemInDatabase(os.urandom(self.item_size))
+        self.uploaded[user.id].append(item_id)
+
+    async def _read(self, user: AsyncUser):
+        item_ids = self.uploaded[user.id] + self.received[user.id]
+        if len(item_ids) == 0:
+            return await self._upload(user)
+        with self._use(item_ids) as item_id:
+            await user.loadItemFromDatabase(item_id)
+
+    async def _list(self, user: AsyncUser):
+        async for _ in user.loadItemIdList():
+            pass
+
+    async def _share(self, user: AsyncUser):
+        if len(self.uploaded[user.id]) == 0 or len(self.users) < 2:
+            return await self._upload(user)
+        recipient = self.random.choice([other for other in self.users if other is not user])
+        with self._use(self.uploaded[user.id]) as item_id:
+            (new_id,) = await user.shareItems([item_id], {recipient.id: recipient.public_key})
+        self.received[recipient.id].append(new_id)
+
+    async def _delete(self, user: AsyncUser):
+        item_ids = [item_id for item_id in self.uploaded[user.id] if self.in_use[item_id] == 0]
+        if len(item_ids) == 0:
+            return await self._upload(user)
+        item_id = self.random.choice(item_ids)
+        self.uploaded[user.id].remove(item_id)
+        await user.deleteItemFromDatabase(item_id)
+
+    async def run_operation(self, name: str, user: AsyncUser):
+        """Run an operation, and record its latency
+
+        Args:
+            name: The name of the operation, one of `OPERATIONS`
+            user: The user running the operation
+
+        """
+        t0 = time.perf_counter()
+        ok = True
+        try:
+            await getattr(self, f"_{name}")(user)
+        except Exception as e:
+            ok = False
+            logger.debug(f"Operation {name} of user {user.id} failed: {e!r}")
+        self.operations.record(name, time.perf_counter() - t0, ok=ok)
+
+    async def run(self, operations: int) -> dict:
+        """Run operations, picked at random according to the mix
+
+        Args:
+            operations: Total number of operations
+
+        Returns:
+            A dictionary with the following keys:
+
+            * elapsed: Duration of the test (s)
+            * operations: Statistics of each operation, see `LatencyRecorder.summary`
+            * endpoints: Statistics of each endpoint
+
+        """
+        names, weights = zip(*self.weights.items())
+        plan: List[Tuple[str, AsyncUser]] = [
+            (name, self.random.choice(self.users))
+            for name in self.random.choices(names, weights=weights, k=operations)
+        ]
+        # The requests of the setup are not part of the results
+        self.operations = LatencyRecorder()
+        self.endpoints = LatencyRecorder()
+
+        async def _worker():
+            while len(plan) > 0:
+                name, user = plan.pop()
+                await self.run_operation(name, user)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[_worker() for _ in range(self.concurrency)])
+        elapsed = time.perf_counter() - t0
+
+        return {
+            "elapsed": elapsed,
+            "operations": self.operations.summary(elapsed),
+            "endpoints": self.endpoints.summary(elapsed),
+        }
+
+
+def print_report(report: dict):
+    """Print the results of a load test
+
+    Args:
+        report: The dictionary returned by `LoadTest.run`
+
+    """
+    console = Console()
+    for key, title in (("operations", "Operations"), ("endpoints", "Endpoints")):
+        table = Table(title=f"{title} ({report['elapsed']:.1f} s)")
+        table.add_column(title[:-1])
+        for column in ("Count", "Errors", "Rate (/s)", "Mean", "p50", "p90", "p99", "Max"):
+            table.add_column(column, justify="right")
+        for name, stats in report[key].items():
+            table.add_row(
+                name,
+                str(stats["count"]),
+                str(stats["errors"]),
+                f"{stats['throughput']:.1f}",
+                *[f"{stats[q] * 1000:.1f} ms" for q in ("mean", "p50", "p90", "p99", "max")],
+            )
+        console.print(table)
@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 import contextlib
 import time
@@ -6,19 +7,38 @@ import threading
 from pathlib import Path
 from asyncio import run as aiorun
 
-from sqlalchemy.ext.asyncio import create_async_engine
 import uvicorn
 from fastapi import FastAPI
+from sqlalchemy.engine import make_url
 import typer
 
 from .. import get_network_version
-from . import item_router, user_router, share_router
+from . import admin_router, item_router, notification_router, user_router, share_router
 from ..frontend.User import User
 from . import models
+from .crypto_executor import shutdown_executor
+from .loadtest import DEFAULT_MIX, LoadTest, print_report
+from .notifier import stop_notifier
+from .proxy_worker import run_proxy as _run_proxy
 
 tapp = typer.Typer()
 
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the database engine of the worker process at startup,
+    and close its connections, the notifier and the cryptographic pool at shutdown
+
+    """
+    models.get_engine()
+    yield
+    await stop_notifier()
+    await models.dispose_engines()
+    shutdown_executor()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     root_path=os.environ.get("ROOT_PATH", ""),
     title="Network API",
     description="API pour accéder à l'annuaire des contacts",
@@ -28,6 +48,8 @@ app = FastAPI(
 app.include_router(item_router.router)
 app.include_router(user_router.router)
 app.include_router(share_router.router)
+app.include_router(admin_router.router)
+app.include_router(notification_router.router)
 
 
 class Server(uvicorn.Server):
@@ -50,6 +72,16 @@ class Server(uvicorn.Server):
             thread.join()
 
 
+async def create_tables():
+    """Create the tables missing in the database, before starting a server"""
+    engine = models.get_engine()
+    target_metadata = models.Base.metadata
+    async with engine.begin() as conn:
+        await conn.run_sync(target_metadata.create_all)
+    # The pool is bound to this event loop, the server will build its own
+    await models.dispose_engines()
+
+
 @tapp.command()
 def create(
     key_path: Path = typer.Option(None, help="Where to save the private key"),
@@ -81,11 +113,32 @@ def run_server(
     port: int = typer.Option(3034, help="Port on which the server listens"),
     workers: int = typer.Option(1, help="Number of workers"),
     test: bool = typer.Option(False, help="Flag to run the server for only one second"),
+    crypto_workers: int = typer.Option(
+        0, help="Number of workers running the cryptographic operations (0 for automatic)"
+    ),
+    crypto_executor: str = typer.Option(
+        "thread", help="Kind of pool running the cryptographic operations: thread or process"
+    ),
 ):
     "Run server"
+    # Read by network.backend.crypto_executor, in all the worker processes
+    os.environ["CRYPTO_WORKERS"] = str(crypto_workers)
+    os.environ["CRYPTO_EXECUTOR"] = crypto_executor
+
+    db_uri = models.get_database_uri()
+    if workers > 1 and "NOTIFIER" not in os.environ:
+        # The changes committed by a worker shall reach the clients connected to the others
+        is_postgres = make_url(db_uri).get_backend_name() == "postgresql"
+        os.environ["NOTIFIER"] = "postgres" if is_postgres else "poll"
+    if workers > 1:
+        # A challenge used on a worker shall not be replayed on the others
+        replay_store = os.environ.setdefault("REPLAY_STORE", db_uri)
+        if replay_store == "memory":
+            raise typer.BadParameter(
+                "REPLAY_STORE=memory cannot be used with several workers, give a database URI"
+            )
 
     async def _run_server():
-        db_uri = os.environ.get("DATABASE_URI", "sqlite+aiosqlite:///tests/test_data.db")
 
         logger = logging.getLogger("network_logger")
         logger.info(
@@ -94,10 +147,7 @@ def run_server(
         )
         logger.info(f"Using {db_uri}")
 
-        engine = create_async_engine(db_uri, echo=False)
-        target_metadata = models.Base.metadata
-        async with engine.begin() as conn:
-            await conn.run_sync(target_metadata.create_all)
+        await create_tables()
 
         admin_key_path = Path("admin.topsecret")
         if not admin_key_path.exists():
@@ -120,3 +170,98 @@ def run_server(
                 pass
 
     aiorun(_run_server())
+
+
+@tapp.command()
+def run_proxy(
+    poll_interval: float = typer.Option(1.0, help="Time to wait when no share job is pending (s)"),
+    batch_size: int = typer.Option(10, help="Number of share jobs processed concurrently"),
+    once: bool = typer.Option(False, help="Stop as soon as no share job is pending"),
+    crypto_workers: int = typer.Option(
+        0, help="Number of workers running the cryptographic operations (0 for automatic)"
+    ),
+    crypto_executor: str = typer.Option(
+        "thread", help="Kind of pool running the cryptographic operations: thread or process"
+    ),
+):
+    "Run a proxy worker, that re-encrypts the shares submitted to POST /share/"
+    os.environ["CRYPTO_WORKERS"] = str(crypto_workers)
+    os.environ["CRYPTO_EXECUTOR"] = crypto_executor
+
+    async def _run():
+        try:
+            await _run_proxy(poll_interval=poll_interval, batch_size=batch_size, once=once)
+        finally:
+            await models.dispose_engines()
+            shutdown_executor()
+
+    aiorun(_run())
+
+
+@tapp.command()
+def loadtest(
+    users: int = typer.Option(10, help="Number of users created"),
+    operations: int = typer.Option(1000, help="Total number of operations"),
+    concurrency: int = typer.Option(32, help="Number of operations in flight at once"),
+    mix: str = typer.Option(
+        DEFAULT_MIX, help="Weights of the operations: upload, read, list, share and delete"
+    ),
+    item_size: int = typer.Option(1024, help="Size of the items uploaded (bytes)"),
+    seed_items: int = typer.Option(10, help="Number of items per user before the test"),
+    server_url: str = typer.Option(
+        "", help="URL of a running server. By default, a server is started for the test"
+    ),
+    port: int = typer.Option(3036, help="Port of the server started for the test"),
+    admin_key: Path = typer.Option(
+        Path("admin.topsecret"),
+        help="Key of an admin of the server. Created if needed for the server started",
+    ),
+    output: Path = typer.Option(None, help="JSON file where the results are saved"),
+    seed: int = typer.Option(None, help="Seed of the random choices of the operations"),
+):
+    """Run a load test, and report the throughput and the latency percentiles per endpoint.
+    The server started for the test uses the database given by DATABASE_URI, and runs in
+    this process. Give the --server-url of a server run with run-server to measure it alone
+
+    """
+
+    async def _run(url: str) -> dict:
+        test = LoadTest(
+            server_url=url,
+            admin_key=admin_key,
+            users=users,
+            concurrency=concurrency,
+            mix=mix,
+            item_size=item_size,
+            seed_items=seed_items,
+            seed=seed,
+        )
+        try:
+            await test.setup()
+            return await test.run(operations)
+        finally:
+            await test.close()
+
+    if server_url != "":
+        report = aiorun(_run(server_url))
+    else:
+        aiorun(create_tables())
+        if not admin_key.exists():
+            create(admin=True, key_path=admin_key)
+
+        config = uvicorn.Config(
+            "network.backend.main:app",
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+            workers=1,
+            reload=False,
+        )
+        server = Server(config=config)
+        with server.run_in_thread():
+            report = aiorun(_run(f"http://127.0.0.1:{port}"))
+
+    print_report(report)
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
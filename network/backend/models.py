@@ -1,47 +1,266 @@
 from base64 import b64decode
 from datetime import datetime, timedelta
 import os
+from typing import TYPE_CHECKING, Dict, Tuple, Union
 
 from sqlalchemy import (
     Column,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     Boolean,
+    JSON,
     String,
     DateTime,
+    LargeBinary,
+    create_engine,
 )
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.sql import func
 from sqlalchemy.orm import declarative_base, Session, relationship, sessionmaker
-from umbral import Signature
+from umbral import PublicKey, Signature
 from umbral.hashing import Hash
 
 from .. import logger
+from .crypto_executor import portable_key, run_crypto
 from ..transcoding import challenge_to_datetime, decodeKey
 
+if TYPE_CHECKING:
+    from .replay_store import ReplayStore
 
 Base = declarative_base()
 
+#: Synchronous drivers to use when a synchronous engine is requested on an async URI
+SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgresql+asyncpg": "postgresql+psycopg2",
+}
 
-def get_connection():
-    db_uri = os.environ.get("DATABASE_URI", "sqlite+aiosqlite:///tests/test_data.db")
+#: Engines built by this process, indexed by (database URI, async flag)
+_engines: Dict[Tuple[str, bool], Union[AsyncEngine, Engine]] = {}
 
-    engine = create_async_engine(db_uri, echo=False, future=True)
-    con = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+#: Session factories bound to the engines of `_engines`, with the same keys
+_session_factories: Dict[Tuple[str, bool], sessionmaker] = {}
 
-    logger.info(f"Using database {db_uri}")
 
-    return con
+def get_database_uri() -> str:
+    """Get the URI of the database, read from the DATABASE_URI environment variable
 
+    Returns:
+        The database URI
 
-def get_db():
+    """
+    return os.environ.get("DATABASE_URI", "sqlite+aiosqlite:///tests/test_data.db")
+
+
+def get_engine_options(db_uri: str) -> dict:
+    """Build the keyword arguments given to the engine factory.
+    The pool can be tuned with the following environment variables:
+
+    * DB_POOL_SIZE: Number of connections kept open in the pool (default 5)
+    * DB_MAX_OVERFLOW: Number of connections allowed above DB_POOL_SIZE (default 10)
+    * DB_POOL_PRE_PING: Check connections liveness before using them (default 1)
+    * DB_POOL_RECYCLE: Age in seconds after which a connection is recycled (default 1800)
+
+    The pool size options are not used with SQLite, whose dialect manages its own pool
+
+    Args:
+        db_uri: The database URI
+
+    Returns:
+        The keyword arguments for `create_engine` or `create_async_engine`
+
+    """
+    options = {
+        "echo": False,
+        "future": True,
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") not in ("0", "false", "False"),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+    }
+    if make_url(db_uri).get_backend_name() != "sqlite":
+        options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", "5"))
+        options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+
+    return options
+
+
+def get_engine(async_engine: bool = True, db_uri: str = None) -> Union[AsyncEngine, Engine]:
+    """Get the engine of the current process for the database given by DATABASE_URI.
+    The engine is built on first call, and reused afterwards
+
+    Args:
+        async_engine: True to get an `AsyncEngine`, False to get a synchronous one
+        db_uri: URI of another database to connect to. Defaults to DATABASE_URI
+
+    Returns:
+        The engine
+
+    """
+    if db_uri is None:
+        db_uri = get_database_uri()
+    key = (db_uri, async_engine)
+
+    engine = _engines.get(key, None)
+    if engine is not None:
+        return engine
+
+    url = make_url(db_uri)
+    if async_engine:
+        engine = create_async_engine(url, **get_engine_options(db_uri))
+    else:
+        url = url.set(drivername=SYNC_DRIVERS.get(url.drivername, url.drivername))
+        engine = create_engine(url, **get_engine_options(db_uri))
+
+    logger.info(f"Using database {url!r}")
+
+    _engines[key] = engine
+    _session_factories[key] = sessionmaker(
+        engine, expire_on_commit=False, class_=AsyncSession if async_engine else Session
+    )
+
+    return engine
+
+
+def get_connection(async_engine: bool = True) -> sessionmaker:
+    """Get the session factory bound to the engine returned by `get_engine`
+
+    Args:
+        async_engine: True to get `AsyncSession` objects, False to get `Session` objects
+
+    Returns:
+        The session factory
+
+    """
+    get_engine(async_engine=async_engine)
+    return _session_factories[(get_database_uri(), async_engine)]
+
+
+async def dispose_engines():
+    """Close all the connections of the engines built by this process,
+    and forget them. Meant to be called at application shutdown
+
+    """
+    for engine in _engines.values():
+        if isinstance(engine, AsyncEngine):
+            await engine.dispose()
+        else:
+            engine.dispose()
+
+    _engines.clear()
+    _session_factories.clear()
+
+
+async def get_db():
+    """fastapi dependency that yields one `AsyncSession` per request"""
     con = get_connection()
-    engine = con.kw["bind"]
-    db = Session(engine)
-    try:
+    async with con() as db:
         yield db
-    finally:
-        db.close()
+
+
+def verify_challenge_signature(vkey: Union[PublicKey, bytes], iso: str, b64_sign: str) -> bool:
+    """Verify the signature of a challenge. Meant to be run by
+    `network.backend.crypto_executor.run_crypto`
+
+    Args:
+        vkey: The verifying key of the user, or its bytes
+        iso: The challenge timestamp, as an ISO string
+        b64_sign: The challenge signature
+
+    Returns:
+        True if the signature is valid
+
+    """
+    if isinstance(vkey, bytes):
+        vkey = PublicKey.from_bytes(vkey)
+
+    hash = Hash()
+    hash.update(iso.encode(encoding="ascii"))
+
+    sign_bytes = b64decode(b64_sign.encode(encoding="ascii"))
+    signature = Signature.from_bytes(sign_bytes)
+
+    return signature.verify_digest(vkey, hash)
+
+
+async def check_challenge(
+    replay_store: "ReplayStore",
+    user_id: int,
+    vkey: PublicKey,
+    b64_hash: str,
+    b64_sign: str,
+    timeout: float,
+) -> dict:
+    """Check if the proposed challenge is valid.
+    The challenge consists in b64_hash and b64_sign.
+    The conditions to succeed in checking the challenge are :
+
+    * the signature matches the user's verifying key
+    * a datetime object can be retrieved from b64_hash
+    * this datetime object has not been used yet by the user (recorded in the replay store)
+    * this datetime object is at most timeout seconds before or after now
+
+    The returned dictionary has the following keys:
+
+    * status: 200 in case of success, 401 otherwise
+    * message: A message that explains the reason of the failure
+
+    Args:
+        replay_store: The store of the challenges already used
+        user_id: The id of the user making the challenge
+        vkey: The verifying key of the user
+        b64_hash: The challenge hash
+        b64_sign: The challenge signature
+        timeout: The timeout to invalidate old challenges
+
+    Returns:
+        A dictionary that gives the status of the check
+
+    """
+    challenge_data = challenge_to_datetime(b64_hash)
+    if challenge_data["status"] != 200:
+        return challenge_data
+
+    t_diff = datetime.now() - challenge_data["datetime"]
+    if t_diff > timedelta(seconds=timeout):
+        response = {
+            "status": 401,
+            "message": f"Challenge expired ({t_diff.total_seconds()} s elapsed)",
+        }
+        return response
+    if -t_diff > timedelta(seconds=timeout):
+        response = {
+            "status": 401,
+            "message": f"Challenge in the future ({-t_diff.total_seconds()} s ahead)",
+        }
+        return response
+
+    valid = await run_crypto(
+        verify_challenge_signature, portable_key(vkey), challenge_data["iso"], b64_sign
+    )
+    if not valid:
+        response = {
+            "status": 401,
+            "message": "Invalid challenge signature",
+        }
+        return response
+
+    # Remembered until the challenge expires, later than now + timeout if it is in the future
+    remember = timeout - t_diff.total_seconds()
+    fresh = await replay_store.check_and_add(user_id, challenge_data["iso"], remember)
+    if not fresh:
+        response = {
+            "status": 401,
+            "message": "Trying to reuse a challenge",
+        }
+        return response
+
+    response = {
+        "status": 200,
+        "message": "OK",
+    }
+    return response
 
 
 class DbUser(Base):
@@ -57,6 +276,7 @@ class DbUser(Base):
 
     verifying_key = Column(String, nullable=False)
 
+    #: Not written anymore, see `network.backend.replay_store`
     time_last_challenge = Column(DateTime(timezone=True), nullable=True)
 
     time_created = Column(DateTime(timezone=True), server_default=func.now())
@@ -67,24 +287,13 @@ class DbUser(Base):
     items = relationship("Item", back_populates="user")
 
     async def check_challenge(
-        self, session: Session, b64_hash: str, b64_sign: str, timeout: float
+        self, replay_store: "ReplayStore", b64_hash: str, b64_sign: str, timeout: float
     ) -> dict:
-        """Check if the proposed challenge is valid.
-        The challenge consists in b64_hash and b64_sign.
-        The conditions to succeed in checking the challenge are :
-
-        * the signature matches the user's verifying key
-        * a datetime object can be retrieved from b64_hash
-        * this datetime object is different from the last challenge datetime (stored in database)
-        * this datetime object is at most timeout seconds before now
-
-        The returned dictionary has the following keys:
-
-        * status: 200 in case of success, 401 otherwise
-        * message: A message that explains the reason of the failure
+        """Check if the proposed challenge is valid for this user.
+        See `network.backend.models.check_challenge`
 
         Args:
-            session: A SQLAlchemy session to update the last challenge datetime
+            replay_store: The store of the challenges already used
             b64_hash: The challenge hash
             b64_sign: The challenge signature
             timeout: The timeout to invalidate old challenges
@@ -94,54 +303,13 @@ class DbUser(Base):
 
         """
         vkey = decodeKey(self.verifying_key)
-
-        challenge_data = challenge_to_datetime(b64_hash)
-        if challenge_data["status"] != 200:
-            return challenge_data
-
-        if (
-            self.time_last_challenge is not None
-            and challenge_data["datetime"] == self.time_last_challenge
-        ):
-            response = {
-                "status": 401,
-                "message": "Trying to reuse a challenge",
-            }
-            return response
-
-        t_diff = datetime.now() - challenge_data["datetime"]
-        if t_diff > timedelta(seconds=timeout):
-            response = {
-                "status": 401,
-                "message": f"Challenge expired ({t_diff.total_seconds()} s elapsed)",
-            }
-            return response
-
-        hash = Hash()
-        hash.update(challenge_data["iso"].encode(encoding="ascii"))
-
-        sign_bytes = b64decode(b64_sign.encode(encoding="ascii"))
-        signature = Signature.from_bytes(sign_bytes)
-
-        if signature.verify_digest(vkey, hash):
-            self.time_last_challenge = challenge_data["datetime"]
-            await session.commit()
-            response = {
-                "status": 200,
-                "message": "OK",
-            }
-            return response
-        else:
-            response = {
-                "status": 401,
-                "message": "Invalid challenge signature",
-            }
-            return response
+        return await check_challenge(replay_store, self.id, vkey, b64_hash, b64_sign, timeout)
 
 
 class Item(Base):
 
     __tablename__ = "items"
+    __table_args__ = (Index("ix_items_user_id_id", "user_id", "id"),)
 
     #: Unique identifier of the session
     id = Column(Integer, nullable=False, primary_key=True)
@@ -152,8 +320,158 @@ class Item(Base):
     #: Session instance the observation belongs to
     user = relationship("DbUser", back_populates="items")
 
-    encrypted_data = Column(String, nullable=False)
+    #: Capsule and ciphertext, as given by `network.transcoding.encrypted_to_raw`.
+    #: Only set for the items stored before the blob store, see blob_hash
+    encrypted_data = Column(LargeBinary, nullable=True)
+
+    #: Key of the ciphertext in the blobs table, see `network.backend.blob_store`
+    blob_hash = Column(String, ForeignKey("blobs.hash"), nullable=True, index=True)
+
+    #: Capsule frag, as given by `network.transcoding.cfrag_to_raw`
+    cfrag = Column(LargeBinary, nullable=True)
+
+    #: Bytes of the public key of the user who shared the data
+    sender_pkey = Column(LargeBinary, nullable=True)
+
+
+class Blob(Base):
+    """A ciphertext referenced by one or more items, see `network.backend.blob_store`"""
+
+    __tablename__ = "blobs"
+
+    #: Hexadecimal SHA-256 hash of data
+    hash = Column(String, nullable=False, primary_key=True)
+
+    #: Capsule and ciphertext, as given by `network.transcoding.encrypted_to_raw`.
+    #: None for an external blob
+    data = Column(LargeBinary, nullable=True)
+
+    #: True if the blob is kept outside of the database, see `network.backend.blob_store`
+    external = Column(Boolean, nullable=False, default=False)
 
-    cfrag = Column(String, nullable=True)
+    #: Size of data (bytes)
+    size = Column(Integer, nullable=False)
 
-    sender_pkey = Column(String, nullable=True)
+    #: Number of items referencing the blob
+    refcount = Column(Integer, nullable=False, default=1)
+
+
+class Share(Base):
+    """An item shared with a user without copying the ciphertext of the source item.
+    The item of the recipient only holds the id and the owner, see
+    `network.backend.crud.select_items_data` for how it is read
+
+    """
+
+    __tablename__ = "shares"
+
+    #: Item of the recipient
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False, primary_key=True)
+
+    #: Item whose ciphertext is shared
+    source_item_id = Column(Integer, ForeignKey("items.id"), nullable=False, index=True)
+
+    #: User the item is shared with
+    recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    #: Capsule frag, as given by `network.transcoding.cfrag_to_raw`.
+    #: None for a share with a M of N threshold, whose cfrags are in the item_cfrags table
+    cfrag = Column(LargeBinary, nullable=True)
+
+    #: Bytes of the public key of the user who shared the data
+    sender_pkey = Column(LargeBinary, nullable=False)
+
+
+class ItemCfrag(Base):
+    """One of the cfrags of an item shared with a M of N threshold.
+    Such an item has a sender_pkey but no cfrag, its cfrags are stored in this table
+
+    """
+
+    __tablename__ = "item_cfrags"
+
+    #: Unique identifier of the cfrag
+    id = Column(Integer, nullable=False, primary_key=True)
+
+    #: Item the cfrag belongs to
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False, index=True)
+
+    #: Capsule frag, as given by `network.transcoding.cfrag_to_raw`
+    cfrag = Column(LargeBinary, nullable=False)
+
+
+class ShareJob(Base):
+    """A share waiting to be re-encrypted by a proxy worker, see `network.backend.proxy_worker`"""
+
+    __tablename__ = "share_jobs"
+
+    #: Status of a job waiting for a worker
+    PENDING = "pending"
+    #: Status of a job claimed by a worker
+    RUNNING = "running"
+    #: Status of a job whose item has been created for the recipient
+    DONE = "done"
+    #: Status of a job that could not be re-encrypted
+    FAILED = "failed"
+
+    #: Unique identifier of the job
+    id = Column(Integer, nullable=False, primary_key=True)
+
+    #: User who shares the item
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    #: User the item is shared with
+    recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    #: Item to share. Not a foreign key, as the item may be deleted before the job is run
+    source_item_id = Column(Integer, nullable=False)
+
+    #: List of the kfrags of the share, as given by `network.transcoding.kfrag_to_json`
+    kfrags = Column(JSON, nullable=False)
+
+    #: One of PENDING, RUNNING, DONE, FAILED
+    status = Column(String, nullable=False, default=PENDING, index=True)
+
+    #: Name of the worker that claimed the job
+    worker = Column(String, nullable=True)
+
+    #: Time when the job was claimed (s since epoch)
+    time_claimed = Column(Float, nullable=True)
+
+    #: Item created for the recipient, once the job is done. Not a foreign key either
+    item_id = Column(Integer, nullable=True)
+
+    #: Reason of the failure of the job
+    error = Column(String, nullable=True)
+
+    time_created = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ItemChange(Base):
+    """An event in the change feed of the items of a user, see `network.backend.change_feed`"""
+
+    __tablename__ = "item_changes"
+    __table_args__ = (Index("ix_item_changes_user_id_id", "user_id", "id"),)
+
+    #: Item created by its owner
+    CREATED = "created"
+    #: Item created by a share from another user
+    SHARED = "shared"
+    #: Item whose data has been replaced
+    UPDATED = "updated"
+    #: Item deleted
+    DELETED = "deleted"
+
+    #: Sequence number of the event, increasing with time
+    id = Column(Integer, nullable=False, primary_key=True)
+
+    #: Owner of the item
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    #: Item concerned. Not a foreign key, as deleted items keep their events
+    item_id = Column(Integer, nullable=False)
+
+    #: One of CREATED, SHARED, UPDATED, DELETED
+    kind = Column(String, nullable=False)
+
+    time_created = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import os
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import get_db
+from .auth_depend import challenge_auth
+from .notifier import get_notifier
+
+
+#: Time after which an idle stream of notifications gets a comment line, to keep it open (s)
+KEEPALIVE_INTERVAL = float(os.environ.get("NOTIFICATION_KEEPALIVE", "15"))
+
+
+router = APIRouter(prefix="/notifications", tags=["notifications"])
+
+
+@router.get(
+    "",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+    description=(
+        "Stream of server-sent events, one per change of an item of user. The event type"
+        " is the kind of change (created, shared, updated, deleted) and its data is a JSON"
+        " object with item_id and kind keys. A client that lags behind loses events,"
+        " GET /item/changes lists all the changes"
+    ),
+)
+async def stream_notifications(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    # The stream can last for hours, it shall not hold a database connection
+    await db.close()
+
+    notifier = get_notifier()
+    queue = await notifier.subscribe(user_id)
+
+    async def _events():
+        try:
+            while True:
+                try:
+                    change = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+
+                data = json.dumps({"item_id": change["item_id"], "kind": change["kind"]})
+                yield f"event: {change['kind']}\ndata: {data}\n\n"
+        finally:
+            notifier.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        _events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
@@ -0,0 +1,275 @@
+"""Push notification of the changes of the items to their owners.
+
+The changes recorded by `network.backend.change_feed` are dispatched to the clients of the
+owner of the items connected to GET /notifications, each one through an `asyncio.Queue`.
+The way changes reach the worker processes is given by the NOTIFIER environment variable:
+
+* memory (default): the changes are dispatched by the process that commits them.
+  Only suitable for a server running a single worker process
+* poll: each process polls the item_changes table every NOTIFIER_POLL_INTERVAL seconds
+  (default 1). Works with any database, e.g. a SQLite file shared by several workers
+* postgres: the changes are sent with NOTIFY when their transaction commits,
+  and each process receives them with LISTEN
+
+A notification tells that an item changed. A client that lags behind loses notifications,
+it catches up with GET /item/changes, which stays the reference
+
+"""
+import asyncio
+import json
+import os
+from typing import Dict, List, Set, Tuple, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import logger
+from . import models
+
+
+#: Maximum number of notifications waiting to be sent to one client
+NOTIFICATION_QUEUE_SIZE = 1000
+
+
+def _put(queue: asyncio.Queue, change: dict):
+    try:
+        queue.put_nowait(change)
+    except asyncio.QueueFull:
+        pass
+
+
+class Notifier(object):
+    """Base class of the notifiers. Dispatches the changes to the subscribers of this process"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._started = False
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Subscribe to the changes of the items of a user. The notifier is started if needed
+
+        Args:
+            user_id: The id of the user
+
+        Returns:
+            The queue receiving the changes, as dictionaries with keys user_id, item_id and kind
+
+        """
+        if not self._started:
+            self._started = True
+            await self.start()
+
+        queue = asyncio.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        """Stop sending changes to a queue returned by `subscribe`
+
+        Args:
+            user_id: The id of the user
+            queue: The queue
+
+        """
+        subscribers = self._subscribers.get(user_id, set())
+        subscribers.difference_update([sub for sub in subscribers if sub[1] is queue])
+        if len(subscribers) == 0:
+            self._subscribers.pop(user_id, None)
+
+    def dispatch(self, changes: List[dict]):
+        """Send changes to the subscribers of this process, from any thread
+
+        Args:
+            changes: The changes, as dictionaries with keys user_id, item_id and kind
+
+        """
+        for change in changes:
+            for loop, queue in list(self._subscribers.get(change["user_id"], ())):
+                loop.call_soon_threadsafe(_put, queue, change)
+
+    async def record(self, db: AsyncSession, changes: List[dict]):
+        """Called by `network.backend.change_feed.record_changes` in the transaction
+        recording changes
+
+        Args:
+            db: The database session
+            changes: The changes, as dictionaries with keys user_id, item_id and kind
+
+        """
+        pass
+
+    def publish(self, changes: List[dict]):
+        """Called once the transaction that recorded changes is committed
+
+        Args:
+            changes: The changes, as dictionaries with keys user_id, item_id and kind
+
+        """
+        pass
+
+    async def start(self):
+        """Start receiving the changes made by the other processes"""
+        pass
+
+    async def stop(self):
+        """Stop receiving the changes made by the other processes"""
+        pass
+
+
+class MemoryNotifier(Notifier):
+    """Notifier dispatching the changes committed by this process"""
+
+    def publish(self, changes: List[dict]):
+        self.dispatch(changes)
+
+
+class PollingNotifier(Notifier):
+    """Notifier polling the item_changes table for the changes committed by any process
+
+    Args:
+        interval: Time between two polls (s)
+
+    """
+
+    #: Maximum number of changes read by one poll
+    BATCH_SIZE = 1000
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._last_id = 0
+        self._task = None
+
+    async def start(self):
+        con = models.get_connection()
+        async with con() as db:
+            stmt = select(func.coalesce(func.max(models.ItemChange.id), 0))
+            self._last_id = (await db.execute(stmt)).scalar_one()
+        self._task = asyncio.ensure_future(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def poll(self) -> int:
+        """Dispatch the changes committed since the previous poll
+
+        Returns:
+            The number of changes dispatched
+
+        """
+        con = models.get_connection()
+        async with con() as db:
+            stmt = (
+                select(
+                    models.ItemChange.id,
+                    models.ItemChange.user_id,
+                    models.ItemChange.item_id,
+                    models.ItemChange.kind,
+                )
+                .where(models.ItemChange.id > self._last_id)
+                .order_by(models.ItemChange.id)
+                .limit(self.BATCH_SIZE)
+            )
+            rows = (await db.execute(stmt)).all()
+
+        if len(rows) > 0:
+            self._last_id = rows[-1].id
+            self.dispatch(
+                [{"user_id": row.user_id, "item_id": row.item_id, "kind": row.kind} for row in rows]
+            )
+        return len(rows)
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                if await self.poll() == self.BATCH_SIZE:
+                    continue
+            except Exception as e:
+                logger.error(f"Polling the item changes failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+
+class PostgresNotifier(Notifier):
+    """Notifier using the NOTIFY and LISTEN commands of PostgreSQL.
+    The changes are sent in the transaction that records them, and delivered when it commits
+
+    """
+
+    #: Channel of the notifications
+    CHANNEL = "item_changes"
+
+    #: Maximum number of changes sent in one notification, whose payload is limited to 8 kB
+    BATCH_SIZE = 100
+
+    def __init__(self):
+        super().__init__()
+        self._conn = None
+
+    async def record(self, db: AsyncSession, changes: List[dict]):
+        for offset in range(0, len(changes), self.BATCH_SIZE):
+            payload = json.dumps(
+                [
+                    [change["user_id"], change["item_id"], change["kind"]]
+                    for change in changes[offset : offset + self.BATCH_SIZE]
+                ]
+            )
+            await db.execute(select(func.pg_notify(self.CHANNEL, payload)))
+
+    async def start(self):
+        # A connection of its own, kept out of the pool while listening
+        self._conn = await models.get_engine().connect()
+        raw = await self._conn.get_raw_connection()
+        await raw.driver_connection.add_listener(self.CHANNEL, self._on_notify)
+
+    async def stop(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        self.dispatch(
+            [
+                {"user_id": user_id, "item_id": item_id, "kind": kind}
+                for user_id, item_id, kind in json.loads(payload)
+            ]
+        )
+
+
+#: Notifier of this process, built by `get_notifier`
+_notifier: Union[Notifier, None] = None
+
+
+def get_notifier() -> Notifier:
+    """Get the notifier of this process, given by the NOTIFIER environment variable:
+    memory (default), poll or postgres. It is built on first call
+
+    Returns:
+        The notifier
+
+    """
+    global _notifier
+
+    if _notifier is None:
+        kind = os.environ.get("NOTIFIER", "memory")
+        if kind == "memory":
+            _notifier = MemoryNotifier()
+        elif kind == "poll":
+            _notifier = PollingNotifier(float(os.environ.get("NOTIFIER_POLL_INTERVAL", "1")))
+        elif kind == "postgres":
+            _notifier = PostgresNotifier()
+        else:
+            raise ValueError(f"Unknown NOTIFIER {kind!r}, expected memory, poll or postgres")
+        logger.info(f"Notifying the item changes with {_notifier.__class__.__name__}")
+
+    return _notifier
+
+
+async def stop_notifier():
+    """Stop the notifier of this process, and forget it. Meant to be called at shutdown"""
+    global _notifier
+
+    if _notifier is not None:
+        await _notifier.stop()
+        _notifier = None
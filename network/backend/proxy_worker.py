@@ -0,0 +1,194 @@
+"""Proxy worker, which re-encrypts the shares submitted to POST /share.
+
+The jobs are stored in the share_jobs table, so that any number of workers can be run
+against the database of the server with `network_server run-proxy`. A worker claims a job
+by switching its status from pending to running with a conditional UPDATE, which only one
+worker can win, with SQLite as well as with PostgreSQL.
+A job claimed by a worker that died is claimed again once JOB_TIMEOUT seconds elapsed.
+The outcome of a job is only recorded by the worker that claimed it last, see `finish_job`
+
+"""
+import asyncio
+from base64 import b64decode
+import os
+import socket
+import time
+from typing import List
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import logger
+from . import crud, models
+
+#: Time after which a running job is considered abandoned by its worker (s)
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "300"))
+
+
+def get_worker_name() -> str:
+    """Get the name that identifies this worker in the share_jobs table
+
+    Returns:
+        The name of the worker, as host:pid
+
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def claim_jobs(db: AsyncSession, worker: str, batch_size: int) -> List[int]:
+    """Claim pending jobs, or jobs abandoned by their worker
+
+    Args:
+        db: The database session
+        worker: The name of the worker
+        batch_size: Maximum number of jobs to claim
+
+    Returns:
+        The ids of the jobs claimed by the worker
+
+    """
+    now = time.time()
+    claimable = or_(
+        models.ShareJob.status == models.ShareJob.PENDING,
+        (models.ShareJob.status == models.ShareJob.RUNNING)
+        & (models.ShareJob.time_claimed < now - JOB_TIMEOUT),
+    )
+    stmt = select(models.ShareJob.id).where(claimable).order_by(models.ShareJob.id)
+    candidates = (await db.execute(stmt.limit(batch_size))).scalars().all()
+
+    claimed = []
+    for job_id in candidates:
+        stmt = (
+            update(models.ShareJob)
+            .where(models.ShareJob.id == job_id)
+            .where(claimable)
+            .values(status=models.ShareJob.RUNNING, worker=worker, time_claimed=now)
+        )
+        res = await db.execute(stmt)
+        if res.rowcount == 1:
+            claimed.append(job_id)
+    await db.commit()
+
+    return claimed
+
+
+async def finish_job(db: AsyncSession, job: models.ShareJob, status: str, **values) -> bool:
+    """Record the outcome of a job with the changes made in the session, and commit them,
+    unless the job has been claimed again by another worker after JOB_TIMEOUT seconds.
+    In that case, the changes are rolled back so that the recipient does not get the item twice
+
+    Args:
+        db: The database session
+        job: A job claimed by this worker
+        status: DONE or FAILED
+        values: Other columns of the job to update
+
+    Returns:
+        True if the outcome is recorded
+
+    """
+    job_id = job.id
+    stmt = (
+        update(models.ShareJob)
+        .where(models.ShareJob.id == job_id)
+        .where(models.ShareJob.status == models.ShareJob.RUNNING)
+        .where(models.ShareJob.worker == job.worker)
+        .values(status=status, **values)
+    )
+    res = await db.execute(stmt)
+    if res.rowcount != 1:
+        await db.rollback()
+        logger.warning(f"Share job {job_id} has been claimed again, its outcome is discarded")
+        return False
+
+    await db.commit()
+    return True
+
+
+async def process_job(db: AsyncSession, job: models.ShareJob):
+    """Re-encrypt the item of a job for its recipient, and record the outcome of the job
+
+    Args:
+        db: The database session
+        job: A job claimed by this worker
+
+    """
+    db_item = await crud.get_item_data(db, job.source_item_id)
+    if db_item is None:
+        await finish_job(
+            db, job, models.ShareJob.FAILED, error=f"Item {job.source_item_id} not found"
+        )
+        return
+
+    db_sender = await crud.get_user(db, job.sender_id)
+    if db_sender is None:
+        await finish_job(db, job, models.ShareJob.FAILED, error=f"User {job.sender_id} not found")
+        return
+
+    try:
+        db_cfrags = await crud.reencrypt(crud.read_item_payload(db_item), job.kfrags)
+    except Exception as e:
+        logger.error(f"Share job {job.id} failed: {e!r}")
+        await finish_job(db, job, models.ShareJob.FAILED, error=f"Re-encryption failed: {e}")
+        return
+
+    new_item = crud.build_shared_item(job.recipient_id, db_item)
+    db.add(new_item)
+    await db.flush()
+    if not await crud.add_shares(
+        db, [new_item], [db_item], b64decode(db_sender.public_key), [db_cfrags]
+    ):
+        await db.rollback()
+        await db.refresh(job)
+        await finish_job(
+            db, job, models.ShareJob.FAILED, error=f"Item {job.source_item_id} not found"
+        )
+        return
+
+    await finish_job(db, job, models.ShareJob.DONE, item_id=new_item.id)
+
+
+async def process_jobs(batch_size: int = 10) -> int:
+    """Claim and process one batch of jobs, whose re-encryptions run concurrently
+    through `network.backend.crypto_executor.run_crypto`
+
+    Args:
+        batch_size: Maximum number of jobs to process
+
+    Returns:
+        The number of jobs processed
+
+    """
+    worker = get_worker_name()
+    con = models.get_connection()
+    async with con() as db:
+        job_ids = await claim_jobs(db, worker, batch_size)
+
+    async def _process(job_id: int):
+        # One session per job, as the jobs are processed concurrently
+        async with con() as db:
+            job = await db.get(models.ShareJob, job_id)
+            await process_job(db, job)
+
+    await asyncio.gather(*[_process(job_id) for job_id in job_ids])
+    return len(job_ids)
+
+
+async def run_proxy(poll_interval: float = 1.0, batch_size: int = 10, once: bool = False):
+    """Process the jobs of the share_jobs table until cancelled
+
+    Args:
+        poll_interval: Time to wait when no job is pending (s)
+        batch_size: Maximum number of jobs processed concurrently
+        once: Stop when no job is pending
+
+    """
+    logger.info(f"Proxy worker {get_worker_name()} started")
+    while True:
+        count = await process_jobs(batch_size=batch_size)
+        if count > 0:
+            logger.info(f"Processed {count} share jobs")
+            continue
+        if once:
+            break
+        await asyncio.sleep(poll_interval)
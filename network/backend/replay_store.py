@@ -0,0 +1,143 @@
+from abc import ABC, abstractmethod
+import heapq
+import os
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, delete, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+
+from .models import get_engine
+
+
+class ReplayStore(ABC):
+    """Base class of the stores that remember the challenges already used,
+    for as long as they are valid
+
+    """
+
+    @abstractmethod
+    async def check_and_add(self, user_id: int, challenge: str, timeout: float) -> bool:
+        """Record a challenge, unless it has already been recorded
+
+        Args:
+            user_id: The id of the user making the challenge
+            challenge: The challenge timestamp, as an ISO string
+            timeout: Time during which the challenge shall be remembered (s)
+
+        Returns:
+            True if the challenge was not known, False if it is a replay
+
+        """
+
+
+class MemoryReplayStore(ReplayStore):
+    """Sliding window of the challenges seen by this process.
+    Only suitable for a server running a single worker process
+
+    """
+
+    def __init__(self):
+        self._expires: Dict[Tuple[int, str], float] = {}
+        self._window: List[Tuple[float, Tuple[int, str]]] = []
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    async def check_and_add(self, user_id: int, challenge: str, timeout: float) -> bool:
+        now = time.monotonic()
+        while self._window and self._window[0][0] < now:
+            _, key = heapq.heappop(self._window)
+            del self._expires[key]
+
+        key = (user_id, challenge)
+        if key in self._expires:
+            return False
+
+        expires = now + timeout
+        self._expires[key] = expires
+        heapq.heappush(self._window, (expires, key))
+
+        return True
+
+
+class SqlReplayStore(ReplayStore):
+    """Store of the challenges in a database table, shared by all the worker processes.
+    With PostgreSQL, the table is UNLOGGED since losing it in a crash is harmless.
+    With SQLite, the database file can be shared by the workers of one host
+
+    Args:
+        db_uri: URI of the database holding the table
+
+    """
+
+    def __init__(self, db_uri: str):
+        self.db_uri = db_uri
+
+        if make_url(db_uri).get_backend_name() == "postgresql":
+            prefixes = ["UNLOGGED"]
+        else:
+            prefixes = []
+
+        self.metadata = MetaData()
+        self.table = Table(
+            "replay_challenges",
+            self.metadata,
+            Column("user_id", Integer, primary_key=True),
+            Column("challenge", String, primary_key=True),
+            Column("expires", Float, nullable=False, index=True),
+            prefixes=prefixes,
+        )
+
+        self._created = False
+        self._next_purge = 0.0
+
+    async def check_and_add(self, user_id: int, challenge: str, timeout: float) -> bool:
+        engine = get_engine(db_uri=self.db_uri)
+        now = time.time()
+
+        try:
+            async with engine.begin() as conn:
+                if not self._created:
+                    await conn.run_sync(self.metadata.create_all)
+                    self._created = True
+
+                table = self.table
+                if now > self._next_purge:
+                    await conn.execute(delete(table).where(table.c.expires < now))
+                    self._next_purge = now + timeout
+                else:
+                    await conn.execute(
+                        delete(table)
+                        .where(table.c.user_id == user_id)
+                        .where(table.c.challenge == challenge)
+                        .where(table.c.expires < now)
+                    )
+
+                await conn.execute(
+                    insert(table).values(
+                        user_id=user_id, challenge=challenge, expires=now + timeout
+                    )
+                )
+        except IntegrityError:
+            return False
+
+        return True
+
+
+def get_replay_store() -> ReplayStore:
+    """Build the replay store given by the REPLAY_STORE environment variable:
+
+    * memory (default): a `MemoryReplayStore`
+    * any other value is a database URI, used to build a `SqlReplayStore`
+
+    Returns:
+        The replay store
+
+    """
+    replay_uri = os.environ.get("REPLAY_STORE", "memory")
+    if replay_uri == "memory":
+        return MemoryReplayStore()
+    else:
+        return SqlReplayStore(replay_uri)
@@ -0,0 +1,98 @@
+from base64 import urlsafe_b64encode
+import binascii
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from typing import Tuple
+
+from .. import logger
+
+
+def get_token_secret() -> bytes:
+    """Get the key used to sign the session tokens, read from the TOKEN_SECRET
+    environment variable. If not set, a random key is drawn, so that the tokens are
+    only valid for the current process
+
+    Returns:
+        The signing key
+
+    """
+    secret = os.environ.get("TOKEN_SECRET", None)
+    if secret is None:
+        logger.warning("TOKEN_SECRET not set, session tokens will only be valid in this process")
+        return secrets.token_bytes(32)
+
+    return secret.encode(encoding="utf-8")
+
+
+#: Key used to sign the session tokens
+TOKEN_SECRET = get_token_secret()
+
+#: Lifetime of the session tokens (s)
+TOKEN_LIFETIME = float(os.environ.get("TOKEN_LIFETIME", "300"))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(TOKEN_SECRET, payload.encode(encoding="ascii"), hashlib.sha256).digest()
+    return urlsafe_b64encode(digest).decode(encoding="ascii")
+
+
+def mint_token(user_id: int, lifetime: float = TOKEN_LIFETIME) -> Tuple[str, float]:
+    """Build a session token for a user, that can be sent instead of a challenge
+
+    Args:
+        user_id: The id of the authenticated user
+        lifetime: Lifetime of the token (s)
+
+    Returns:
+        The token, formatted as <user_id>.<expiration timestamp>.<b64 HMAC>
+        The lifetime of the token (s)
+
+    """
+    payload = f"{user_id}.{int(time.time() + lifetime)}"
+    token = f"{payload}.{_sign(payload)}"
+    return token, lifetime
+
+
+def check_token(token: str) -> dict:
+    """Check a session token built by `mint_token`.
+    If it is valid, return a dictionary whose key is:
+
+    * user_id: The id of the authenticated user
+
+    Otherwise, the dictionary has the keys:
+
+    * status: 401
+    * message: A message that explains the reason of the failure
+
+    Args:
+        token: The token
+
+    Returns:
+        The result of the check as a dictionary
+
+    """
+    if token.count(".") != 2:
+        response = {"status": 401, "message": "Invalid format for session token"}
+        return response
+
+    s_user_id, s_expires, b64_hmac = token.split(".")
+    payload = f"{s_user_id}.{s_expires}"
+    try:
+        valid = hmac.compare_digest(_sign(payload), b64_hmac)
+        user_id, expires = int(s_user_id), int(s_expires)
+    except (ValueError, TypeError, binascii.Error):
+        valid = False
+
+    if not valid:
+        response = {"status": 401, "message": "Invalid session token signature"}
+        return response
+
+    if expires < time.time():
+        response = {"status": 401, "message": "Session token expired"}
+        return response
+
+    response = {"user_id": user_id}
+    return response
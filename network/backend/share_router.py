@@ -1,33 +1,144 @@
+from typing import List
+
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import schemas
 from . import crud
-from .models import get_db, get_connection, DbUser, Item
+from .models import get_db, DbUser
 from .auth_depend import challenge_auth
+from .item_router import DECODING_ERRORS
 
 
 router = APIRouter(prefix="/share", tags=["share"])
 
+#: Maximum number of shares in one request to POST /share/batch
+MAX_BATCH_SIZE = 1000
+
+
+@router.post(
+    "/",
+    status_code=202,
+    response_model=schemas.ShareJobModel,
+    description=(
+        "Submits the share of one item of the user. The re-encryption is done later by a proxy"
+        " worker (see network_server run-proxy), whose progress is given by GET /share/jobs/{id}"
+    ),
+)
+async def post_share_job(
+    share: schemas.ShareModel,
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    if len(share.kfrag_list()) == 0:
+        raise HTTPException(status_code=422, detail=f"No kfrag given to share item {share.item_id}")
+
+    db_item = await crud.get_user_item(db, user_id, share.item_id)
+    if db_item is None:
+        raise HTTPException(status_code=404, detail=f"Item {share.item_id} not found")
+
+    db_recipient = await crud.get_user(db, share.recipient_id)
+    if db_recipient is None:
+        raise HTTPException(
+            status_code=404, detail=f"Recipient user {share.recipient_id} not found"
+        )
+
+    return await crud.create_share_job(db, user_id, share)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=schemas.ShareJobModel,
+    description="Gives the status of a share submitted by the user to POST /share/",
+)
+async def get_share_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    job = await crud.get_share_job(db, user_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Share job {job_id} not found")
+
+    return job
+
+
+@router.post(
+    "/batch",
+    response_model=List[schemas.ItemIdModel],
+    description=(
+        "Shares several items of the user with several recipients in one transaction."
+        " The ids of the created items are returned in the order of the shares"
+    ),
+)
+async def post_reencrypted_batch(
+    shares: List[schemas.ShareModel],
+    db: AsyncSession = Depends(get_db),
+    user_id: int = Depends(challenge_auth),
+):
+    if len(shares) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"Batch too large ({len(shares)} > {MAX_BATCH_SIZE} shares)"
+        )
+
+    for share in shares:
+        if len(share.kfrag_list()) == 0:
+            raise HTTPException(
+                status_code=422, detail=f"No kfrag given to share item {share.item_id}"
+            )
+
+    item_ids = list({share.item_id for share in shares})
+    recipient_ids = list({share.recipient_id for share in shares})
+
+    db_items = await crud.get_user_items_by_id(db, user_id, item_ids)
+    db_users = await crud.get_users_by_id(db, recipient_ids + [user_id])
+
+    for item_id in item_ids:
+        if item_id not in db_items.keys():
+            raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
+
+    for recipient_id in recipient_ids:
+        if recipient_id not in db_users.keys():
+            raise HTTPException(status_code=404, detail=f"Recipient user {recipient_id} not found")
+
+    sender = schemas.UserModel.fromORM(db_users[user_id])
+
+    try:
+        new_item_ids = await crud.post_shared_items(db, sender, shares, db_items)
+    except DECODING_ERRORS:
+        raise HTTPException(status_code=422, detail="Invalid kfrag")
+    if new_item_ids is None:
+        raise HTTPException(status_code=404, detail="A shared item has been deleted meanwhile")
+
+    return [
+        schemas.ItemIdModel(id=new_item_id, user_id=share.recipient_id)
+        for new_item_id, share in zip(new_item_ids, shares)
+    ]
+
 
 @router.post(
     "/{item_id}/{recipient_id}",
     response_model=schemas.ItemModel,
-    description="Creates one item data for user",
+    description=(
+        "Creates one item data for user. The body holds either one kfrag,"
+        " or the N kfrags of a M of N share which are re-encrypted in parallel"
+    ),
 )
 async def post_reencrypted_data(
     request: Request,
     item_id: int,
     recipient_id: int,
     kfrag: schemas.KfragModel,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
-    con = get_connection()
-    async with con() as session:
-        db_item = session.query(Item).filter(Item.id == item_id).first()
-        db_sender: DbUser = await session.query(DbUser).filter(DbUser.id == user_id).first()
-        db_recipient: DbUser = await session.query(DbUser).filter(DbUser.id == recipient_id).first()
+    db_kfrags = kfrag.kfrag_list()
+    if len(db_kfrags) == 0:
+        raise HTTPException(status_code=422, detail="No kfrag given")
+
+    db_item = await crud.get_user_item_data(db, user_id, item_id)
+    db_sender: DbUser = await crud.get_user(db, user_id)
+    db_recipient: DbUser = await crud.get_user(db, recipient_id)
 
     if db_item is None:
         raise HTTPException(status_code=404, detail=f"Item {item_id} not found")
@@ -38,10 +149,17 @@ async def post_reencrypted_data(
     sender = schemas.UserModel.fromORM(db_sender)
     recipient = schemas.UserModel.fromORM(db_recipient)
 
-    return crud.post_shared_item(
-        db=db,
-        sender=sender,
-        recipient=recipient,
-        db_kfrag=kfrag.kfrag,
-        encrypted_data=db_item.encrypted_data,
-    )
+    try:
+        item = await crud.post_shared_item(
+            db=db,
+            sender=sender,
+            recipient=recipient,
+            db_kfrags=db_kfrags,
+            source_item=db_item,
+        )
+    except DECODING_ERRORS:
+        raise HTTPException(status_code=422, detail="Invalid kfrag")
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"Item {item_id} has been deleted meanwhile")
+
+    return item
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from umbral import PublicKey
+
+from . import crud
+from .models import DbUser
+from ..transcoding import decodeKey
+
+
+@dataclass
+class CachedUser:
+    #: The decoded verifying key of the user
+    verifying_key: PublicKey
+    #: Administrator flag
+    admin: bool
+    #: Time (as given by time.monotonic) after which the entry shall be reloaded
+    expires: float
+
+
+class UserCache(object):
+    """Bounded LRU cache of the users data needed for authentication, keyed by user id.
+    Entries are dropped after ttl seconds, or as soon as the user row is updated or deleted
+    by this process
+
+    Args:
+        maxsize: Maximum number of users in the cache
+        ttl: Lifetime of an entry (s)
+
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, CachedUser]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        """Get a user from the cache, without database access
+
+        Args:
+            user_id: The id of the user
+
+        Returns:
+            The cached user, or None if absent or expired
+
+        """
+        entry = self._entries.get(user_id, None)
+        if entry is None:
+            return None
+
+        if entry.expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def put(self, db_user: DbUser) -> CachedUser:
+        """Decode the verifying key of a user and store it in the cache
+
+        Args:
+            db_user: Database record of the user
+
+        Returns:
+            The cached user
+
+        """
+        entry = CachedUser(
+            verifying_key=decodeKey(db_user.verifying_key),
+            admin=db_user.admin,
+            expires=time.monotonic() + self.ttl,
+        )
+        self._entries[db_user.id] = entry
+        self._entries.move_to_end(db_user.id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        return entry
+
+    async def load(self, db: AsyncSession, user_id: int) -> Optional[CachedUser]:
+        """Get a user from the cache, reading it from the database if needed
+
+        Args:
+            db: A SQLAlchemy session used in case of cache miss
+            user_id: The id of the user
+
+        Returns:
+            The cached user, or None if the user does not exist
+
+        """
+        entry = self.get(user_id)
+        if entry is not None:
+            return entry
+
+        db_user = await crud.get_user(db, user_id)
+        if db_user is None:
+            return None
+
+        return self.put(db_user)
+
+    def invalidate(self, user_id: int):
+        """Remove a user from the cache
+
+        Args:
+            user_id: The id of the user
+
+        """
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Remove all the users from the cache"""
+        self._entries.clear()
+
+
+user_cache = UserCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("USER_CACHE_TTL", "300")),
+)
+
+
+@event.listens_for(DbUser, "after_update")
+def _invalidate_updated_user(mapper, connection, target: DbUser):
+    state = inspect(target)
+    if state.attrs.verifying_key.history.has_changes() or state.attrs.admin.history.has_changes():
+        user_cache.invalidate(target.id)
+
+
+@event.listens_for(DbUser, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target: DbUser):
+    user_cache.invalidate(target.id)
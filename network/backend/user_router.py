@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import schemas
 from . import crud
-from .models import get_db, get_connection, DbUser
-from .auth_depend import challenge_auth
+from .models import get_db
+from .auth_depend import challenge_auth, challenge_only_auth
+from .session_token import mint_token
+from .user_cache import user_cache
 
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -17,16 +19,32 @@ router = APIRouter(prefix="/users", tags=["users"])
 )
 async def create_user(
     user: schemas.UserModel,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user_id: int = Depends(challenge_auth),
 ):
-    con = get_connection()
-    async with con() as session:
-        db_issuer: DbUser = await session.query(DbUser).filter(DbUser.id == user_id).first()
-
-    if not db_issuer.admin:
+    issuer = await user_cache.load(db, user_id)
+    if issuer is None:
+        # The user has been deleted since the authentication
+        raise HTTPException(
+            status_code=401, detail="The user making the challenge could not be found"
+        )
+
+    if not issuer.admin:
         raise HTTPException(status_code=403, detail="Only an admin can create a user")
 
-    new_user = crud.create_user(db=db, user=user)
+    new_user = await crud.create_user(db=db, user=user)
 
     return new_user
+
+
+@router.post(
+    "/token",
+    response_model=schemas.TokenModel,
+    description="Exchanges a challenge for a short-lived session token",
+)
+async def create_token(
+    user_id: int = Depends(challenge_only_auth),
+):
+    token, lifetime = mint_token(user_id)
+
+    return schemas.TokenModel(token=token, lifetime=lifetime)
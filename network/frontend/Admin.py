@@ -1,8 +1,6 @@
 from pathlib import Path
 import json
 
-import requests
-
 from .User import User
 
 
@@ -12,6 +10,12 @@ class Admin(User):
     Args:
         server_url: URL of the server
         config_file: File to read to instanciate the user
+        use_token: Exchange a challenge for a session token, and reuse it until it expires
+        pool_size: Maximum number of connections kept open to the server
+        http2: Use HTTP/2 if the server supports it. Requires the h2 package
+        timeout: Timeout of the requests (s), None to wait indefinitely
+        cache_file: SQLite file of a `network.frontend.ItemCache.ItemCache`, where the items
+            loaded one by one are kept encrypted and revalidated with conditional requests
 
     """
 
@@ -29,13 +33,24 @@ class Admin(User):
         with open(public_file, "r") as f:
             user_data = json.load(f)
         user_data["admin"] = admin
-        challenge_str = self.build_challenge()
-        r = requests.post(
-            f"{self.server_url}/users/", json=user_data, headers={"Challenge": challenge_str}
-        )
+        r = self._request("POST", "/users/", json=user_data)
         if r.status_code != 200:
             raise AssertionError(r.json()["detail"])
 
         user_id = r.json()["id"]
 
         return user_id
+
+    def getBlobStats(self) -> dict:
+        """Get the deduplication achieved by the blob store of the server
+
+        Returns:
+            A dictionary with keys 'blobs', 'references', 'stored_bytes', 'logical_bytes'
+            and 'dedup_ratio'
+
+        """
+        r = self._request("GET", "/admin/blobs")
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()
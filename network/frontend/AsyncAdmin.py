@@ -0,0 +1,54 @@
+from pathlib import Path
+import json
+
+from .AsyncUser import AsyncUser
+
+
+class AsyncAdmin(AsyncUser):
+    """Create an admin user, whose requests to the server are awaitable
+
+    Args:
+        server_url: URL of the server
+        config_file: File to read to instanciate the user
+        use_token: Exchange a challenge for a session token, and reuse it until it expires
+        pool_size: Maximum number of connections kept open to the server
+        http2: Use HTTP/2 if the server supports it. Requires the h2 package
+        timeout: Timeout of the requests (s), None to wait indefinitely
+        cache_file: SQLite file of a `network.frontend.ItemCache.ItemCache`, where the items
+            loaded one by one are kept encrypted and revalidated with conditional requests
+
+    """
+
+    async def createUser(self, public_file: Path, admin: bool = False):
+        """Create a new user from its public file
+
+        Args:
+            public_file: Public file created with `network.frontend.User.to_public_file`
+            admin: Flag to promote the user as admin
+
+        Returns:
+            The id of the new user
+
+        """
+        with open(public_file, "r") as f:
+            user_data = json.load(f)
+        user_data["admin"] = admin
+        r = await self._request("POST", "/users/", json=user_data)
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()["id"]
+
+    async def getBlobStats(self) -> dict:
+        """Get the deduplication achieved by the blob store of the server
+
+        Returns:
+            A dictionary with keys 'blobs', 'references', 'stored_bytes', 'logical_bytes'
+            and 'dedup_ratio'
+
+        """
+        r = await self._request("GET", "/admin/blobs")
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()
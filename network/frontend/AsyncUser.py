@@ -0,0 +1,614 @@
+import asyncio
+import json
+from pathlib import Path
+import time
+from typing import AsyncIterator, Dict, List
+
+import httpx
+from umbral import Capsule, PublicKey
+from umbral.dem import DEM
+
+from .. import schemas
+from ..transcoding import encrypted_to_raw
+from ..streaming import (
+    STREAM_CHUNK_SIZE,
+    STREAM_KDF_INFO,
+    StreamSource,
+    aiter_sized,
+    decrypt_frame,
+)
+from .User import User
+
+
+class AsyncUser(User):
+    """Create a user whose requests to the server are awaitable, so that many of them
+    can be in flight at once. The server methods of `network.frontend.User.User`
+    are coroutines here, and the decryptions run in the default executor of the event loop
+
+    Args:
+        server_url: URL of the server
+        config_file: File to read to instanciate the user
+        use_token: Exchange a challenge for a session token, and reuse it until it expires.
+            Otherwise, a challenge is built for each request
+        pool_size: Maximum number of connections kept open to the server
+        http2: Use HTTP/2 if the server supports it. Requires the h2 package,
+            installed with the http2 extra
+        timeout: Timeout of the requests (s), None to wait indefinitely
+        cache_file: SQLite file of a `network.frontend.ItemCache.ItemCache`, where the items
+            loaded one by one are kept encrypted and revalidated with conditional requests
+
+    The connections are closed by `network.frontend.AsyncUser.AsyncUser.close`,
+    or when leaving an async with block:
+
+        async with AsyncUser(server_url=url, config_file=path) as user:
+            items = await user.loadItems(ids, concurrency=32)
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = None
+
+    def __enter__(self):
+        raise TypeError("AsyncUser closes its connections asynchronously, use async with")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """HTTP client holding the pool of connections to the server, created on first use"""
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+            )
+            self._client = httpx.AsyncClient(
+                base_url=self.server_url, limits=limits, http2=self.http2, timeout=self.timeout
+            )
+        return self._client
+
+    async def close(self):
+        """Close the connections to the server. The next request opens new ones"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def build_auth_headers(self) -> dict:
+        """Build the headers that authenticate a request to the server:
+        either a session token, or a challenge.
+        Concurrent requests wait for the same session token
+
+        Returns:
+            The headers to add to the request
+
+        """
+        if not self.use_token:
+            return {"Challenge": self.build_challenge()}
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+
+        async with self._token_lock:
+            if self._token is None or time.monotonic() > self._token_expires:
+                challenge_str = self.build_challenge()
+                r = await self.client.post("/users/token", headers={"Challenge": challenge_str})
+                if r.status_code != 200:
+                    raise AssertionError(r.json()["detail"])
+
+                data = r.json()
+                self._token = data["token"]
+                self._token_expires = time.monotonic() + data["lifetime"] - self.TOKEN_MARGIN
+
+        return {"Authorization": f"Bearer {self._token}"}
+
+    async def _request(
+        self, method: str, path: str, retry: bool = True, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        """Send an authenticated request to the server.
+        If the session token is refused, a new one is requested and the request is sent again
+
+        Args:
+            method: HTTP method
+            path: Path of the endpoint, starting with '/'
+            retry: False if the request cannot be sent twice, e.g. when its body is a generator
+            stream: Do not read the body of the response, which must then be closed
+            kwargs: Other arguments given to `httpx.AsyncClient.build_request`
+
+        Returns:
+            The response of the server
+
+        """
+        if self.server_url == "":
+            raise AssertionError("No server_url attribute")
+
+        headers = kwargs.pop("headers", {})
+
+        async def _send():
+            auth_headers = await self.build_auth_headers()
+            request = self.client.build_request(
+                method, path, headers={**headers, **auth_headers}, **kwargs
+            )
+            return await self.client.send(request, stream=stream)
+
+        r = await _send()
+        if r.status_code == 401 and self._token is not None and retry:
+            await r.aclose()
+            self._token = None
+            r = await _send()
+
+        return r
+
+    async def saveItemInDatabase(self, item: bytes, raw: bool = False) -> int:
+        """Encrypt and save an item in the database
+
+        Args:
+            item: Clear content
+            raw: Upload the encrypted item as application/octet-stream instead of JSON
+
+        Returns:
+            The id of the item in the database
+
+        """
+        if raw:
+            u_item = self.encrypt(item)
+            r = await self._request(
+                "POST",
+                "/item/raw",
+                content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        else:
+            data = self.encrypt_for_db(item)
+            r = await self._request("POST", "/item/", json=data)
+        if r.status_code != 200:
+            raise AssertionError(r)
+
+        return r.json()["id"]
+
+    async def loadItemFromDatabase(self, item_id: int, raw: bool = False) -> bytes:
+        """Load and decrypt an item from the database
+
+        Args:
+            item_id: The id of the item in the database
+            raw: Download the encrypted item as application/octet-stream instead of JSON
+
+        Returns:
+            The clear content
+
+        """
+        headers, cached = self._get_cached_item(item_id, raw)
+        if raw:
+            r = await self._request("GET", f"/item/{item_id}/raw", headers=headers)
+        else:
+            r = await self._request("GET", f"/item/{item_id}", headers=headers)
+        r = self._check_item_response(item_id, raw, r, cached)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._decrypt_item_response, item_id, r, raw)
+
+    async def saveStreamInDatabase(
+        self, source: StreamSource, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> int:
+        """Encrypt data chunk by chunk and upload it with a chunked HTTP body.
+        The memory used is bounded by chunk_size
+
+        Args:
+            source: bytes, a binary file-like object, or an iterable of bytes
+            chunk_size: Size of the plaintext chunks
+
+        Returns:
+            The id of the item in the database
+
+        """
+        frames = self.encrypt_stream(source, chunk_size=chunk_size)
+        loop = asyncio.get_running_loop()
+
+        async def _aiter_frames():
+            # Each chunk is read and encrypted in the executor
+            while True:
+                frame = await loop.run_in_executor(None, next, frames, None)
+                if frame is None:
+                    return
+                yield frame
+
+        # A token is requested now, as a generator body cannot be sent twice
+        await self.build_auth_headers()
+        r = await self._request(
+            "POST",
+            "/item/raw",
+            retry=False,
+            content=_aiter_frames(),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()["id"]
+
+    async def loadStreamFromDatabase(
+        self, item_id: int, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Download an item saved by `network.frontend.User.User.saveStreamInDatabase`
+        and decrypt it frame by frame, as the frames are received
+
+        Args:
+            item_id: The id of the item in the database
+            chunk_size: Size of the pieces read from the network
+
+        Returns:
+            An asynchronous iterator on the plaintext chunks
+
+        """
+        r = await self._request("GET", f"/item/{item_id}/raw", stream=True)
+        if r.status_code != 200:
+            await r.aread()
+            await r.aclose()
+            raise AssertionError(r.json()["detail"])
+
+        cfrag, sender_pkey, cfrags = self._read_share_headers(r)
+        loop = asyncio.get_running_loop()
+
+        async def _decrypt_frames():
+            # The connection goes back to the pool once the body is read
+            try:
+                frames = aiter_sized(r.aiter_bytes(chunk_size=chunk_size))
+                try:
+                    caps_bytes = await frames.__anext__()
+                    key_ciphertext = await frames.__anext__()
+                except StopAsyncIteration:
+                    raise ValueError("Truncated stream")
+
+                key_item = schemas.UmbralMessage(
+                    capsule=Capsule.from_bytes(caps_bytes),
+                    ciphertext=key_ciphertext,
+                    cfrag=cfrag,
+                    sender_pkey=sender_pkey,
+                    cfrags=cfrags,
+                )
+                key_material = await loop.run_in_executor(None, self.decrypt, key_item)
+                dem = DEM(key_material, info=STREAM_KDF_INFO)
+
+                index = 0
+                last = False
+                async for frame in frames:
+                    if last:
+                        raise ValueError("Unexpected data after the last chunk")
+                    chunk, last = await loop.run_in_executor(None, decrypt_frame, dem, frame, index)
+                    yield chunk
+                    index += 1
+                if not last:
+                    raise ValueError("Truncated stream: last chunk is missing")
+            finally:
+                await r.aclose()
+
+        return _decrypt_frames()
+
+    async def loadItemIdList(self, page_size: int = 1000) -> AsyncIterator[int]:
+        """Iterate over the ids of the user's items, in increasing order.
+        The pages of ids are requested lazily
+
+        Args:
+            page_size: Number of ids requested at once
+
+        Yields:
+            The ids of the items
+
+        """
+        after_id = None
+        while True:
+            params = {"limit": page_size}
+            if after_id is not None:
+                params["after_id"] = after_id
+            r = await self._request("GET", "/item/", params=params)
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+
+            page = r.json()
+            for item_id in page:
+                yield item_id
+
+            if len(page) < page_size:
+                return
+            after_id = page[-1]
+
+    async def saveItems(
+        self, items: List[bytes], batch_size: int = 500, concurrency: int = 32
+    ) -> List[int]:
+        """Encrypt and save several items, with one request per batch.
+        The batches are sent concurrently
+
+        Args:
+            items: Clear contents
+            batch_size: Number of items sent in one request
+            concurrency: Maximum number of requests in flight
+
+        Returns:
+            The ids of the items in the database, in the same order as items
+
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+
+        def _encrypt_batch(batch: List[bytes]) -> List[dict]:
+            return [self.encrypt_for_db(item) for item in batch]
+
+        async def _save_batch(batch: List[bytes]) -> List[int]:
+            # Only the batches being sent are encrypted and held in memory
+            async with semaphore:
+                data = await loop.run_in_executor(None, _encrypt_batch, batch)
+                r = await self._request("POST", "/item/batch", json=data)
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            return [item["id"] for item in r.json()]
+
+        pages = await asyncio.gather(
+            *[
+                _save_batch(items[offset : offset + batch_size])
+                for offset in range(0, len(items), batch_size)
+            ]
+        )
+        return [item_id for page in pages for item_id in page]
+
+    async def loadItems(
+        self, item_ids: List[int], batch_size: int = 500, concurrency: int = 32
+    ) -> List[bytes]:
+        """Load and decrypt several items, with one request per batch.
+        The batches are requested concurrently, and each item is decrypted in the executor
+        as soon as its batch is received
+
+        Args:
+            item_ids: The ids of the items in the database
+            batch_size: Number of items requested at once. With 1, each item is
+                requested on its own
+            concurrency: Maximum number of requests in flight
+
+        Returns:
+            The clear contents, in the same order as item_ids
+
+        """
+        items = await self._load_items_by_id(item_ids, batch_size, concurrency)
+
+        missing = [item_id for item_id in item_ids if item_id not in items.keys()]
+        if len(missing) > 0:
+            raise AssertionError(f"Items {missing} not found")
+
+        return [items[item_id] for item_id in item_ids]
+
+    async def _load_items_by_id(
+        self, item_ids: List[int], batch_size: int, concurrency: int
+    ) -> Dict[int, bytes]:
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def _load_batch(batch: List[int]) -> Dict[int, bytes]:
+            async with semaphore:
+                r = await self._request("POST", "/item/batch-get", json=batch)
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+
+            db_items = r.json()
+            plaintexts = await asyncio.gather(
+                *[loop.run_in_executor(None, self.decrypt_from_db, db_data) for db_data in db_items]
+            )
+            return {db_data["id"]: plaintext for db_data, plaintext in zip(db_items, plaintexts)}
+
+        items = {}
+        for page in await asyncio.gather(
+            *[
+                _load_batch(item_ids[offset : offset + batch_size])
+                for offset in range(0, len(item_ids), batch_size)
+            ]
+        ):
+            items.update(page)
+
+        return items
+
+    async def sync(
+        self, local_dir: Path, page_size: int = 1000, batch_size: int = 500, concurrency: int = 32
+    ) -> dict:
+        """Mirror the user's items in a local directory, one file per item named after its id.
+        Only the items changed since the previous synchronization are downloaded,
+        as listed by GET /item/changes. The files hold the clear contents
+
+        Args:
+            local_dir: The directory, created if needed
+            page_size: Number of changes requested at once
+            batch_size: Number of items downloaded at once
+            concurrency: Maximum number of requests in flight
+
+        Returns:
+            A dictionary with keys 'updated' and 'deleted', giving the ids of the items
+            whose file has been written or removed
+
+        """
+        loop = asyncio.get_running_loop()
+        local_dir, since = self._read_sync_state(local_dir)
+        res = {"updated": [], "deleted": []}
+        while True:
+            r = await self._request(
+                "GET", "/item/changes", params={"since": since, "limit": page_size}
+            )
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            page = r.json()
+
+            # Only the last change of each item matters
+            kinds = {change["item_id"]: change["kind"] for change in page["changes"]}
+            plaintexts = await self._load_items_by_id(
+                [item_id for item_id, kind in kinds.items() if kind != "deleted"],
+                batch_size,
+                concurrency,
+            )
+            await loop.run_in_executor(None, self._apply_changes, local_dir, kinds, plaintexts, res)
+
+            since = page["last_seq"]
+            self._write_sync_state(local_dir, since)
+            if len(page["changes"]) < page_size:
+                return res
+
+    async def deleteItems(self, item_ids: List[int], batch_size: int = 500) -> List[int]:
+        """Delete several items, with one request per batch
+
+        Args:
+            item_ids: The ids of the items in the database
+            batch_size: Number of items deleted at once
+
+        Returns:
+            The ids of the items actually deleted
+
+        """
+        res = []
+        for offset in range(0, len(item_ids), batch_size):
+            r = await self._request(
+                "POST", "/item/batch-delete", json=item_ids[offset : offset + batch_size]
+            )
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            res.extend(r.json())
+
+        if self.cache is not None:
+            self.cache.delete(self.server_url, self.id, res)
+
+        return res
+
+    async def shareItems(
+        self,
+        item_ids: List[int],
+        recipients: Dict[int, PublicKey],
+        batch_size: int = 500,
+        threshold: int = 1,
+        shares: int = 1,
+    ) -> List[int]:
+        """Share several items with several users, with one request per batch.
+        One set of kfrags is generated per recipient, and used for all the items
+
+        Args:
+            item_ids: The ids of the items to share
+            recipients: The public keys of the recipients, indexed by their ids
+            batch_size: Number of (item, recipient) pairs sent in one request
+            threshold: The number of cfrags necessary to decrypt the shared items
+            shares: Total number of kfrags generated per recipient
+
+        Returns:
+            The ids of the items created for the recipients,
+            for each item of item_ids and each recipient of recipients in turn
+
+        """
+        kfrags = {
+            recipient_id: self.generate_kfrags_for_db(public_key, threshold, shares)
+            for recipient_id, public_key in recipients.items()
+        }
+        share_list = [
+            {"item_id": item_id, "recipient_id": recipient_id, **kfrag}
+            for item_id in item_ids
+            for recipient_id, kfrag in kfrags.items()
+        ]
+
+        res = []
+        for offset in range(0, len(share_list), batch_size):
+            r = await self._request(
+                "POST", "/share/batch", json=share_list[offset : offset + batch_size]
+            )
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            res.extend(item["id"] for item in r.json())
+
+        return res
+
+    async def submitShare(
+        self,
+        item_id: int,
+        recipient_id: int,
+        rx_public_key: PublicKey,
+        threshold: int = 1,
+        shares: int = 1,
+    ) -> int:
+        """Submit the share of an item, to be re-encrypted later by a proxy worker.
+        See `network.frontend.AsyncUser.AsyncUser.getShareJob` to follow its progress
+
+        Args:
+            item_id: The id of the item to share
+            recipient_id: The id of the recipient
+            rx_public_key: The public key of the recipient
+            threshold: The number of cfrags necessary to decrypt the shared item
+            shares: Total number of kfrags generated
+
+        Returns:
+            The id of the share job
+
+        """
+        share = {"item_id": item_id, "recipient_id": recipient_id}
+        share.update(self.generate_kfrags_for_db(rx_public_key, threshold, shares))
+        r = await self._request("POST", "/share/", json=share)
+        if r.status_code != 202:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()["id"]
+
+    async def getShareJob(self, job_id: int) -> dict:
+        """Get the status of a share submitted by
+        `network.frontend.AsyncUser.AsyncUser.submitShare`
+
+        Args:
+            job_id: The id of the share job
+
+        Returns:
+            A dictionary with keys 'id', 'status', 'item_id' (the id of the item created
+            for the recipient once the status is 'done') and 'error'
+
+        """
+        r = await self._request("GET", f"/share/jobs/{job_id}")
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()
+
+    async def notifications(self) -> AsyncIterator[dict]:
+        """Subscribe to the notifications of the changes of the user's items, pushed by the
+        server as they happen. The subscription is active once this coroutine returns.
+        Notifications may be lost by a slow consumer, see
+        `network.frontend.AsyncUser.AsyncUser.sync` to catch up:
+
+            events = await user.notifications()
+            async for event in events:
+                if event["kind"] == "shared":
+                    data = await user.loadItemFromDatabase(event["item_id"])
+
+        Returns:
+            An asynchronous iterator on the notifications, dictionaries with keys
+            'item_id' and 'kind' (one of 'created', 'shared', 'updated', 'deleted').
+            Closing it ends the subscription
+
+        """
+        r = await self._request(
+            "GET", "/notifications", stream=True, timeout=httpx.Timeout(self.timeout, read=None)
+        )
+        if r.status_code != 200:
+            await r.aread()
+            await r.aclose()
+            raise AssertionError(r.json()["detail"])
+
+        async def _events():
+            try:
+                data = []
+                async for line in r.aiter_lines():
+                    if line.startswith("data:"):
+                        data.append(line[5:].strip())
+                    elif line == "" and len(data) > 0:
+                        yield json.loads("\n".join(data))
+                        data = []
+            finally:
+                await r.aclose()
+
+        return _events()
+
+    async def deleteItemFromDatabase(self, item_id: int):
+        r = await self._request("DELETE", f"/item/{item_id}")
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        if self.cache is not None:
+            self.cache.delete(self.server_url, self.id, [item_id])
@@ -0,0 +1,111 @@
+from pathlib import Path
+import json
+import sqlite3
+import threading
+from typing import List, Union
+
+import httpx
+
+#: Headers of the responses of the server kept in the cache
+CACHED_HEADERS = ["ETag", "Item-Cfrag", "Item-Cfrags", "Item-Sender-Pkey"]
+
+
+class ItemCache(object):
+    """On-disk cache of the responses of the server to GET /item/{item_id}
+    and GET /item/{item_id}/raw, stored in a SQLite database.
+    Only the encrypted items are stored, never their plaintext.
+
+    A cached item is revalidated with the entity tag given by the server,
+    which answers with an empty 304 response while the item does not change.
+    The entries are indexed by server URL, user id, item id and representation,
+    so that one file can be shared by several users and servers
+
+    Args:
+        path: The SQLite database file, created if needed
+
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path).expanduser().resolve()
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "server_url TEXT NOT NULL, user_id INTEGER NOT NULL, item_id INTEGER NOT NULL,"
+                " raw INTEGER NOT NULL, headers TEXT NOT NULL, content BLOB NOT NULL,"
+                " PRIMARY KEY (server_url, user_id, item_id, raw))"
+            )
+
+    def get(
+        self, server_url: str, user_id: int, item_id: int, raw: bool
+    ) -> Union[httpx.Response, None]:
+        """Get a cached response
+
+        Args:
+            server_url: URL of the server
+            user_id: The id of the user
+            item_id: The id of the item
+            raw: True for the response of GET /item/{item_id}/raw
+
+        Returns:
+            The response, with an ETag header, or None if the item is not cached
+
+        """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT headers, content FROM items"
+                " WHERE server_url=? AND user_id=? AND item_id=? AND raw=?",
+                (server_url, user_id, item_id, int(raw)),
+            ).fetchone()
+        if row is None:
+            return None
+
+        headers, content = row
+        return httpx.Response(200, headers=json.loads(headers), content=content)
+
+    def put(self, server_url: str, user_id: int, item_id: int, raw: bool, r: httpx.Response):
+        """Cache a response, if the server gave it an entity tag
+
+        Args:
+            server_url: URL of the server
+            user_id: The id of the user
+            item_id: The id of the item
+            raw: True for the response of GET /item/{item_id}/raw
+            r: The response, whose body has been read
+
+        """
+        if "ETag" not in r.headers:
+            return
+
+        headers = {key: r.headers[key] for key in CACHED_HEADERS if key in r.headers}
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                (server_url, user_id, item_id, int(raw), json.dumps(headers), r.content),
+            )
+
+    def delete(self, server_url: str, user_id: int, item_ids: List[int]):
+        """Remove items from the cache, in both representations
+
+        Args:
+            server_url: URL of the server
+            user_id: The id of the user
+            item_ids: The ids of the items
+
+        """
+        with self._lock, self._con:
+            self._con.executemany(
+                "DELETE FROM items WHERE server_url=? AND user_id=? AND item_id=?",
+                [(server_url, user_id, item_id) for item_id in item_ids],
+            )
+
+    def clear(self):
+        """Remove all the items from the cache"""
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM items")
+
+    def close(self):
+        """Close the database file"""
+        with self._lock:
+            self._con.close()
@@ -1,14 +1,17 @@
 import logging
+import os
 from pathlib import Path
 from datetime import datetime
-from typing import List
-import struct
-from base64 import b64encode
+import tempfile
+import time
+from typing import Dict, Iterator, List, Tuple, Union
+from base64 import b64decode, b64encode
 import json
 
-import requests
+import httpx
 from umbral import (
     VerifiedKeyFrag,
+    VerifiedCapsuleFrag,
     PublicKey,
     generate_kfrags,
     encrypt,
@@ -19,8 +22,29 @@ from umbral import (
 )
 from umbral.hashing import Hash
 
-from ..transcoding import datetime_to_challenge, encodeKey, encrypted_to_json, kfrag_to_json
+from ..transcoding import (
+    datetime_to_challenge,
+    db_bytes_to_cfrag,
+    decodeKey,
+    encodeKey,
+    encrypted_to_json,
+    encrypted_to_raw,
+    kfrag_to_json,
+    pack_sized,
+    raw_to_encrypted,
+    unpack_sized,
+)
 from .. import schemas
+from ..streaming import (
+    STREAM_CHUNK_SIZE,
+    StreamReader,
+    StreamSource,
+    decrypt_frames,
+    encrypt_stream,
+    is_stream,
+    read_stream_header,
+)
+from .ItemCache import ItemCache
 
 
 class User(object):
@@ -29,13 +53,50 @@ class User(object):
     Args:
         server_url: URL of the server
         config_file: File to read to instanciate the user
+        use_token: Exchange a challenge for a session token, and reuse it until it expires.
+            Otherwise, a challenge is built for each request
+        pool_size: Maximum number of connections kept open to the server
+        http2: Use HTTP/2 if the server supports it. Requires the h2 package,
+            installed with the http2 extra
+        timeout: Timeout of the requests (s), None to wait indefinitely
+        cache_file: SQLite file of a `network.frontend.ItemCache.ItemCache`, where the items
+            loaded one by one are kept encrypted and revalidated with conditional requests
+
+    The connections to the server are kept alive and reused by all the requests.
+    They are closed by `network.frontend.User.User.close`, or when leaving a with block:
+
+        with User(server_url=url, config_file=path) as user:
+            ids = user.saveItems(items)
 
     """
 
-    def __init__(self, server_url: str = "", config_file: Path = None):
+    #: Margin before the expiration of a session token where it is not used anymore (s)
+    TOKEN_MARGIN = 10.0
+
+    #: Name of the file where `network.frontend.User.User.sync` keeps its state
+    SYNC_STATE_FILE = ".network-sync.json"
+
+    def __init__(
+        self,
+        server_url: str = "",
+        config_file: Path = None,
+        use_token: bool = True,
+        pool_size: int = 10,
+        http2: bool = False,
+        timeout: float = None,
+        cache_file: Path = None,
+    ):
         logger = logging.getLogger("network_logger")
 
         self.server_url = server_url
+        self.use_token = use_token
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.timeout = timeout
+        self._client = None
+        self.cache = None if cache_file is None else ItemCache(cache_file)
+        self._token = None
+        self._token_expires = 0.0
 
         if config_file is not None:
             config_file = config_file.expanduser().resolve()
@@ -54,21 +115,43 @@ class User(object):
             with open(config_file, "rb") as f:
                 dat = f.read()
 
-            user_id, pkey_len = struct.unpack_from("<II", dat, offset=0)
-            pkey_bytes = dat[8 : 8 + pkey_len]
-            (skey_len,) = struct.unpack_from("<I", dat, offset=8 + pkey_len)
-            skey_bytes = dat[8 + pkey_len + 4 : 8 + pkey_len + 4 + skey_len]
+            user_id = int.from_bytes(dat[:4], "little")
+            pkey_bytes, skey_bytes = unpack_sized(dat[4:], 2)
 
-            self.private_key = SecretKey.from_bytes(pkey_bytes)
+            self.private_key = SecretKey.from_bytes(bytes(pkey_bytes))
             self.public_key = self.private_key.public_key()
 
-            self.signing_key = SecretKey.from_bytes(skey_bytes)
+            self.signing_key = SecretKey.from_bytes(bytes(skey_bytes))
             self.verifying_key = self.signing_key.public_key()
 
             self.id = user_id
 
             logger.info(f"Loaded user id={self.id}")
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def client(self) -> httpx.Client:
+        """HTTP client holding the pool of connections to the server, created on first use"""
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+            )
+            self._client = httpx.Client(
+                base_url=self.server_url, limits=limits, http2=self.http2, timeout=self.timeout
+            )
+        return self._client
+
+    def close(self):
+        """Close the connections to the server. The next request opens new ones"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
     def to_public_file(self, path: Path):
         """Export **public** data to send to an admin for account creation
 
@@ -121,15 +204,7 @@ class User(object):
         pkey = self.private_key.to_secret_bytes()
         skey = self.signing_key.to_secret_bytes()
 
-        fmt = "<II" + len(pkey) * "B" + "I" + len(skey) * "B"
-        dat = struct.pack(
-            fmt,
-            self.id,
-            len(pkey),
-            *pkey,
-            len(skey),
-            *skey,
-        )
+        dat = self.id.to_bytes(4, "little") + pack_sized(pkey, skey)
         with open(path.expanduser().resolve(), "wb") as f:
             f.write(dat)
 
@@ -158,6 +233,65 @@ class User(object):
 
         return f"{self.id}:{b64_hash}:{b64_sign}"
 
+    def build_auth_headers(self) -> dict:
+        """Build the headers that authenticate a request to the server:
+        either a session token, or a challenge
+
+        Returns:
+            The headers to add to the request
+
+        """
+        if not self.use_token:
+            return {"Challenge": self.build_challenge()}
+
+        if self._token is None or time.monotonic() > self._token_expires:
+            challenge_str = self.build_challenge()
+            r = self.client.post("/users/token", headers={"Challenge": challenge_str})
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+
+            data = r.json()
+            self._token = data["token"]
+            self._token_expires = time.monotonic() + data["lifetime"] - self.TOKEN_MARGIN
+
+        return {"Authorization": f"Bearer {self._token}"}
+
+    def _request(
+        self, method: str, path: str, retry: bool = True, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        """Send an authenticated request to the server.
+        If the session token is refused, a new one is requested and the request is sent again
+
+        Args:
+            method: HTTP method
+            path: Path of the endpoint, starting with '/'
+            retry: False if the request cannot be sent twice, e.g. when its body is a generator
+            stream: Do not read the body of the response, which must then be closed
+            kwargs: Other arguments given to `httpx.Client.build_request`
+
+        Returns:
+            The response of the server
+
+        """
+        if self.server_url == "":
+            raise AssertionError("No server_url attribute")
+
+        headers = kwargs.pop("headers", {})
+
+        def _send():
+            request = self.client.build_request(
+                method, path, headers={**headers, **self.build_auth_headers()}, **kwargs
+            )
+            return self.client.send(request, stream=stream)
+
+        r = _send()
+        if r.status_code == 401 and self._token is not None and retry:
+            r.close()
+            self._token = None
+            r = _send()
+
+        return r
+
     def encrypt(self, plaintext: bytes) -> schemas.UmbralMessage:
         """Encrypt a message
 
@@ -209,15 +343,19 @@ class User(object):
             The plaintext message
 
         """
-        if item.cfrag is None and item.sender_pkey is None:
-            cleartext = decrypt_original(self.private_key, item.capsule, item.ciphertext)
-        elif item.cfrag is not None and item.sender_pkey is not None:
+        # umbral only accepts bytes, the ciphertext may be a view on a database value
+        ciphertext = bytes(item.ciphertext)
+        cfrags = item.get_cfrags()
+        if cfrags is None and item.sender_pkey is None:
+            cleartext = decrypt_original(self.private_key, item.capsule, ciphertext)
+        elif cfrags is not None and item.sender_pkey is not None:
+            # With a M of N share, any M cfrags out of the N given by the server are enough
             cleartext = pre.decrypt_reencrypted(
                 receiving_sk=self.private_key,
                 delegating_pk=item.sender_pkey,
-                verified_cfrags=[item.cfrag],
+                verified_cfrags=cfrags,
                 capsule=item.capsule,
-                ciphertext=item.ciphertext,
+                ciphertext=ciphertext,
             )
         else:
             raise AssertionError("cfrag and sender_pkey shall be simultaneously set or unset")
@@ -236,9 +374,67 @@ class User(object):
         """
         item = schemas.ItemModel(**db_data)
         u_item = item.toUmbral()
+        raw = b64decode(item.encrypted_data)
+        if is_stream(raw):
+            chunks = self.decrypt_stream(
+                raw, cfrag=u_item.cfrag, sender_pkey=u_item.sender_pkey, cfrags=u_item.cfrags
+            )
+            return b"".join(chunks)
+
         cleartext = self.decrypt(u_item)
         return cleartext
 
+    def encrypt_stream(
+        self, source: StreamSource, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Encrypt data chunk by chunk, see `network.streaming`.
+        The memory used is bounded by chunk_size
+
+        Args:
+            source: bytes, a binary file-like object, or an iterable of bytes
+            chunk_size: Size of the plaintext chunks
+
+        Returns:
+            An iterator on the binary database value of the encrypted data
+
+        """
+        return encrypt_stream(self.public_key, source, chunk_size=chunk_size)
+
+    def decrypt_stream(
+        self,
+        source: StreamSource,
+        cfrag: VerifiedCapsuleFrag = None,
+        sender_pkey: PublicKey = None,
+        cfrags: List[VerifiedCapsuleFrag] = None,
+    ) -> Iterator[bytes]:
+        """Decrypt data encrypted by `network.frontend.User.User.encrypt_stream`,
+        chunk by chunk
+
+        Args:
+            source: The encrypted data, as bytes, a binary file-like object,
+                or an iterable of bytes
+            cfrag: Capsule frag used to decrypt the data, if it has been shared by another user
+            sender_pkey: Public key of the user who shared the data
+            cfrags: Capsule frags used instead of cfrag, if the data has been shared
+                with a M of N threshold
+
+        Yields:
+            The plaintext chunks
+
+        """
+        reader = StreamReader(source)
+        capsule, key_ciphertext = read_stream_header(reader)
+        key_item = schemas.UmbralMessage(
+            capsule=capsule,
+            ciphertext=key_ciphertext,
+            cfrag=cfrag,
+            sender_pkey=sender_pkey,
+            cfrags=cfrags,
+        )
+        key_material = self.decrypt(key_item)
+
+        yield from decrypt_frames(key_material, reader)
+
     def generate_kfrags(
         self, rx_public_key: PublicKey, threshold: int, shares: int
     ) -> List[VerifiedKeyFrag]:
@@ -263,30 +459,50 @@ class User(object):
         )
         return kfrags
 
-    def generate_kfrags_for_db(self, rx_public_key: PublicKey) -> dict:
+    def generate_kfrags_for_db(
+        self, rx_public_key: PublicKey, threshold: int = 1, shares: int = 1
+    ) -> dict:
         """Generate "M of N" re-encryption key fragments (or "KFrags") for the receiver
 
         Args:
             rx_public_key: The public key of the receiver
+            threshold: The number of VerifiedCapsuleFrag necessary to decrypt the mesage
+            shares: Total number of VerifiedCapsuleFrag generated
 
         Returns:
-            A dictionary with key 'kfrag' and the db value as a string
+            A dictionary with key 'kfrag' and the db value as a string if shares is 1,
+            or with key 'kfrags' and the list of db values otherwise
 
         """
-        kfrags = self.generate_kfrags(rx_public_key, threshold=1, shares=1)
-        kfrag_json = kfrag_to_json(kfrags[0])
+        kfrags = self.generate_kfrags(rx_public_key, threshold=threshold, shares=shares)
+        if shares == 1:
+            kfrag_json = kfrag_to_json(kfrags[0])
+        else:
+            kfrag_json = {"kfrags": [kfrag_to_json(kfrag)["kfrag"] for kfrag in kfrags]}
         return kfrag_json
 
-    def saveItemInDatabase(self, item: bytes) -> int:
-        if self.server_url == "":
-            raise AssertionError("No server_url attribute")
+    def saveItemInDatabase(self, item: bytes, raw: bool = False) -> int:
+        """Encrypt and save an item in the database
 
-        data = self.encrypt_for_db(item)
+        Args:
+            item: Clear content
+            raw: Upload the encrypted item as application/octet-stream instead of JSON
 
-        challenge_str = self.build_challenge()
-        r = requests.post(
-            f"{self.server_url}/item/", json=data, headers={"Challenge": challenge_str}
-        )
+        Returns:
+            The id of the item in the database
+
+        """
+        if raw:
+            u_item = self.encrypt(item)
+            r = self._request(
+                "POST",
+                "/item/raw",
+                content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        else:
+            data = self.encrypt_for_db(item)
+            r = self._request("POST", "/item/", json=data)
         if r.status_code != 200:
             # exc = r.json()["detail"]
             # msg = repr(exc[0])
@@ -296,39 +512,454 @@ class User(object):
 
         return data["id"]
 
-    def loadItemFromDatabase(self, item_id: int) -> bytes:
-        if self.server_url == "":
-            raise AssertionError("No server_url attribute")
+    def loadItemFromDatabase(self, item_id: int, raw: bool = False) -> bytes:
+        """Load and decrypt an item from the database
+
+        Args:
+            item_id: The id of the item in the database
+            raw: Download the encrypted item as application/octet-stream instead of JSON
+
+        Returns:
+            The clear content
+
+        """
+        headers, cached = self._get_cached_item(item_id, raw)
+        if raw:
+            r = self._request("GET", f"/item/{item_id}/raw", headers=headers)
+        else:
+            r = self._request("GET", f"/item/{item_id}", headers=headers)
+        r = self._check_item_response(item_id, raw, r, cached)
+
+        return self._decrypt_item_response(item_id, r, raw)
+
+    def _get_cached_item(self, item_id: int, raw: bool) -> Tuple[dict, Union[httpx.Response, None]]:
+        """Look for an item in the cache
+
+        Args:
+            item_id: The id of the item in the database
+            raw: True for the application/octet-stream representation
+
+        Returns:
+            The headers of the request revalidating the cached item, empty if not cached
+            The cached response, or None
+
+        """
+        if self.cache is None:
+            return {}, None
+
+        cached = self.cache.get(self.server_url, self.id, item_id, raw)
+        if cached is None:
+            return {}, None
+
+        return {"If-None-Match": cached.headers["ETag"]}, cached
+
+    def _check_item_response(
+        self, item_id: int, raw: bool, r: httpx.Response, cached: Union[httpx.Response, None]
+    ) -> httpx.Response:
+        """Check the response to the request of an item, and update the cache
+
+        Args:
+            item_id: The id of the item in the database
+            raw: True for the application/octet-stream representation
+            r: The response of the server
+            cached: The cached response, as given by `_get_cached_item`
+
+        Returns:
+            The response, or the cached one if the item did not change
+
+        """
+        if r.status_code == 304 and cached is not None:
+            return cached
 
-        challenge_str = self.build_challenge()
-        r = requests.get(f"{self.server_url}/item/{item_id}", headers={"Challenge": challenge_str})
         if r.status_code != 200:
+            if self.cache is not None and r.status_code == 404:
+                self.cache.delete(self.server_url, self.id, [item_id])
             raise AssertionError(r.json()["detail"])
 
-        data = r.json()
-        data = self.decrypt_from_db(data)
+        if self.cache is not None:
+            self.cache.put(self.server_url, self.id, item_id, raw, r)
+
+        return r
+
+    def _decrypt_item_response(self, item_id: int, r: httpx.Response, raw: bool) -> bytes:
+        if not raw:
+            data = r.json()
+            data = self.decrypt_from_db(data)
+            return data
+
+        cfrag, sender_pkey, cfrags = self._read_share_headers(r)
+        if is_stream(r.content):
+            chunks = self.decrypt_stream(
+                r.content, cfrag=cfrag, sender_pkey=sender_pkey, cfrags=cfrags
+            )
+            return b"".join(chunks)
+
+        capsule, ciphertext = raw_to_encrypted(r.content)
+        u_item = schemas.UmbralMessage(
+            id=item_id,
+            user_id=self.id,
+            capsule=capsule,
+            ciphertext=ciphertext,
+            cfrag=cfrag,
+            sender_pkey=sender_pkey,
+            cfrags=cfrags,
+        )
+        data = self.decrypt(u_item)
 
         return data
 
-    def loadItemIdList(self) -> List[int]:
-        if self.server_url == "":
-            raise AssertionError("No server_url attribute")
+    @staticmethod
+    def _read_share_headers(r: httpx.Response):
+        cfrag = r.headers.get("Item-Cfrag", None)
+        sender_pkey = r.headers.get("Item-Sender-Pkey", None)
+        cfrags = r.headers.get("Item-Cfrags", None)
+        return (
+            None if cfrag is None else db_bytes_to_cfrag(cfrag),
+            None if sender_pkey is None else decodeKey(sender_pkey),
+            None if cfrags is None else [db_bytes_to_cfrag(x) for x in cfrags.split(",")],
+        )
+
+    def saveStreamInDatabase(
+        self, source: StreamSource, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> int:
+        """Encrypt data chunk by chunk and upload it with a chunked HTTP body.
+        The memory used is bounded by chunk_size
+
+        Args:
+            source: bytes, a binary file-like object, or an iterable of bytes
+            chunk_size: Size of the plaintext chunks
 
-        challenge_str = self.build_challenge()
-        r = requests.get(f"{self.server_url}/item/", headers={"Challenge": challenge_str})
+        Returns:
+            The id of the item in the database
+
+        """
+        # A token is requested now, as a generator body cannot be sent twice
+        self.build_auth_headers()
+        r = self._request(
+            "POST",
+            "/item/raw",
+            retry=False,
+            content=self.encrypt_stream(source, chunk_size=chunk_size),
+            headers={"Content-Type": "application/octet-stream"},
+        )
         if r.status_code != 200:
             raise AssertionError(r.json()["detail"])
 
-        data = r.json()
-        return data
+        return r.json()["id"]
 
-    def deleteItemFromDatabase(self, item_id: int):
-        if self.server_url == "":
-            raise AssertionError("No server_url attribute")
+    def loadStreamFromDatabase(
+        self, item_id: int, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """Download an item saved by `network.frontend.User.User.saveStreamInDatabase`
+        and decrypt it chunk by chunk
 
-        challenge_str = self.build_challenge()
-        r = requests.delete(
-            f"{self.server_url}/item/{item_id}", headers={"Challenge": challenge_str}
+        Args:
+            item_id: The id of the item in the database
+            chunk_size: Size of the pieces read from the network
+
+        Returns:
+            An iterator on the plaintext chunks
+
+        """
+        r = self._request("GET", f"/item/{item_id}/raw", stream=True)
+        if r.status_code != 200:
+            r.read()
+            r.close()
+            raise AssertionError(r.json()["detail"])
+
+        def _iter_chunks():
+            # The connection goes back to the pool once the body is read
+            try:
+                yield from r.iter_bytes(chunk_size=chunk_size)
+            finally:
+                r.close()
+
+        cfrag, sender_pkey, cfrags = self._read_share_headers(r)
+        return self.decrypt_stream(
+            _iter_chunks(),
+            cfrag=cfrag,
+            sender_pkey=sender_pkey,
+            cfrags=cfrags,
         )
+
+    def loadItemIdList(self, page_size: int = 1000) -> Iterator[int]:
+        """Iterate over the ids of the user's items, in increasing order.
+        The pages of ids are requested lazily
+
+        Args:
+            page_size: Number of ids requested at once
+
+        Yields:
+            The ids of the items
+
+        """
+        after_id = None
+        while True:
+            params = {"limit": page_size}
+            if after_id is not None:
+                params["after_id"] = after_id
+            r = self._request("GET", "/item/", params=params)
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+
+            page = r.json()
+            yield from page
+
+            if len(page) < page_size:
+                return
+            after_id = page[-1]
+
+    def saveItems(self, items: List[bytes], batch_size: int = 500) -> List[int]:
+        """Encrypt and save several items, with one request per batch
+
+        Args:
+            items: Clear contents
+            batch_size: Number of items sent in one request
+
+        Returns:
+            The ids of the items in the database, in the same order as items
+
+        """
+        res = []
+        for offset in range(0, len(items), batch_size):
+            data = [self.encrypt_for_db(item) for item in items[offset : offset + batch_size]]
+            r = self._request("POST", "/item/batch", json=data)
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            res.extend(item["id"] for item in r.json())
+
+        return res
+
+    def loadItems(self, item_ids: List[int], batch_size: int = 500) -> List[bytes]:
+        """Load and decrypt several items, with one request per batch
+
+        Args:
+            item_ids: The ids of the items in the database
+            batch_size: Number of items requested at once
+
+        Returns:
+            The clear contents, in the same order as item_ids
+
+        """
+        items = self._get_items_data(item_ids, batch_size)
+
+        missing = [item_id for item_id in item_ids if item_id not in items.keys()]
+        if len(missing) > 0:
+            raise AssertionError(f"Items {missing} not found")
+
+        return [self.decrypt_from_db(items[item_id]) for item_id in item_ids]
+
+    def _get_items_data(self, item_ids: List[int], batch_size: int) -> Dict[int, dict]:
+        items = {}
+        for offset in range(0, len(item_ids), batch_size):
+            r = self._request(
+                "POST", "/item/batch-get", json=item_ids[offset : offset + batch_size]
+            )
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            for db_data in r.json():
+                items[db_data["id"]] = db_data
+
+        return items
+
+    def sync(self, local_dir: Path, page_size: int = 1000, batch_size: int = 500) -> dict:
+        """Mirror the user's items in a local directory, one file per item named after its id.
+        Only the items changed since the previous synchronization are downloaded,
+        as listed by GET /item/changes. The files hold the clear contents
+
+        Args:
+            local_dir: The directory, created if needed
+            page_size: Number of changes requested at once
+            batch_size: Number of items downloaded at once
+
+        Returns:
+            A dictionary with keys 'updated' and 'deleted', giving the ids of the items
+            whose file has been written or removed
+
+        """
+        local_dir, since = self._read_sync_state(local_dir)
+        res = {"updated": [], "deleted": []}
+        while True:
+            r = self._request("GET", "/item/changes", params={"since": since, "limit": page_size})
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            page = r.json()
+
+            # Only the last change of each item matters
+            kinds = {change["item_id"]: change["kind"] for change in page["changes"]}
+            items = self._get_items_data(
+                [item_id for item_id, kind in kinds.items() if kind != "deleted"], batch_size
+            )
+            plaintexts = {
+                item_id: self.decrypt_from_db(db_data) for item_id, db_data in items.items()
+            }
+            self._apply_changes(local_dir, kinds, plaintexts, res)
+
+            since = page["last_seq"]
+            self._write_sync_state(local_dir, since)
+            if len(page["changes"]) < page_size:
+                return res
+
+    def _read_sync_state(self, local_dir: Path) -> Tuple[Path, int]:
+        local_dir = Path(local_dir).expanduser().resolve()
+        local_dir.mkdir(parents=True, exist_ok=True)
+        state_file = local_dir / self.SYNC_STATE_FILE
+        if not state_file.exists():
+            return local_dir, 0
+
+        state = json.loads(state_file.read_text())
+        if state["server_url"] != self.server_url or state["user_id"] != self.id:
+            raise AssertionError(f"{local_dir} is synchronized with another account")
+        return local_dir, state["seq"]
+
+    def _write_sync_state(self, local_dir: Path, seq: int):
+        state = {"server_url": self.server_url, "user_id": self.id, "seq": seq}
+        self._write_file(local_dir / self.SYNC_STATE_FILE, json.dumps(state).encode())
+
+    def _apply_changes(
+        self, local_dir: Path, kinds: Dict[int, str], plaintexts: Dict[int, bytes], res: dict
+    ):
+        for item_id in kinds.keys():
+            path = local_dir / str(item_id)
+            if item_id in plaintexts.keys():
+                self._write_file(path, plaintexts[item_id])
+                res["updated"].append(item_id)
+            else:
+                # Deleted, possibly after a change not yet listed
+                if path.exists():
+                    path.unlink()
+                res["deleted"].append(item_id)
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes):
+        # An interrupted synchronization leaves no partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def deleteItems(self, item_ids: List[int], batch_size: int = 500) -> List[int]:
+        """Delete several items, with one request per batch
+
+        Args:
+            item_ids: The ids of the items in the database
+            batch_size: Number of items deleted at once
+
+        Returns:
+            The ids of the items actually deleted
+
+        """
+        res = []
+        for offset in range(0, len(item_ids), batch_size):
+            r = self._request(
+                "POST", "/item/batch-delete", json=item_ids[offset : offset + batch_size]
+            )
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            res.extend(r.json())
+
+        if self.cache is not None:
+            self.cache.delete(self.server_url, self.id, res)
+
+        return res
+
+    def shareItems(
+        self,
+        item_ids: List[int],
+        recipients: Dict[int, PublicKey],
+        batch_size: int = 500,
+        threshold: int = 1,
+        shares: int = 1,
+    ) -> List[int]:
+        """Share several items with several users, with one request per batch.
+        One set of kfrags is generated per recipient, and used for all the items
+
+        Args:
+            item_ids: The ids of the items to share
+            recipients: The public keys of the recipients, indexed by their ids
+            batch_size: Number of (item, recipient) pairs sent in one request
+            threshold: The number of cfrags necessary to decrypt the shared items
+            shares: Total number of kfrags generated per recipient
+
+        Returns:
+            The ids of the items created for the recipients,
+            for each item of item_ids and each recipient of recipients in turn
+
+        """
+        kfrags = {
+            recipient_id: self.generate_kfrags_for_db(public_key, threshold, shares)
+            for recipient_id, public_key in recipients.items()
+        }
+        share_list = [
+            {"item_id": item_id, "recipient_id": recipient_id, **kfrag}
+            for item_id in item_ids
+            for recipient_id, kfrag in kfrags.items()
+        ]
+
+        res = []
+        for offset in range(0, len(share_list), batch_size):
+            r = self._request("POST", "/share/batch", json=share_list[offset : offset + batch_size])
+            if r.status_code != 200:
+                raise AssertionError(r.json()["detail"])
+            res.extend(item["id"] for item in r.json())
+
+        return res
+
+    def submitShare(
+        self,
+        item_id: int,
+        recipient_id: int,
+        rx_public_key: PublicKey,
+        threshold: int = 1,
+        shares: int = 1,
+    ) -> int:
+        """Submit the share of an item, to be re-encrypted later by a proxy worker.
+        See `network.frontend.User.User.getShareJob` to follow its progress
+
+        Args:
+            item_id: The id of the item to share
+            recipient_id: The id of the recipient
+            rx_public_key: The public key of the recipient
+            threshold: The number of cfrags necessary to decrypt the shared item
+            shares: Total number of kfrags generated
+
+        Returns:
+            The id of the share job
+
+        """
+        share = {"item_id": item_id, "recipient_id": recipient_id}
+        share.update(self.generate_kfrags_for_db(rx_public_key, threshold, shares))
+        r = self._request("POST", "/share/", json=share)
+        if r.status_code != 202:
+            raise AssertionError(r.json()["detail"])
+
+        return r.json()["id"]
+
+    def getShareJob(self, job_id: int) -> dict:
+        """Get the status of a share submitted by `network.frontend.User.User.submitShare`
+
+        Args:
+            job_id: The id of the share job
+
+        Returns:
+            A dictionary with keys 'id', 'status', 'item_id' (the id of the item created
+            for the recipient once the status is 'done') and 'error'
+
+        """
+        r = self._request("GET", f"/share/jobs/{job_id}")
         if r.status_code != 200:
             raise AssertionError(r.json()["detail"])
+
+        return r.json()
+
+    def deleteItemFromDatabase(self, item_id: int):
+        r = self._request("DELETE", f"/item/{item_id}")
+        if r.status_code != 200:
+            raise AssertionError(r.json()["detail"])
+
+        if self.cache is not None:
+            self.cache.delete(self.server_url, self.id, [item_id])
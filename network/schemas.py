@@ -1,6 +1,7 @@
+from base64 import b64decode, b64encode
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Union
 
 from pydantic import BaseModel
 from umbral import PublicKey, VerifiedCapsuleFrag, Capsule
@@ -13,8 +14,8 @@ from .backend import models
 class UmbralMessage:
     #: The encapsulated symmetric key returnd by the encrypt method
     capsule: Capsule
-    #: The ciphertext returnd by the encrypt method
-    ciphertext: bytes
+    #: The ciphertext returnd by the encrypt method, or a view on its database value
+    ciphertext: Union[bytes, memoryview]
     #: ID of the data in the database
     id: Optional[int] = None
     #: ID of the user that owns the data
@@ -23,29 +24,177 @@ class UmbralMessage:
     cfrag: Optional[VerifiedCapsuleFrag] = None
     #: Public key of the user who shared the data
     sender_pkey: Optional[PublicKey] = None
+    #: Capsule frags used instead of cfrag if the data has been shared with a M of N threshold.
+    #: At least M of them are needed to decrypt the data
+    cfrags: Optional[List[VerifiedCapsuleFrag]] = None
+
+    def get_cfrags(self) -> Optional[List[VerifiedCapsuleFrag]]:
+        """Get the capsule frags to decrypt the data with, whether it has been shared
+        with a single cfrag or with a M of N threshold
+
+        Returns:
+            The list of capsule frags, or None if the data has not been shared
+
+        """
+        if self.cfrags:
+            return self.cfrags
+        if self.cfrag is not None:
+            return [self.cfrag]
+        return None
+
+
+def _kfrag_list(kfrag: Optional[str], kfrags: Optional[List[str]]) -> List[str]:
+    if kfrags:
+        return list(kfrags)
+    if kfrag is not None:
+        return [kfrag]
+    return []
 
 
 class KfragModel(BaseModel):
-    kfrag: str
+    #: The kfrag of a 1 of 1 share
+    kfrag: Optional[str] = None
+    #: The N kfrags of a M of N share, used instead of kfrag
+    kfrags: Optional[List[str]] = None
+
+    def kfrag_list(self) -> List[str]:
+        """Get the kfrags of the share, whichever field was given
+
+        Returns:
+            The list of kfrags, empty if none was given
+
+        """
+        return _kfrag_list(self.kfrag, self.kfrags)
+
+
+class ShareModel(BaseModel):
+    #: ID of the item to share
+    item_id: int
+    #: ID of the user to share the item with
+    recipient_id: int
+    #: kfrag generated for the recipient by `network.frontend.User.User.generate_kfrags_for_db`
+    kfrag: Optional[str] = None
+    #: kfrags of a M of N share, used instead of kfrag
+    kfrags: Optional[List[str]] = None
+
+    def kfrag_list(self) -> List[str]:
+        """Get the kfrags of the share, whichever field was given
+
+        Returns:
+            The list of kfrags, empty if none was given
+
+        """
+        return _kfrag_list(self.kfrag, self.kfrags)
+
+
+class ShareJobModel(BaseModel):
+    #: ID of the job
+    id: int
+    #: Status of the job, see `network.backend.models.ShareJob`
+    status: str
+    #: ID of the item created for the recipient, once the job is done
+    item_id: Optional[int] = None
+    #: Reason of the failure of the job
+    error: Optional[str] = None
+
+    @classmethod
+    def fromORM(cls, obj: models.ShareJob) -> "ShareJobModel":
+        """Build a ShareJobModel from a db record
+
+        Args:
+            obj: Database record
+
+        Returns:
+            A ShareJobModel instance
+
+        """
+        res = cls(id=obj.id, status=obj.status, item_id=obj.item_id, error=obj.error)
+        return res
+
+
+class BlobStatsModel(BaseModel):
+    #: Number of blobs stored
+    blobs: int
+    #: Number of items referencing a blob
+    references: int
+    #: Size of the blobs (bytes)
+    stored_bytes: int
+    #: Size the blobs would take if each item had its own copy (bytes)
+    logical_bytes: int
+    #: logical_bytes / stored_bytes
+    dedup_ratio: float
+
+
+class ItemChangeModel(BaseModel):
+    #: Sequence number of the change
+    seq: int
+    #: ID of the item
+    item_id: int
+    #: Kind of change, see `network.backend.models.ItemChange`
+    kind: str
+
+
+class ItemChangesModel(BaseModel):
+    #: The changes, in increasing order of sequence number
+    changes: List[ItemChangeModel]
+    #: Sequence number to give as since to get the next changes
+    last_seq: int
 
 
 class CfragModel(BaseModel):
     cfrag: str
 
 
+class TokenModel(BaseModel):
+    #: The session token, to send as 'Authorization: Bearer <token>'
+    token: str
+    #: Lifetime of the token (s)
+    lifetime: float
+
+
+class ItemIdModel(BaseModel):
+    id: int
+    user_id: int
+
+
+def _b64encode(raw: Optional[bytes]) -> Optional[str]:
+    if raw is None:
+        return None
+    return b64encode(raw).decode(encoding="ascii")
+
+
+def _b64decode(b64data: Optional[str]) -> Optional[bytes]:
+    if b64data is None:
+        return None
+    # Raises binascii.Error on the characters out of the alphabet, instead of skipping them
+    return b64decode(b64data, validate=True)
+
+
 class ItemModel(BaseModel):
+    """JSON representation of an item. The binary database values
+    are base64 encoded
+
+    """
+
     id: Optional[int] = None
     user_id: Optional[int] = None
     encrypted_data: str
     cfrag: Optional[str] = None
     sender_pkey: Optional[str] = None
+    cfrags: Optional[List[str]] = None
 
     @classmethod
-    def fromORM(cls, obj: models.Item) -> "ItemModel":
+    def fromORM(
+        cls, obj: models.Item, cfrags: List[bytes] = None, encrypted_data: bytes = None
+    ) -> "ItemModel":
         """Build a ItemModel from a db record
 
         Args:
-            obj: Database record
+            obj: Database record, or row selected by `network.backend.crud.select_items_data`
+            cfrags: The cfrags of the item in the item_cfrags table, if it has been shared
+                with a M of N threshold
+            encrypted_data: The ciphertext to use instead of the one of obj,
+                for the blobs kept outside of the database
 
         Returns:
             A ItemModel instance
@@ -54,9 +203,28 @@ class ItemModel(BaseModel):
         res = cls(
             id=obj.id,
             user_id=obj.user_id,
-            encrypted_data=obj.encrypted_data,
-            cfrag=obj.cfrag,
-            sender_pkey=obj.sender_pkey,
+            encrypted_data=_b64encode(
+                obj.encrypted_data if encrypted_data is None else encrypted_data
+            ),
+            cfrag=_b64encode(obj.cfrag),
+            sender_pkey=_b64encode(obj.sender_pkey),
+            cfrags=None if not cfrags else [_b64encode(cfrag) for cfrag in cfrags],
+        )
+        return res
+
+    def toORM(self) -> models.Item:
+        """Build a db record from a ItemModel
+
+        Returns:
+            A database record, not yet added to a session
+
+        """
+        res = models.Item(
+            id=self.id,
+            user_id=self.user_id,
+            encrypted_data=_b64decode(self.encrypted_data),
+            cfrag=_b64decode(self.cfrag),
+            sender_pkey=_b64decode(self.sender_pkey),
         )
         return res
 
@@ -74,6 +242,11 @@ class ItemModel(BaseModel):
         else:
             cfrag = db_bytes_to_cfrag(self.cfrag)
 
+        if not self.cfrags:
+            cfrags = None
+        else:
+            cfrags = [db_bytes_to_cfrag(cfrag) for cfrag in self.cfrags]
+
         if self.sender_pkey is None:
             sender_pkey = None
         else:
@@ -86,6 +259,7 @@ class ItemModel(BaseModel):
             ciphertext=ciphertext,
             cfrag=cfrag,
             sender_pkey=sender_pkey,
+            cfrags=cfrags,
         )
 
         return res
@@ -0,0 +1,272 @@
+"""Chunked encryption of large data.
+
+A random symmetric key is encrypted with umbral, so that the usual capsule, cfrag
+and sharing mechanisms apply to it. The data is then encrypted with this key
+in authenticated chunks of fixed size. The binary format is:
+
+* the capsule and the encrypted key, as given by `network.transcoding.encrypted_to_raw`
+* a sequence of frames, each one as given by `network.transcoding.pack_sized`,
+  holding the nonce and ciphertext of one chunk
+
+The index of each chunk and a flag marking the last one are authenticated with
+the chunk, so that frames can neither be reordered nor dropped.
+
+"""
+import os
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterable, Iterator, Tuple, Union
+
+from umbral import Capsule, PublicKey, encrypt
+from umbral.dem import DEM
+
+from .transcoding import encrypted_to_raw, pack_sized
+
+
+#: Default size of the plaintext chunks (bytes)
+STREAM_CHUNK_SIZE = 1 << 20
+
+#: Size of the random key material encrypted by umbral
+STREAM_KEY_SIZE = 32
+
+#: Info string used to derive the chunks key from the key material
+STREAM_KDF_INFO = b"network-stream-v1"
+
+
+#: Types accepted as source of data to encrypt or decrypt
+StreamSource = Union[bytes, BinaryIO, Iterable[bytes]]
+
+
+def iter_chunks(source: StreamSource, chunk_size: int) -> Iterator[bytes]:
+    """Cut a source of data in chunks of chunk_size bytes. The last chunk may be shorter
+
+    Args:
+        source: bytes, a binary file-like object, or an iterable of bytes
+        chunk_size: Size of the chunks
+
+    Yields:
+        The chunks
+
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset : offset + chunk_size])
+        return
+
+    if hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    buffer = bytearray()
+    for piece in source:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class StreamReader(object):
+    """Reads exact amounts of bytes from a source of data
+
+    Args:
+        source: bytes, a binary file-like object, or an iterable of bytes
+
+    """
+
+    def __init__(self, source: StreamSource):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = [bytes(source)]
+        elif hasattr(source, "read"):
+            source = iter_chunks(source, STREAM_CHUNK_SIZE)
+        self._pieces = iter(source)
+        self._buffer = bytearray()
+
+    def read_exact(self, size: int) -> bytes:
+        """Read size bytes
+
+        Args:
+            size: Number of bytes to read
+
+        Returns:
+            The bytes read. Shorter than size only if the source is exhausted
+
+        """
+        while len(self._buffer) < size:
+            piece = next(self._pieces, None)
+            if piece is None:
+                break
+            self._buffer += piece
+
+        res = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return res
+
+    def read_sized(self) -> Union[bytes, None]:
+        """Read one byte string serialized by `network.transcoding.pack_sized`
+
+        Returns:
+            The byte string, or None if the source is exhausted
+
+        """
+        header = self.read_exact(4)
+        if len(header) == 0:
+            return None
+        if len(header) != 4:
+            raise ValueError("Truncated stream")
+
+        sze = int.from_bytes(header, "little")
+        res = self.read_exact(sze)
+        if len(res) != sze:
+            raise ValueError("Truncated stream")
+
+        return res
+
+
+def _chunk_ad(index: int, last: bool) -> bytes:
+    return index.to_bytes(8, "little") + (b"\x01" if last else b"\x00")
+
+
+def encrypt_stream(
+    public_key: PublicKey, source: StreamSource, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Encrypt a source of data chunk by chunk
+
+    Args:
+        public_key: The public key of the owner of the data
+        source: bytes, a binary file-like object, or an iterable of bytes
+        chunk_size: Size of the plaintext chunks
+
+    Yields:
+        The header with the capsule and the encrypted key, then one frame per chunk
+
+    """
+    key_material = os.urandom(STREAM_KEY_SIZE)
+    capsule, key_ciphertext = encrypt(public_key, key_material)
+    yield encrypted_to_raw(capsule, key_ciphertext)
+
+    dem = DEM(key_material, info=STREAM_KDF_INFO)
+
+    chunks = iter_chunks(source, chunk_size)
+    chunk = next(chunks, b"")
+    index = 0
+    while True:
+        next_chunk = next(chunks, None)
+        last = next_chunk is None
+        yield pack_sized(dem.encrypt(chunk, authenticated_data=_chunk_ad(index, last)))
+        if last:
+            return
+        chunk = next_chunk
+        index += 1
+
+
+def read_stream_header(reader: StreamReader) -> Tuple[Capsule, bytes]:
+    """Read the header written by `encrypt_stream`
+
+    Args:
+        reader: The reader on the encrypted stream
+
+    Returns:
+        The capsule
+        The encrypted key material
+
+    """
+    caps_bytes = reader.read_sized()
+    key_ciphertext = reader.read_sized()
+    if caps_bytes is None or key_ciphertext is None:
+        raise ValueError("Truncated stream")
+
+    return Capsule.from_bytes(caps_bytes), key_ciphertext
+
+
+async def aiter_sized(source: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Cut an asynchronous source of data in the byte strings serialized by
+    `network.transcoding.pack_sized`, as they are received
+
+    Args:
+        source: An asynchronous iterable of bytes, e.g. the body of an HTTP response
+
+    Yields:
+        The byte strings
+
+    """
+    buffer = bytearray()
+    async for piece in source:
+        buffer += piece
+        while len(buffer) >= 4:
+            sze = int.from_bytes(buffer[:4], "little")
+            if len(buffer) < 4 + sze:
+                break
+            yield bytes(buffer[4 : 4 + sze])
+            del buffer[: 4 + sze]
+    if buffer:
+        raise ValueError("Truncated stream")
+
+
+def decrypt_frame(dem: DEM, frame: bytes, index: int) -> Tuple[bytes, bool]:
+    """Decrypt one frame written by `encrypt_stream`
+
+    Args:
+        dem: The cipher built from the decrypted key material
+        frame: The frame
+        index: The index of the frame in the stream
+
+    Returns:
+        The plaintext chunk
+        True if the frame is the last one of the stream
+
+    """
+    try:
+        return dem.decrypt(frame, authenticated_data=_chunk_ad(index, False)), False
+    except ValueError:
+        return dem.decrypt(frame, authenticated_data=_chunk_ad(index, True)), True
+
+
+def decrypt_frames(key_material: bytes, reader: StreamReader) -> Iterator[bytes]:
+    """Decrypt the frames written by `encrypt_stream`, after the header
+
+    Args:
+        key_material: The decrypted key material
+        reader: The reader on the encrypted stream, positionned after the header
+
+    Yields:
+        The plaintext chunks
+
+    """
+    dem = DEM(key_material, info=STREAM_KDF_INFO)
+
+    index = 0
+    while True:
+        frame = reader.read_sized()
+        if frame is None:
+            raise ValueError("Truncated stream: last chunk is missing")
+
+        chunk, last = decrypt_frame(dem, frame, index)
+        yield chunk
+
+        if last:
+            if reader.read_sized() is not None:
+                raise ValueError("Unexpected data after the last chunk")
+            return
+
+        index += 1
+
+
+def is_stream(raw: bytes) -> bool:
+    """Tell whether the binary database value of an item has been built by
+    `encrypt_stream`, or by `network.transcoding.encrypted_to_raw`
+
+    Args:
+        raw: The binary database value of the item
+
+    Returns:
+        True if the data is a stream
+
+    """
+    view = memoryview(raw)
+    caps_sze = int.from_bytes(view[0:4], "little")
+    ciph_sze = int.from_bytes(view[4 + caps_sze : 8 + caps_sze], "little")
+    return len(view) > 8 + caps_sze + ciph_sze
@@ -1,24 +1,23 @@
-import os
 from pathlib import Path
 from asyncio import run as aiorun
 
-from sqlalchemy.ext.asyncio import create_async_engine
 from fastapi.testclient import TestClient
 
 from network.frontend.User import User
 from network.backend import models
+from network.backend.user_cache import user_cache
 from network.backend.main import app
 
 
 def prepare_database(ref_plaintext: str = "Président de la République Française"):
     async def _prepare_database():
-        db_uri = os.environ.get("DATABASE_URI", "sqlite+aiosqlite:///tests/test_data.db")
-
         default_db_uri = Path("tests/test_data.db")
         if default_db_uri.exists():
             default_db_uri.unlink()
+        # The users ids of the deleted database will be reused
+        user_cache.clear()
 
-        engine = create_async_engine(db_uri, echo=False)
+        engine = models.get_engine()
         target_metadata = models.Base.metadata
         async with engine.begin() as conn:
             await conn.run_sync(target_metadata.create_all)
@@ -32,7 +31,7 @@ def prepare_database(ref_plaintext: str = "Président de la République Françai
         async with con() as session:
             session.add(db_admin)
             await session.commit()
-            session.refresh(db_admin)
+            await session.refresh(db_admin)
             admin.id = db_admin.id
         admin.to_topsecret_file(Path("tests/admin.topsecret"))
 
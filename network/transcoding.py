@@ -1,7 +1,6 @@
 from base64 import b64decode, b64encode
 from datetime import datetime
-import struct
-from typing import Tuple
+from typing import List, Tuple
 
 from umbral import Capsule, PublicKey, VerifiedKeyFrag, VerifiedCapsuleFrag
 
@@ -48,6 +47,48 @@ def challenge_to_datetime(b64_hash: str) -> dict:
     return res
 
 
+def pack_sized(*chunks: bytes) -> bytes:
+    """Serialize byte strings, each one prefixed by its length as a little endian uint32.
+    This is the binary format of the data stored in the database
+
+    Args:
+        chunks: The byte strings to serialize
+
+    Returns:
+        The serialized data
+
+    """
+    parts = []
+    for chunk in chunks:
+        parts.append(len(chunk).to_bytes(4, "little"))
+        parts.append(chunk)
+
+    return b"".join(parts)
+
+
+def unpack_sized(dat: bytes, count: int) -> List[memoryview]:
+    """Deserialize byte strings serialized by `pack_sized`, without copying them
+
+    Args:
+        dat: The serialized data
+        count: Number of byte strings to read
+
+    Returns:
+        The list of byte strings, as views on dat
+
+    """
+    view = memoryview(dat)
+    chunks = []
+    offset = 0
+    for _ in range(count):
+        sze = int.from_bytes(view[offset : offset + 4], "little")
+        offset += 4
+        chunks.append(view[offset : offset + sze])
+        offset += sze
+
+    return chunks
+
+
 def db_bytes_to_kfrag(db_data: str) -> VerifiedKeyFrag:
     """Build a `VerifiedKeyFrag` from the database string
 
@@ -58,55 +99,67 @@ def db_bytes_to_kfrag(db_data: str) -> VerifiedKeyFrag:
         The verified kfrag
 
     """
-    dat = b64decode(db_data.encode(encoding="ascii"))
+    (kfrag_bytes,) = unpack_sized(b64decode(db_data), 1)
 
-    (kfrag_sze,) = struct.unpack_from("<I", dat, offset=0)
-    kfrag_bytes = dat[4 : 4 + kfrag_sze]
-
-    kfrag = VerifiedKeyFrag.from_verified_bytes(kfrag_bytes)
+    kfrag = VerifiedKeyFrag.from_verified_bytes(bytes(kfrag_bytes))
 
     return kfrag
 
 
-def db_bytes_to_cfrag(db_data: str) -> VerifiedCapsuleFrag:
-    """Build a `VerifiedCapsuleFrag` from the database string
+def raw_to_cfrag(raw: bytes) -> VerifiedCapsuleFrag:
+    """Build a `VerifiedCapsuleFrag` from the database binary value
 
     Args:
-        db_data: cfrag as stored in the database
+        raw: cfrag as stored in the database
 
     Returns:
         The verified cfrag
 
     """
-    dat = b64decode(db_data.encode(encoding="ascii"))
+    (cfrag_bytes,) = unpack_sized(raw, 1)
 
-    (cfrag_sze,) = struct.unpack_from("<I", dat, offset=0)
-    cfrag_bytes = dat[4 : 4 + cfrag_sze]
-
-    cfrag = VerifiedCapsuleFrag.from_verified_bytes(cfrag_bytes)
+    cfrag = VerifiedCapsuleFrag.from_verified_bytes(bytes(cfrag_bytes))
 
     return cfrag
 
 
-def cfrag_to_json(cfrag: VerifiedCapsuleFrag) -> dict:
+def db_bytes_to_cfrag(db_data: str) -> VerifiedCapsuleFrag:
+    """Build a `VerifiedCapsuleFrag` from the JSON string
+
+    Args:
+        db_data: cfrag as sent in JSON, i.e. the base64 encoded database value
+
+    Returns:
+        The verified cfrag
+
+    """
+    return raw_to_cfrag(b64decode(db_data))
+
+
+def cfrag_to_raw(cfrag: VerifiedCapsuleFrag) -> bytes:
     """Codes a `VerifiedCapsuleFrag` for write in the database
 
     Args:
         cfrag: The verified cfrag to store in the database
 
     Returns:
-        A dictionary with key 'cfrag' and the db value as a string
+        The db binary value
 
     """
-    cfrag_bytes = bytes(cfrag)
-    cfrag_sze = len(cfrag_bytes)
+    return pack_sized(bytes(cfrag))
 
-    dat = struct.pack(
-        "<I" + cfrag_sze * "B",
-        cfrag_sze,
-        *cfrag_bytes,
-    )
-    b64data = b64encode(dat).decode(encoding="ascii")
+
+def cfrag_to_json(cfrag: VerifiedCapsuleFrag) -> dict:
+    """Codes a `VerifiedCapsuleFrag` for JSON transfer
+
+    Args:
+        cfrag: The verified cfrag to send
+
+    Returns:
+        A dictionary with key 'cfrag' and the base64 encoded db value as a string
+
+    """
+    b64data = b64encode(cfrag_to_raw(cfrag)).decode(encoding="ascii")
 
     return {"cfrag": b64data}
 
@@ -121,69 +174,74 @@ def kfrag_to_json(kfrag: VerifiedKeyFrag) -> dict:
         A dictionary with key 'kfrag' and the db value as a string
 
     """
-    kfrag_bytes = bytes(kfrag)
-    kfrag_sze = len(kfrag_bytes)
-
-    dat = struct.pack(
-        "<I" + kfrag_sze * "B",
-        kfrag_sze,
-        *kfrag_bytes,
-    )
+    dat = pack_sized(bytes(kfrag))
     b64data = b64encode(dat).decode(encoding="ascii")
     return {"kfrag": b64data}
 
 
-def encrypted_to_json(capsule: Capsule, ciphertext: bytes) -> dict:
-    """Codes an encrypted for write in the database
+def encrypted_to_raw(capsule: Capsule, ciphertext: bytes) -> bytes:
+    """Codes an encrypted message for write in the database
 
     Args:
         capsule: The capsule of the encrypted message
         ciphertext: The encrypted messages bytes
 
     Returns:
-        A dictionary with key 'encrypted_data' and the db value as a string
+        The db binary value
 
     """
-    caps_sze = capsule.serialized_size()
-    ciph_sze = len(ciphertext)
+    return pack_sized(bytes(capsule), ciphertext)
 
-    dat = struct.pack(
-        "<I" + caps_sze * "B" + "I" + ciph_sze * "B",
-        caps_sze,
-        *bytes(capsule),
-        ciph_sze,
-        *ciphertext,
-    )
-    b64data = b64encode(dat).decode(encoding="ascii")
+
+def encrypted_to_json(capsule: Capsule, ciphertext: bytes) -> dict:
+    """Codes an encrypted message for JSON transfer
+
+    Args:
+        capsule: The capsule of the encrypted message
+        ciphertext: The encrypted messages bytes
+
+    Returns:
+        A dictionary with key 'encrypted_data' and the base64 encoded db value as a string
+
+    """
+    b64data = b64encode(encrypted_to_raw(capsule, ciphertext)).decode(encoding="ascii")
     return {
         "encrypted_data": b64data,
     }
 
 
-def db_bytes_to_encrypted(db_data: str) -> Tuple[Capsule, bytes]:
+def raw_to_encrypted(raw: bytes) -> Tuple[Capsule, memoryview]:
     """Decodes an encrypted message as stored in the database
 
     Args:
-        db_data: The database representation of the message
+        raw: The database binary value of the message
 
     Returns:
         The capsule of the encrypted message
-        The encrypted messages bytes
+        The encrypted messages bytes, as a view on raw
 
     """
-    b64data = db_data.encode(encoding="ascii")
-    dat = b64decode(b64data)
+    caps_bytes, ciphertext = unpack_sized(raw, 2)
 
-    (caps_sze,) = struct.unpack_from("<I", dat, offset=0)
-    caps_bytes = dat[4 : 4 + caps_sze]
-    (ciph_sze,) = struct.unpack_from("<I", dat, offset=4 + caps_sze)
-    ciphertext = dat[4 + caps_sze + 4 : 4 + caps_sze + 4 + ciph_sze]
-
-    capsule = Capsule.from_bytes(caps_bytes)
+    capsule = Capsule.from_bytes(bytes(caps_bytes))
 
     return capsule, ciphertext
 
 
+def db_bytes_to_encrypted(db_data: str) -> Tuple[Capsule, memoryview]:
+    """Decodes an encrypted message as sent in JSON
+
+    Args:
+        db_data: The base64 encoded database value of the message
+
+    Returns:
+        The capsule of the encrypted message
+        The encrypted messages bytes, as a view on the decoded value
+
+    """
+    return raw_to_encrypted(b64decode(db_data))
+
+
 def encodeKey(pkey: PublicKey) -> str:
     """Encodes a `PublicKey` as a database string
 
@@ -209,7 +267,7 @@ def decodeKey(db_key: str) -> PublicKey:
         The database representation of the message
 
     """
-    key_bytes = b64decode(db_key.encode(encoding="ascii"))
+    key_bytes = b64decode(db_key)
     key = PublicKey.from_bytes(key_bytes)
 
     return key
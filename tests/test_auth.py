@@ -5,6 +5,7 @@ import unittest
 from fastapi.testclient import TestClient
 
 from network.backend.auth_depend import challenge_auth
+from network.backend.session_token import check_token, mint_token
 from network.frontend.User import User
 from network.backend.main import app
 from network.testing import prepare_database
@@ -84,8 +85,64 @@ class TestAuthentication(unittest.TestCase):
         assert r.status_code == 401
         assert "Invalid challenge signature" in r.json()["detail"]
 
+    def test_token(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        challenge_str = alice.build_challenge()
+        r = client.post("/users/token", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        token = r.json()["token"]
+        assert r.json()["lifetime"] > 0
+
+        r = client.get("/item/", headers={"Authorization": f"Bearer {token}"})
+        assert r.status_code == 200
+        r = client.get("/item/", headers={"Authorization": f"Bearer {token}"})
+        assert r.status_code == 200
+
+        # ==============================================================================
+
+        r = client.post("/users/token", headers={"Authorization": f"Bearer {token}"})
+        assert r.status_code == 401
+        assert r.json()["detail"] == "No challenge provided with the request"
+
+        # ==============================================================================
+
+        user_id, expires, b64_hmac = token.split(".")
+        forged_token = f"{int(user_id) + 1}.{expires}.{b64_hmac}"
+        r = client.get("/item/", headers={"Authorization": f"Bearer {forged_token}"})
+        assert r.status_code == 401
+        assert r.json()["detail"] == "Invalid session token signature"
+
+        for bad_token in (f"x.{expires}.{b64_hmac}", f"{user_id}.{expires}.é"):
+            assert check_token(bad_token) == {
+                "status": 401,
+                "message": "Invalid session token signature",
+            }
+
+        # ==============================================================================
+
+        # Token still valid for a user deleted since it was minted
+        deleted_token, _ = mint_token(1245636)
+        for method, url in (
+            ("post", "/users/"),
+            ("get", "/admin/blobs"),
+            ("get", "/item/"),
+            ("post", "/share/batch"),
+        ):
+            r = client.request(
+                method,
+                url,
+                headers={"Authorization": f"Bearer {deleted_token}"},
+                json=alice.to_json(),
+            )
+            assert r.status_code == 401
+            assert r.json()["detail"] == "The user making the challenge could not be found"
+
 
 if __name__ == "__main__":
     TestAuthentication.setUpClass()
     a = TestAuthentication()
     a.test_auth_errors()
+    a.test_token()
@@ -0,0 +1,42 @@
+import unittest
+
+from benchmarks.__main__ import BENCHMARKS_DIR
+from benchmarks.runner import compare, run_suite, time_function
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_time_function(self):
+        number, samples = time_function(lambda: None, number=0, repeat=3, min_time=0.001)
+        assert number > 1
+        assert len(samples) == 3
+
+        number, samples = time_function(lambda: None, number=7, repeat=2, min_time=1)
+        assert number == 7
+        assert len(samples) == 2
+
+    def test_run_suite(self):
+        seen = []
+        base = run_suite(
+            BENCHMARKS_DIR,
+            pattern="Keys.time_",
+            repeat=2,
+            min_time=0.001,
+            progress=lambda key, stats: seen.append(key),
+        )
+        assert sorted(base["results"]) == sorted(seen)
+        assert "bench_transcoding.Keys.time_encodeKey" in base["results"]
+        assert base["machine"]["python"] != ""
+
+        head = {"results": {key: dict(stats) for key, stats in base["results"].items()}}
+        head["results"]["bench_transcoding.Keys.time_encodeKey"]["median"] *= 2
+        head["results"]["bench_transcoding.Keys.time_decodeKey"]["median"] /= 2
+        verdicts = {row[0]: row[4] for row in compare(base, head, threshold=1.1)}
+        assert verdicts["bench_transcoding.Keys.time_encodeKey"] == "slower"
+        assert verdicts["bench_transcoding.Keys.time_decodeKey"] == "faster"
+        assert verdicts["bench_transcoding.Keys.time_datetime_to_challenge"] == ""
+
+
+if __name__ == "__main__":
+    a = TestBenchmarks()
+    a.test_time_function()
+    a.test_run_suite()
@@ -0,0 +1,236 @@
+from asyncio import run as aiorun
+import os
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from network.backend import blob_store, models
+from network.backend.main import app
+from network.frontend.User import User
+from network.schemas import ItemModel
+from network.transcoding import encrypted_to_raw
+from network.testing import prepare_database
+
+
+class TestBlobStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        prepare_database()
+
+    def test_storage_interface(self):
+        with self.assertRaises(TypeError):
+            blob_store.BlobStorage()
+
+        with tempfile.TemporaryDirectory() as root:
+            storage = blob_store.LocalBlobStorage(Path(root))
+            storage.write("abcdef", b"data")
+            with storage.read("abcdef") as m:
+                assert m[:] == b"data"
+            storage.delete("abcdef")
+            assert not storage.path("abcdef").exists()
+
+    def test_refcount(self):
+        async def _check():
+            con = models.get_connection()
+            async with con() as db:
+                hashes = await blob_store.reference_blobs(db, [b"a", b"bc", b"a"])
+                assert hashes[0] == hashes[2] == blob_store.blob_hash(b"a")
+                await blob_store.reference_blobs(db, [b"bc"])
+                await db.commit()
+
+                blobs = {blob.hash: blob for blob in await db.run_sync(_all_blobs)}
+                assert blobs[hashes[0]].refcount == 2
+                assert blobs[hashes[1]].refcount == 2
+                assert blobs[hashes[1]].size == 2
+
+                await blob_store.release_blobs(db, [hashes[0], hashes[1], hashes[0], None])
+                await db.commit()
+                blobs = {blob.hash: blob for blob in await db.run_sync(_all_blobs)}
+                assert hashes[0] not in blobs
+                assert blobs[hashes[1]].refcount == 1
+
+                await blob_store.release_blobs(db, [hashes[1]])
+                await db.commit()
+
+        def _all_blobs(session):
+            return session.query(models.Blob).populate_existing().all()
+
+        aiorun(_check())
+
+    def test_deleted_while_referenced(self):
+        real_existing_blobs = blob_store.existing_blobs
+        stale = {blob_store.blob_hash(b"deleted")}
+
+        async def _existing_blobs(db, hashes):
+            # The first lookup happens before the blob is deleted by another transaction
+            if stale:
+                return {stale.pop()}
+            return await real_existing_blobs(db, hashes)
+
+        async def _check():
+            con = models.get_connection()
+            async with con() as db:
+                with mock.patch.object(blob_store, "existing_blobs", _existing_blobs):
+                    (hash,) = await blob_store.reference_blobs(db, [b"deleted"])
+                await db.commit()
+
+                blob = await db.get(models.Blob, hash)
+                assert blob.refcount == 1
+                assert blob.data == b"deleted"
+
+                await blob_store.release_blobs(db, [hash])
+                await db.commit()
+
+        aiorun(_check())
+
+    def test_stored_again_while_deleted(self):
+        data = b"stored again" * 4
+
+        async def _check():
+            path = blob_store.get_blob_storage().path(blob_store.blob_hash(data))
+            con = models.get_connection()
+            async with con() as db, con() as other_db:
+                (hash,) = await blob_store.reference_blobs(db, [data])
+                await db.commit()
+                external = await blob_store.release_blobs(db, [hash])
+                await db.commit()
+                assert external == [hash]
+
+                # Another request stores the blob before the file is deleted
+                await blob_store.reference_blobs(other_db, [data])
+                await other_db.commit()
+                await blob_store.delete_files(db, external)
+                assert path.read_bytes() == data
+
+                external = await blob_store.release_blobs(other_db, [hash])
+                await other_db.commit()
+                await blob_store.delete_files(other_db, external)
+                assert not path.exists()
+
+        with tempfile.TemporaryDirectory() as root:
+            env = {"BLOB_STORAGE_DIR": root, "BLOB_INLINE_THRESHOLD": "16"}
+            with mock.patch.dict(os.environ, env):
+                aiorun(_check())
+
+    def test_dedup_stats(self):
+        client = TestClient(app)
+
+        admin = User(config_file=Path("tests/admin.topsecret"))
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        def _stats(user):
+            challenge_str = user.build_challenge()
+            return client.get("/admin/blobs", headers={"Challenge": challenge_str})
+
+        r = _stats(alice)
+        assert r.status_code == 403
+
+        r = _stats(admin)
+        assert r.status_code == 200
+        before = r.json()
+
+        # The same ciphertext uploaded 3 times is stored once
+        data = alice.encrypt_for_db(b"dedup")
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch", json=[data] * 3, headers={"Challenge": challenge_str})
+        item_ids = [item["id"] for item in r.json()]
+
+        after = _stats(admin).json()
+        assert after["blobs"] == before["blobs"] + 1
+        assert after["references"] == before["references"] + 3
+        assert after["logical_bytes"] - before["logical_bytes"] == 3 * (
+            after["stored_bytes"] - before["stored_bytes"]
+        )
+        assert after["dedup_ratio"] > 1
+
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch-delete", json=item_ids, headers={"Challenge": challenge_str})
+        assert r.json() == item_ids
+        assert _stats(admin).json() == before
+
+    def test_external_storage(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        with tempfile.TemporaryDirectory() as root:
+            os.environ["BLOB_STORAGE_DIR"] = root
+            os.environ["BLOB_INLINE_THRESHOLD"] = "16"
+            try:
+                data = alice.encrypt_for_db(b"stored in a file")
+                challenge_str = alice.build_challenge()
+                r = client.post("/item", json=data, headers={"Challenge": challenge_str})
+                assert r.status_code == 200
+                item_id = r.json()["id"]
+
+                async def _get_blob():
+                    con = models.get_connection()
+                    async with con() as db:
+                        db_item = await db.get(models.Item, item_id)
+                        return await db.get(models.Blob, db_item.blob_hash)
+
+                blob = aiorun(_get_blob())
+                assert blob.external
+                assert blob.data is None
+                path = Path(root) / blob.hash[:2] / blob.hash[2:4] / blob.hash
+                assert path.is_file()
+
+                challenge_str = alice.build_challenge()
+                r = client.get(f"/item/{item_id}", headers={"Challenge": challenge_str})
+                assert alice.decrypt(ItemModel(**r.json()).toUmbral()) == b"stored in a file"
+
+                challenge_str = alice.build_challenge()
+                r = client.get(f"/item/{item_id}/raw", headers={"Challenge": challenge_str})
+                assert r.status_code == 200
+                assert r.content == path.read_bytes()
+
+                challenge_str = alice.build_challenge()
+                r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+                assert r.status_code == 200
+                assert not path.exists()
+
+                # A raw upload sent in chunks is spooled, then copied to its file
+                u_item = alice.encrypt(b"streamed to a file")
+                raw_data = encrypted_to_raw(u_item.capsule, u_item.ciphertext)
+                chunks = [raw_data[i : i + 10] for i in range(0, len(raw_data), 10)]
+                challenge_str = alice.build_challenge()
+                r = client.post(
+                    "/item/raw",
+                    content=iter(chunks),
+                    headers={
+                        "Challenge": challenge_str,
+                        "Content-Type": "application/octet-stream",
+                    },
+                )
+                assert r.status_code == 200
+                item_id = r.json()["id"]
+
+                hash = blob_store.blob_hash(raw_data)
+                path = Path(root) / hash[:2] / hash[2:4] / hash
+                assert path.read_bytes() == raw_data
+
+                challenge_str = alice.build_challenge()
+                r = client.get(f"/item/{item_id}/raw", headers={"Challenge": challenge_str})
+                assert r.content == raw_data
+
+                challenge_str = alice.build_challenge()
+                r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+                assert r.status_code == 200
+                assert not path.exists()
+            finally:
+                os.environ.pop("BLOB_STORAGE_DIR")
+                os.environ.pop("BLOB_INLINE_THRESHOLD")
+
+
+if __name__ == "__main__":
+    TestBlobStore.setUpClass()
+    a = TestBlobStore()
+    a.test_storage_interface()
+    a.test_refcount()
+    a.test_deleted_while_referenced()
+    a.test_stored_again_while_deleted()
+    a.test_dedup_stats()
+    a.test_external_storage()
@@ -10,5 +10,14 @@ def test_app():
     runner.invoke(tapp, ["--port", 3035, "--test"])
 
 
+def test_workers_replay_store():
+    # The workers of a server cannot each remember the challenges they saw
+    env = {"REPLAY_STORE": "memory", "NOTIFIER": "memory"}
+    result = runner.invoke(tapp, ["run-server", "--workers", "2", "--test"], env=env)
+    assert result.exit_code != 0
+    assert "REPLAY_STORE=memory" in result.output
+
+
 if __name__ == "__main__":
     test_app()
+    test_workers_replay_store()
@@ -0,0 +1,55 @@
+from asyncio import run as aiorun
+import os
+import unittest
+from unittest import mock
+
+from network.backend import crud
+from network.backend.crypto_executor import portable_key, run_crypto, shutdown_executor
+from network.backend.models import verify_challenge_signature
+from network.backend.Proxy import Proxy
+from network.frontend.User import User
+from network.transcoding import challenge_to_datetime, encrypted_to_raw, raw_to_cfrag
+
+
+class TestCryptoExecutor(unittest.TestCase):
+    async def _run_crypto(self):
+        alice = User()
+        bob = User()
+
+        _, b64_hash, b64_sign = alice.build_challenge().split(":")
+        iso = challenge_to_datetime(b64_hash)["iso"]
+        vkey = portable_key(alice.verifying_key)
+        assert await run_crypto(verify_challenge_signature, vkey, iso, b64_sign)
+        vkey = portable_key(bob.verifying_key)
+        assert not await run_crypto(verify_challenge_signature, vkey, iso, b64_sign)
+
+        u_item = alice.encrypt(b"Je suis un poney")
+        encrypted_data = encrypted_to_raw(u_item.capsule, u_item.ciphertext)
+        db_kfrag = alice.generate_kfrags_for_db(bob.public_key)["kfrag"]
+        db_cfrag = await run_crypto(Proxy().reencrypt_for_db, encrypted_data, db_kfrag)
+        u_item.cfrag = raw_to_cfrag(db_cfrag)
+        u_item.sender_pkey = alice.public_key
+        assert bob.decrypt(u_item) == b"Je suis un poney"
+
+        # Only the capsule is sent to the pool, the payload may be a memory map
+        (db_cfrag,) = await crud.reencrypt(memoryview(encrypted_data), [db_kfrag])
+        u_item.cfrag = raw_to_cfrag(db_cfrag)
+        assert bob.decrypt(u_item) == b"Je suis un poney"
+
+    def test_thread_pool(self):
+        with mock.patch.dict(os.environ, {"CRYPTO_EXECUTOR": "thread", "CRYPTO_WORKERS": "2"}):
+            shutdown_executor()
+            aiorun(self._run_crypto())
+            shutdown_executor()
+
+    def test_process_pool(self):
+        with mock.patch.dict(os.environ, {"CRYPTO_EXECUTOR": "process", "CRYPTO_WORKERS": "2"}):
+            shutdown_executor()
+            aiorun(self._run_crypto())
+            shutdown_executor()
+
+
+if __name__ == "__main__":
+    a = TestCryptoExecutor()
+    a.test_thread_pool()
+    a.test_process_pool()
@@ -1,18 +1,24 @@
+import asyncio
+from asyncio import run as aiorun
+from io import BytesIO
 from pathlib import Path
+import tempfile
 import unittest
 
 import uvicorn
 
 from network.backend.main import Server
+from network.backend.proxy_worker import run_proxy
 from network.frontend.Admin import Admin
+from network.frontend.AsyncAdmin import AsyncAdmin
+from network.frontend.AsyncUser import AsyncUser
 from network.frontend.User import User
 
 
 class TestFrontend(unittest.TestCase):
-    def admin_create_user(self, server_url: str, public_file: Path):
+    def register_admin(self, admin: Admin):
         import network.backend.models as md
 
-        admin = Admin(server_url=server_url)
         data = admin.to_json()
         db_admin = md.DbUser(
             admin=True, public_key=data["public_key"], verifying_key=data["verifying_key"]
@@ -24,6 +30,9 @@ class TestFrontend(unittest.TestCase):
             session.refresh(db_admin)
             admin.id = db_admin.id
 
+    def admin_create_user(self, server_url: str, public_file: Path):
+        admin = Admin(server_url=server_url)
+        self.register_admin(admin)
         user_id = admin.createUser(public_file)
 
         return user_id
@@ -60,23 +69,190 @@ class TestFrontend(unittest.TestCase):
             eve.to_topsecret_file(id_file)
 
             # User reloading through the .topsecret file
-            eve = User(server_url=server_url, config_file=id_file)
+            with User(server_url=server_url, config_file=id_file, pool_size=4) as eve:
+
+                test_id = eve.saveItemInDatabase(ref_plaintext.encode(encoding="utf-8"))
+
+                l_id = list(eve.loadItemIdList())
+                assert test_id in l_id
+
+                item_id = l_id[0]
+                plaintext = eve.loadItemFromDatabase(item_id)
+
+                assert ref_plaintext == plaintext.decode(encoding="utf-8")
+
+                # The cached items are revalidated, and not downloaded again while unchanged
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    cached_eve = User(
+                        server_url=server_url,
+                        config_file=id_file,
+                        cache_file=Path(cache_dir) / "cache.db",
+                    )
+                    statuses = []
+                    cached_eve.client.event_hooks["response"].append(
+                        lambda r: statuses.append(r.status_code)
+                    )
+                    for raw in [False, True, False, True]:
+                        plaintext = cached_eve.loadItemFromDatabase(item_id, raw=raw)
+                        assert ref_plaintext == plaintext.decode(encoding="utf-8")
+                    assert statuses[-4:] == [200, 200, 304, 304]
+                    cached_eve.close()
+
+                # Only the changes since the previous synchronization are downloaded
+                with tempfile.TemporaryDirectory() as sync_dir:
+                    res = eve.sync(sync_dir, page_size=3)
+                    plaintext = (Path(sync_dir) / str(test_id)).read_bytes()
+                    assert ref_plaintext == plaintext.decode(encoding="utf-8")
+                    assert test_id in res["updated"]
+
+                    sync_id = eve.saveItemInDatabase(b"synchronized")
+                    assert eve.sync(sync_dir) == {"updated": [sync_id], "deleted": []}
+                    assert (Path(sync_dir) / str(sync_id)).read_bytes() == b"synchronized"
+                    eve.deleteItemFromDatabase(sync_id)
+                    assert eve.sync(sync_dir) == {"updated": [], "deleted": [sync_id]}
+                    assert not (Path(sync_dir) / str(sync_id)).exists()
+
+                raw_id = eve.saveItemInDatabase(ref_plaintext.encode(encoding="utf-8"), raw=True)
+                plaintext = eve.loadItemFromDatabase(raw_id, raw=True)
+                assert ref_plaintext == plaintext.decode(encoding="utf-8")
+                eve.deleteItemFromDatabase(raw_id)
+
+                big_plaintext = bytes(range(256)) * 1000
+                stream_id = eve.saveStreamInDatabase(BytesIO(big_plaintext), chunk_size=10_000)
+                chunks = eve.loadStreamFromDatabase(stream_id)
+                assert b"".join(chunks) == big_plaintext
+                assert eve.loadItemFromDatabase(stream_id) == big_plaintext
+                shared_ids = eve.shareItems(
+                    [stream_id], {eve.id: eve.public_key}, threshold=2, shares=3
+                )
+                assert b"".join(eve.loadStreamFromDatabase(shared_ids[0])) == big_plaintext
+                eve.deleteItemFromDatabase(shared_ids[0])
+                eve.deleteItemFromDatabase(stream_id)
+
+                plaintexts = [f"{ref_plaintext} {k}".encode(encoding="utf-8") for k in range(7)]
+                batch_ids = eve.saveItems(plaintexts, batch_size=3)
+                assert len(batch_ids) == 7
+                assert eve.loadItems(batch_ids[::-1], batch_size=3) == plaintexts[::-1]
+
+                shared_ids = eve.shareItems(batch_ids[:2], {eve.id: eve.public_key}, batch_size=1)
+                assert eve.loadItems(shared_ids) == plaintexts[:2]
+                assert eve.deleteItems(shared_ids) == shared_ids
+
+                job_id = eve.submitShare(batch_ids[0], eve.id, eve.public_key)
+                assert eve.getShareJob(job_id)["status"] == "pending"
+                aiorun(run_proxy(once=True))
+                job = eve.getShareJob(job_id)
+                assert job["status"] == "done"
+                assert eve.loadItemFromDatabase(job["item_id"]) == plaintexts[0]
+                eve.deleteItemFromDatabase(job["item_id"])
+                assert eve.deleteItems(batch_ids + [6867474357], batch_size=3) == batch_ids
+
+                # All the requests go through the same pool of connections
+                client = eve.client
+                eve.deleteItemFromDatabase(item_id)
+                l_id = list(eve.loadItemIdList())
+                assert eve.client is client
+                assert item_id not in l_id
+
+            # The connections are closed when leaving the with block
+            assert eve._client is None
+
+    def test_async_frontend(self, host: str = "127.0.0.1", port: int = 3101):
+        server_url = f"http://{host}:{port}"
+
+        config = uvicorn.Config(
+            "network.backend.main:app",
+            host=host,
+            port=port,
+            log_level="info",
+            workers=1,
+            reload=False,
+        )
+        server = Server(config=config)
+
+        async def _check():
+            admin = AsyncAdmin(server_url=server_url)
+            self.register_admin(admin)
+
+            frank = AsyncUser(server_url=server_url, pool_size=4)
+            frank_public = Path("tests/frank.public")
+            frank.to_public_file(frank_public)
+            async with admin:
+                frank.id = await admin.createUser(frank_public)
+                before = await admin.getBlobStats()
 
-            test_id = eve.saveItemInDatabase(ref_plaintext.encode(encoding="utf-8"))
+            # The connections can only be closed asynchronously
+            with self.assertRaises(TypeError):
+                with frank:
+                    pass
 
-            l_id = eve.loadItemIdList()
-            assert test_id in l_id
+            async with frank:
+                events = await frank.notifications()
 
-            item_id = l_id[0]
-            plaintext = eve.loadItemFromDatabase(item_id)
+                plaintexts = [f"Item {k}".encode(encoding="utf-8") for k in range(20)]
+                item_ids = await frank.saveItems(plaintexts, batch_size=3, concurrency=4)
+                # The batches are saved concurrently, so their ids may interleave
+                l_id = [item_id async for item_id in frank.loadItemIdList(page_size=7)]
+                assert l_id == sorted(item_ids)
 
-            assert ref_plaintext == plaintext.decode(encoding="utf-8")
+                # One request per item, at most 4 at once
+                assert await frank.loadItems(item_ids, batch_size=1, concurrency=4) == plaintexts
+                assert await frank.loadItems(item_ids[::-1], batch_size=6) == plaintexts[::-1]
 
-            eve.deleteItemFromDatabase(item_id)
-            l_id = eve.loadItemIdList()
-            assert item_id not in l_id
+                raw_id = await frank.saveItemInDatabase(b"raw item", raw=True)
+                assert await frank.loadItemFromDatabase(raw_id, raw=True) == b"raw item"
+                assert await frank.loadItemFromDatabase(raw_id) == b"raw item"
+
+                big_plaintext = bytes(range(256)) * 1000
+                stream_id = await frank.saveStreamInDatabase(
+                    BytesIO(big_plaintext), chunk_size=10_000
+                )
+                chunks = await frank.loadStreamFromDatabase(stream_id, chunk_size=3_000)
+                assert b"".join([chunk async for chunk in chunks]) == big_plaintext
+
+                shared_ids = await frank.shareItems(
+                    [stream_id], {frank.id: frank.public_key}, threshold=2, shares=3
+                )
+                chunks = await frank.loadStreamFromDatabase(shared_ids[0])
+                assert b"".join([chunk async for chunk in chunks]) == big_plaintext
+
+                job_id = await frank.submitShare(raw_id, frank.id, frank.public_key)
+                await run_proxy(once=True)
+                job = await frank.getShareJob(job_id)
+                assert await frank.loadItemFromDatabase(job["item_id"]) == b"raw item"
+
+                # The changes are pushed, including the share made by the proxy worker
+                received = []
+                while {"item_id": job["item_id"], "kind": "shared"} not in received:
+                    received.append(await asyncio.wait_for(events.__anext__(), timeout=5))
+                assert received[0] == {"item_id": min(item_ids), "kind": "created"}
+                await events.aclose()
+
+                with tempfile.TemporaryDirectory() as sync_dir:
+                    res = await frank.sync(sync_dir, page_size=7, batch_size=2)
+                    assert sorted(res["updated"]) == sorted(
+                        item_ids + [raw_id, stream_id, shared_ids[0], job["item_id"]]
+                    )
+                    assert (Path(sync_dir) / str(item_ids[3])).read_bytes() == plaintexts[3]
+
+                    for item_id in [job["item_id"], raw_id, stream_id, shared_ids[0]]:
+                        await frank.deleteItemFromDatabase(item_id)
+
+                    res = await frank.sync(sync_dir)
+                    assert sorted(res["deleted"]) == sorted(
+                        [job["item_id"], raw_id, stream_id, shared_ids[0]]
+                    )
+                    assert res["updated"] == []
+                assert sorted(await frank.deleteItems(item_ids, batch_size=7)) == sorted(item_ids)
+
+            async with admin:
+                assert await admin.getBlobStats() == before
+
+        with server.run_in_thread():
+            aiorun(_check())
 
 
 if __name__ == "__main__":
     a = TestFrontend()
     a.test_frontend()
+    a.test_async_frontend()
@@ -5,7 +5,9 @@ from fastapi.testclient import TestClient
 
 from network.frontend.User import User
 from network.backend.main import app
+from network.schemas import UmbralMessage
 from network.testing import prepare_database
+from network.transcoding import encrypted_to_raw, pack_sized, raw_to_encrypted
 
 
 class TestItem(unittest.TestCase):
@@ -94,6 +96,275 @@ class TestItem(unittest.TestCase):
         r = client.post("/item/", json=data, headers={"Challenge": challenge_str})
         assert r.status_code == 200
 
+        # Malformed base64
+        for url, bad_data in (
+            ("/item/", {**data, "encrypted_data": "abc"}),
+            ("/item/", {**data, "encrypted_data": "a$b%"}),
+            ("/item/batch", [data, {**data, "encrypted_data": "abc"}]),
+        ):
+            challenge_str = alice.build_challenge()
+            r = client.post(url, json=bad_data, headers={"Challenge": challenge_str})
+            assert r.status_code == 422
+            assert r.json()["detail"] == "Item data is not valid base64"
+
+    def test_raw_item_data(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        u_item = alice.encrypt(TestItem.ref_plaintext.encode())
+        raw_data = encrypted_to_raw(u_item.capsule, u_item.ciphertext)
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/raw",
+            content=raw_data,
+            headers={"Challenge": challenge_str, "Content-Type": "application/octet-stream"},
+        )
+        assert r.status_code == 200
+        item_id = r.json()["id"]
+
+        challenge_str = alice.build_challenge()
+        r = client.get(f"/item/{item_id}/raw", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert r.headers["Content-Type"] == "application/octet-stream"
+        assert r.content == raw_data
+        assert "Item-Cfrag" not in r.headers
+
+        u_item = alice.encrypt(b"Je suis un poney")
+        challenge_str = alice.build_challenge()
+        r = client.put(
+            f"/item/{item_id}/raw",
+            content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+            headers={"Challenge": challenge_str},
+        )
+        assert r.status_code == 200
+
+        challenge_str = alice.build_challenge()
+        r = client.get(f"/item/{item_id}/raw", headers={"Challenge": challenge_str})
+        capsule, ciphertext = raw_to_encrypted(r.content)
+        plaintext = alice.decrypt(UmbralMessage(capsule=capsule, ciphertext=ciphertext))
+        assert plaintext == b"Je suis un poney"
+
+        challenge_str = alice.build_challenge()
+        r = client.put(f"/item/{item_id}/raw", content=b"foo", headers={"Challenge": challenge_str})
+        assert r.status_code == 422
+
+        # The body is not read before the user is authenticated
+        for method, url in (("put", f"/item/{item_id}/raw"), ("post", "/item/raw")):
+            r = client.request(method, url, content=b"foo")
+            assert r.status_code == 401
+
+        # Well formed, but the capsule is not a valid point
+        bad_capsule = bytes(len(bytes(u_item.capsule)))
+        challenge_str = alice.build_challenge()
+        r = client.put(
+            f"/item/{item_id}/raw",
+            content=pack_sized(bad_capsule, u_item.ciphertext),
+            headers={"Challenge": challenge_str},
+        )
+        assert r.status_code == 422
+
+        challenge_str = alice.build_challenge()
+        r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+
+    def test_item_pagination(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        data = alice.encrypt_for_db(TestItem.ref_plaintext.encode())
+        for _ in range(5):
+            challenge_str = alice.build_challenge()
+            r = client.post("/item/", json=data, headers={"Challenge": challenge_str})
+            assert r.status_code == 200
+
+        challenge_str = alice.build_challenge()
+        r = client.get("/item/", headers={"Challenge": challenge_str})
+        all_ids = r.json()
+        assert len(all_ids) >= 5
+        assert all_ids == sorted(all_ids)
+
+        page_ids = []
+        after_id = None
+        while True:
+            params = {"limit": 2}
+            if after_id is not None:
+                params["after_id"] = after_id
+            challenge_str = alice.build_challenge()
+            r = client.get("/item/", params=params, headers={"Challenge": challenge_str})
+            assert r.status_code == 200
+            page = r.json()
+            assert len(page) <= 2
+            page_ids.extend(page)
+            if len(page) < 2:
+                break
+            after_id = page[-1]
+        assert page_ids == all_ids
+
+        challenge_str = alice.build_challenge()
+        r = client.get("/item/", params={"limit": 0}, headers={"Challenge": challenge_str})
+        assert r.status_code == 422
+
+    def test_item_batch(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        data = [alice.encrypt_for_db(f"{k}".encode()) for k in range(3)]
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch", json=data, headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        item_ids = [item["id"] for item in r.json()]
+        assert len(item_ids) == 3
+
+        # Bob cannot read nor delete Alice's items
+        challenge_str = bob.build_challenge()
+        r = client.post("/item/batch-get", json=item_ids, headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert r.json() == []
+
+        challenge_str = bob.build_challenge()
+        r = client.post("/item/batch-delete", json=item_ids, headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert r.json() == []
+
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch-get", json=item_ids, headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        plaintexts = [alice.decrypt_from_db(item) for item in r.json()]
+        assert plaintexts == [b"0", b"1", b"2"]
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/batch-delete", json=item_ids[:2], headers={"Challenge": challenge_str}
+        )
+        assert r.status_code == 200
+        assert r.json() == item_ids[:2]
+
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch-get", json=item_ids, headers={"Challenge": challenge_str})
+        assert [item["id"] for item in r.json()] == item_ids[2:]
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/batch-get", json=list(range(1001)), headers={"Challenge": challenge_str}
+        )
+        assert r.status_code == 413
+
+    def test_item_etag(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        u_item = alice.encrypt(TestItem.ref_plaintext.encode())
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/raw",
+            content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+            headers={"Challenge": challenge_str, "Content-Type": "application/octet-stream"},
+        )
+        item_id = r.json()["id"]
+
+        for path in [f"/item/{item_id}", f"/item/{item_id}/raw"]:
+            challenge_str = alice.build_challenge()
+            r = client.get(path, headers={"Challenge": challenge_str})
+            assert r.status_code == 200
+            etag = r.headers["ETag"]
+
+            challenge_str = alice.build_challenge()
+            r = client.get(path, headers={"Challenge": challenge_str, "If-None-Match": etag})
+            assert r.status_code == 304
+            assert r.content == b""
+            assert r.headers["ETag"] == etag
+
+            challenge_str = alice.build_challenge()
+            r = client.get(path, headers={"Challenge": challenge_str, "If-None-Match": '"foo"'})
+            assert r.status_code == 200
+
+        # The entity tag changes with the item
+        u_item = alice.encrypt(b"Je suis un poney")
+        challenge_str = alice.build_challenge()
+        r = client.put(
+            f"/item/{item_id}/raw",
+            content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+            headers={"Challenge": challenge_str},
+        )
+        challenge_str = alice.build_challenge()
+        r = client.get(
+            f"/item/{item_id}", headers={"Challenge": challenge_str, "If-None-Match": etag}
+        )
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+
+        # Another user cannot probe the entity tag of an item
+        bob = User(config_file=Path("tests/bob.topsecret"))
+        challenge_str = bob.build_challenge()
+        r = client.get(
+            f"/item/{item_id}", headers={"Challenge": challenge_str, "If-None-Match": "*"}
+        )
+        assert r.status_code == 404
+
+        challenge_str = alice.build_challenge()
+        r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+
+    def test_item_changes(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+
+        def _changes(since: int, limit: int = 1000) -> dict:
+            challenge_str = alice.build_challenge()
+            r = client.get(
+                "/item/changes",
+                params={"since": since, "limit": limit},
+                headers={"Challenge": challenge_str},
+            )
+            assert r.status_code == 200
+            return r.json()
+
+        since = 0
+        while True:
+            page = _changes(since)
+            since = page["last_seq"]
+            if len(page["changes"]) < 1000:
+                break
+
+        data = alice.encrypt_for_db(TestItem.ref_plaintext.encode())
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch", json=[data, data], headers={"Challenge": challenge_str})
+        item_ids = [item["id"] for item in r.json()]
+
+        u_item = alice.encrypt(b"Je suis un poney")
+        challenge_str = alice.build_challenge()
+        r = client.put(
+            f"/item/{item_ids[0]}/raw",
+            content=encrypted_to_raw(u_item.capsule, u_item.ciphertext),
+            headers={"Challenge": challenge_str},
+        )
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch-delete", json=item_ids, headers={"Challenge": challenge_str})
+        assert r.json() == item_ids
+
+        page = _changes(since)
+        changes = [(change["item_id"], change["kind"]) for change in page["changes"]]
+        assert changes == [
+            (item_ids[0], "created"),
+            (item_ids[1], "created"),
+            (item_ids[0], "updated"),
+            (item_ids[0], "deleted"),
+            (item_ids[1], "deleted"),
+        ]
+        assert page["last_seq"] == page["changes"][-1]["seq"]
+
+        # Pages of changes
+        first = _changes(since, limit=2)
+        assert first["changes"] == page["changes"][:2]
+        assert _changes(first["last_seq"])["changes"] == page["changes"][2:]
+        assert _changes(page["last_seq"]) == {"changes": [], "last_seq": page["last_seq"]}
+
 
 if __name__ == "__main__":
     TestItem.setUpClass()
@@ -101,3 +372,8 @@ if __name__ == "__main__":
     a.test_illicit_user_creation()
     a.test_item_data()
     a.test_item_errors()
+    a.test_raw_item_data()
+    a.test_item_etag()
+    a.test_item_changes()
+    a.test_item_pagination()
+    a.test_item_batch()
@@ -0,0 +1,92 @@
+from asyncio import run as aiorun
+from pathlib import Path
+import unittest
+
+import httpx
+import uvicorn
+
+from network.backend.loadtest import LoadTest, endpoint_name, parse_mix, percentile
+from network.backend.main import Server
+from network.frontend.Admin import Admin
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_helpers(self):
+        assert parse_mix("upload=2, read") == {"upload": 2.0, "read": 1.0}
+        with self.assertRaises(ValueError):
+            parse_mix("upload=1,download=1")
+        with self.assertRaises(ValueError):
+            parse_mix("upload=0")
+
+        request = httpx.Request("GET", "http://localhost/item/123/raw?x=1")
+        assert endpoint_name(request) == "GET /item/{id}/raw"
+        request = httpx.Request("POST", "http://localhost/item/")
+        assert endpoint_name(request) == "POST /item/"
+
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 100) == 100
+        assert percentile([3.0], 90) == 3.0
+
+    def test_loadtest(self, host: str = "127.0.0.1", port: int = 3102):
+        import network.backend.models as md
+
+        server_url = f"http://{host}:{port}"
+        admin_key = Path("tests/loadtest_admin.topsecret")
+
+        admin = Admin()
+        data = admin.to_json()
+        db_admin = md.DbUser(
+            admin=True, public_key=data["public_key"], verifying_key=data["verifying_key"]
+        )
+        con = md.get_connection(async_engine=False)
+        with con() as session:
+            session.add(db_admin)
+            session.commit()
+            session.refresh(db_admin)
+            admin.id = db_admin.id
+        admin.to_topsecret_file(admin_key)
+
+        async def _run():
+            test = LoadTest(
+                server_url=server_url,
+                admin_key=admin_key,
+                users=3,
+                concurrency=4,
+                item_size=100,
+                seed_items=2,
+                seed=0,
+            )
+            try:
+                await test.setup()
+                return await test.run(60)
+            finally:
+                await test.close()
+
+        config = uvicorn.Config(
+            "network.backend.main:app", host=host, port=port, log_level="info", workers=1
+        )
+        server = Server(config=config)
+        with server.run_in_thread():
+            report = aiorun(_run())
+        admin_key.unlink()
+
+        operations = report["operations"]
+        assert sum(stats["count"] for stats in operations.values()) == 60
+        assert set(operations) <= {"upload", "read", "list", "share", "delete"}
+        assert "read" in operations
+
+        endpoints = report["endpoints"]
+        assert "GET /item/{id}" in endpoints
+        # The requests of the setup are not counted
+        assert "POST /users/" not in endpoints
+        for stats in endpoints.values():
+            assert stats["errors"] == 0
+            assert stats["p50"] <= stats["p90"] <= stats["p99"] <= stats["max"]
+
+
+if __name__ == "__main__":
+    a = TestLoadTest()
+    a.test_helpers()
+    a.test_loadtest()
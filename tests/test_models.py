@@ -0,0 +1,24 @@
+from asyncio import run as aiorun
+import unittest
+
+from network.backend import models
+
+
+class TestModels(unittest.TestCase):
+    def test_engine_registry(self):
+        con = models.get_connection()
+        engine = models.get_engine()
+
+        assert models.get_connection() is con
+        assert models.get_engine() is engine
+        assert con.kw["bind"] is engine
+        assert models.get_engine(async_engine=False) is not engine
+
+        aiorun(models.dispose_engines())
+
+        assert models.get_engine() is not engine
+
+
+if __name__ == "__main__":
+    a = TestModels()
+    a.test_engine_registry()
@@ -0,0 +1,59 @@
+import asyncio
+from asyncio import run as aiorun
+from pathlib import Path
+import unittest
+
+from network.backend import crud, models
+from network.backend.notifier import PollingNotifier, get_notifier
+from network.frontend.User import User
+from network.testing import prepare_database
+from network.transcoding import encrypted_to_raw
+
+
+class TestNotifier(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        prepare_database()
+
+    async def _check_notifier(self, notifier):
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        alice_queue = await notifier.subscribe(alice.id)
+        bob_queue = await notifier.subscribe(bob.id)
+
+        u_item = alice.encrypt(b"Je suis un poney")
+        con = models.get_connection()
+        async with con() as db:
+            item_id = await crud.create_raw_item(
+                db, alice.id, encrypted_to_raw(u_item.capsule, u_item.ciphertext)
+            )
+            assert await crud.delete_item(db, alice.id, item_id)
+
+        for kind in ["created", "deleted"]:
+            change = await asyncio.wait_for(alice_queue.get(), timeout=5)
+            assert change == {"user_id": alice.id, "item_id": item_id, "kind": kind}
+        assert bob_queue.empty()
+
+        notifier.unsubscribe(alice.id, alice_queue)
+        notifier.unsubscribe(bob.id, bob_queue)
+
+    def test_memory_notifier(self):
+        aiorun(self._check_notifier(get_notifier()))
+
+    def test_polling_notifier(self):
+        async def _check():
+            notifier = PollingNotifier(interval=0.01)
+            try:
+                await self._check_notifier(notifier)
+            finally:
+                await notifier.stop()
+
+        aiorun(_check())
+
+
+if __name__ == "__main__":
+    TestNotifier.setUpClass()
+    a = TestNotifier()
+    a.test_memory_notifier()
+    a.test_polling_notifier()
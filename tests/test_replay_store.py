@@ -0,0 +1,72 @@
+from asyncio import run as aiorun
+from base64 import b64encode
+from datetime import datetime, timedelta
+from pathlib import Path
+import time
+import unittest
+
+from umbral import Signer
+from umbral.hashing import Hash
+
+from network.backend.models import check_challenge
+from network.backend.replay_store import MemoryReplayStore, ReplayStore, SqlReplayStore
+from network.frontend.User import User
+from network.transcoding import datetime_to_challenge
+
+
+class TestReplayStore(unittest.TestCase):
+    async def _check_store(self, store):
+        assert await store.check_and_add(1, "2023-03-10T16:45:06.294439", timeout=60)
+        assert await store.check_and_add(2, "2023-03-10T16:45:06.294439", timeout=60)
+        assert await store.check_and_add(1, "2023-03-10T16:45:07.294439", timeout=60)
+        assert not await store.check_and_add(1, "2023-03-10T16:45:06.294439", timeout=60)
+
+        # Expired challenges are forgotten
+        assert await store.check_and_add(3, "2023-03-10T16:45:06.294439", timeout=-1)
+        assert await store.check_and_add(4, "2023-03-10T16:45:06.294439", timeout=60)
+        assert await store.check_and_add(3, "2023-03-10T16:45:06.294439", timeout=60)
+
+    def test_memory_store(self):
+        with self.assertRaises(TypeError):
+            ReplayStore()
+
+        store = MemoryReplayStore()
+        aiorun(self._check_store(store))
+        assert len(store) == 5
+
+    def test_sql_store(self):
+        db_path = Path("tests/test_replay.db")
+        if db_path.exists():
+            db_path.unlink()
+
+        store = SqlReplayStore(f"sqlite+aiosqlite:///{db_path}")
+        aiorun(self._check_store(store))
+
+    def test_future_challenge(self):
+        user = User()
+        store = MemoryReplayStore()
+
+        def _check(dt: datetime) -> dict:
+            # Same as User.build_challenge, at a given time
+            sdt, b64_hash = datetime_to_challenge(dt)
+            hash = Hash()
+            hash.update(sdt.encode(encoding="ascii"))
+            signature = Signer(user.signing_key).sign_digest(hash)
+            b64_sign = b64encode(bytes(signature)).decode(encoding="ascii")
+            return aiorun(check_challenge(store, 1, user.verifying_key, b64_hash, b64_sign, 10))
+
+        status = _check(datetime.now() + timedelta(seconds=30))
+        assert status["status"] == 401
+        assert "Challenge in the future" in status["message"]
+
+        # Remembered until the challenge expires, not only timeout seconds from now
+        assert _check(datetime.now() + timedelta(seconds=5))["status"] == 200
+        expires, _ = store._window[0]
+        assert expires - time.monotonic() > 14
+
+
+if __name__ == "__main__":
+    a = TestReplayStore()
+    a.test_memory_store()
+    a.test_sql_store()
+    a.test_future_challenge()
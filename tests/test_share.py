@@ -1,11 +1,16 @@
+from asyncio import run as aiorun
+from base64 import b64decode
 from pathlib import Path
 import unittest
 
 from fastapi.testclient import TestClient
+from sqlalchemy import select
 
 from network.frontend.User import User
+from network.backend import crud, models
 from network.backend.main import app
-from network.schemas import ItemModel
+from network.backend.proxy_worker import claim_jobs, process_job, process_jobs
+from network.schemas import ItemModel, ShareModel, UserModel
 from network.testing import prepare_database
 
 
@@ -113,10 +118,341 @@ class TestShare(unittest.TestCase):
         assert r.status_code == 404
         assert f"Recipient user {recipient_id} not found" in r.json()["detail"]
 
+        # Bob cannot share Alice's item
+        challenge_str = bob.build_challenge()
+        r = client.post(
+            f"/share/{item_id}/{bob.id}", headers={"Challenge": challenge_str}, json=kfrag_json
+        )
+        assert r.status_code == 404
+        assert f"Item {item_id} not found" in r.json()["detail"]
+
+        # Malformed kfrags
+        for bad_kfrag in ("abc", kfrag_json["kfrag"][:-8]):
+            challenge_str = alice.build_challenge()
+            r = client.post(
+                f"/share/{item_id}/{bob.id}",
+                headers={"Challenge": challenge_str},
+                json={"kfrag": bad_kfrag},
+            )
+            assert r.status_code == 422
+            assert r.json()["detail"] == "Invalid kfrag"
+
+            share = {"item_id": item_id, "recipient_id": bob.id, "kfrag": bad_kfrag}
+            challenge_str = alice.build_challenge()
+            r = client.post("/share/batch", json=[share], headers={"Challenge": challenge_str})
+            assert r.status_code == 422
+            assert r.json()["detail"] == "Invalid kfrag"
+
+    def test_share_batch(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        data = [alice.encrypt_for_db(f"{k}".encode()) for k in range(3)]
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/batch", json=data, headers={"Challenge": challenge_str})
+        item_ids = [item["id"] for item in r.json()]
+
+        kfrag_json = alice.generate_kfrags_for_db(bob.public_key)
+        shares = [
+            {"item_id": item_id, "recipient_id": bob.id, "kfrag": kfrag_json["kfrag"]}
+            for item_id in item_ids
+        ]
+        challenge_str = alice.build_challenge()
+        r = client.post("/share/batch", json=shares, headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        bob_items = r.json()
+        assert [item["user_id"] for item in bob_items] == [bob.id] * 3
+
+        challenge_str = bob.build_challenge()
+        r = client.post(
+            "/item/batch-get",
+            json=[item["id"] for item in bob_items],
+            headers={"Challenge": challenge_str},
+        )
+        plaintexts = [bob.decrypt_from_db(item) for item in r.json()]
+        assert plaintexts == [b"0", b"1", b"2"]
+
+        # Bob cannot share Alice's items
+        challenge_str = bob.build_challenge()
+        r = client.post("/share/batch", json=shares, headers={"Challenge": challenge_str})
+        assert r.status_code == 404
+        assert f"Item {item_ids[0]} not found" in r.json()["detail"]
+
+        shares[1]["recipient_id"] = 46435434
+        challenge_str = alice.build_challenge()
+        r = client.post("/share/batch", json=shares, headers={"Challenge": challenge_str})
+        assert r.status_code == 404
+        assert "Recipient user 46435434 not found" in r.json()["detail"]
+
+    def test_share_threshold(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/", json=alice.encrypt_for_db(b"2 of 3"), headers={"Challenge": challenge_str}
+        )
+        item_id = r.json()["id"]
+
+        kfrag_json = alice.generate_kfrags_for_db(bob.public_key, threshold=2, shares=3)
+        assert len(kfrag_json["kfrags"]) == 3
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            f"/share/{item_id}/{bob.id}", headers={"Challenge": challenge_str}, json=kfrag_json
+        )
+        assert r.status_code == 200
+        item = r.json()
+        assert item["cfrag"] is None
+        assert len(item["cfrags"]) == 3
+        bob_item_id = item["id"]
+
+        challenge_str = bob.build_challenge()
+        r = client.get(f"/item/{bob_item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        u_item = ItemModel(**r.json()).toUmbral()
+        assert bob.decrypt(u_item) == b"2 of 3"
+
+        # Any 2 cfrags out of 3 are enough, a single one is not
+        u_item.cfrags = u_item.cfrags[1:]
+        assert bob.decrypt(u_item) == b"2 of 3"
+        u_item.cfrags = u_item.cfrags[1:]
+        self.assertRaises(ValueError, bob.decrypt, u_item)
+
+        challenge_str = bob.build_challenge()
+        r = client.get(f"/item/{bob_item_id}/raw", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert len(r.headers["Item-Cfrags"].split(",")) == 3
+
+        challenge_str = bob.build_challenge()
+        r = client.delete(f"/item/{bob_item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+
+        # A share must give at least one kfrag
+        challenge_str = alice.build_challenge()
+        r = client.post(f"/share/{item_id}/{bob.id}", headers={"Challenge": challenge_str}, json={})
+        assert r.status_code == 422
+
+    def test_share_job(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/", json=alice.encrypt_for_db(b"queued"), headers={"Challenge": challenge_str}
+        )
+        item_id = r.json()["id"]
+
+        job_ids = []
+        for threshold, shares in [(1, 1), (2, 3)]:
+            share = {"item_id": item_id, "recipient_id": bob.id}
+            share.update(alice.generate_kfrags_for_db(bob.public_key, threshold, shares))
+            challenge_str = alice.build_challenge()
+            r = client.post("/share/", json=share, headers={"Challenge": challenge_str})
+            assert r.status_code == 202
+            assert r.json()["status"] == "pending"
+            job_ids.append(r.json()["id"])
+
+        # Bob cannot follow Alice's jobs
+        challenge_str = bob.build_challenge()
+        r = client.get(f"/share/jobs/{job_ids[0]}", headers={"Challenge": challenge_str})
+        assert r.status_code == 404
+
+        assert aiorun(process_jobs(batch_size=10)) == 2
+        assert aiorun(process_jobs(batch_size=10)) == 0
+
+        for job_id in job_ids:
+            challenge_str = alice.build_challenge()
+            r = client.get(f"/share/jobs/{job_id}", headers={"Challenge": challenge_str})
+            assert r.status_code == 200
+            job = r.json()
+            assert job["status"] == "done"
+
+            challenge_str = bob.build_challenge()
+            r = client.get(f"/item/{job['item_id']}", headers={"Challenge": challenge_str})
+            assert bob.decrypt_from_db(r.json()) == b"queued"
+
+        # Alice cannot submit the share of Bob's items
+        share["item_id"] = job["item_id"]
+        challenge_str = alice.build_challenge()
+        r = client.post("/share/", json=share, headers={"Challenge": challenge_str})
+        assert r.status_code == 404
+
+    def test_share_job_reclaimed(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/", json=alice.encrypt_for_db(b"reclaimed"), headers={"Challenge": challenge_str}
+        )
+        item_id = r.json()["id"]
+        kfrags = alice.generate_kfrags_for_db(bob.public_key)["kfrag"]
+
+        async def _run():
+            con = models.get_connection()
+            async with con() as db:
+                job = models.ShareJob(
+                    sender_id=alice.id, recipient_id=bob.id, source_item_id=item_id, kfrags=kfrags
+                )
+                # The sender has been deleted since the job was submitted
+                orphan = models.ShareJob(
+                    sender_id=1245636, recipient_id=bob.id, source_item_id=item_id, kfrags=kfrags
+                )
+                db.add_all([job, orphan])
+                await db.commit()
+                job_id, orphan_id = job.id, orphan.id
+                assert {job_id, orphan_id} <= set(await claim_jobs(db, "slow-worker", 10))
+
+            async with con() as db:
+                orphan = await db.get(models.ShareJob, orphan_id)
+                await process_job(db, orphan)
+
+            async with con() as db:
+                job = await db.get(models.ShareJob, job_id)
+                # Another worker claims the job again while it is re-encrypted
+                async with con() as other_db:
+                    await other_db.execute(
+                        models.ShareJob.__table__.update()
+                        .where(models.ShareJob.id == job_id)
+                        .values(worker="other-worker")
+                    )
+                    await other_db.commit()
+                await process_job(db, job)
+
+            async with con() as db:
+                job = await db.get(models.ShareJob, job_id)
+                orphan = await db.get(models.ShareJob, orphan_id)
+                return job, orphan
+
+        before = client.get("/item/", headers={"Challenge": bob.build_challenge()}).json()
+        job, orphan = aiorun(_run())
+        assert orphan.status == models.ShareJob.FAILED
+        assert orphan.error == "User 1245636 not found"
+        # The outcome of the slow worker is discarded
+        assert job.status == models.ShareJob.RUNNING
+        assert job.worker == "other-worker"
+        assert job.item_id is None
+        after = client.get("/item/", headers={"Challenge": bob.build_challenge()}).json()
+        assert after == before
+
+        challenge_str = alice.build_challenge()
+        r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+
+    def test_share_without_copy(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        async def _refcount(item_id):
+            con = models.get_connection()
+            async with con() as db:
+                stmt = (
+                    select(models.Item.encrypted_data, models.Blob.refcount)
+                    .join(models.Blob, models.Blob.hash == models.Item.blob_hash)
+                    .where(models.Item.id == item_id)
+                )
+                encrypted_data, refcount = (await db.execute(stmt)).one()
+                # The ciphertext is only stored in the blob store
+                assert encrypted_data is None
+                return refcount
+
+        def _bob_reads(item_id):
+            challenge_str = bob.build_challenge()
+            r = client.get(f"/item/{item_id}", headers={"Challenge": challenge_str})
+            assert r.status_code == 200
+            return bob.decrypt_from_db(r.json())
+
+        data = alice.encrypt_for_db(b"shared")
+        challenge_str = alice.build_challenge()
+        r = client.post("/item/", json=data, headers={"Challenge": challenge_str})
+        item_id = r.json()["id"]
+
+        kfrag_json = alice.generate_kfrags_for_db(bob.public_key)
+        shares = [{"item_id": item_id, "recipient_id": bob.id, **kfrag_json}] * 3
+        challenge_str = alice.build_challenge()
+        r = client.post("/share/batch", json=shares, headers={"Challenge": challenge_str})
+        bob_ids = [item["id"] for item in r.json()]
+
+        # Alice's item and Bob's items reference the same blob
+        assert aiorun(_refcount(item_id)) == 4
+        assert [_bob_reads(bob_id) for bob_id in bob_ids] == [b"shared"] * 3
+
+        challenge_str = bob.build_challenge()
+        r = client.get(f"/item/{bob_ids[0]}/raw", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert r.content == b64decode(data["encrypted_data"])
+        assert "Item-Cfrag" in r.headers
+
+        # Once Alice's item is deleted, the blob is kept for Bob's items
+        challenge_str = alice.build_challenge()
+        r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+        assert r.status_code == 200
+        assert aiorun(_refcount(bob_ids[0])) == 3
+        assert [_bob_reads(bob_id) for bob_id in bob_ids] == [b"shared"] * 3
+
+        challenge_str = bob.build_challenge()
+        r = client.post(
+            "/item/batch-delete", json=bob_ids[:2], headers={"Challenge": challenge_str}
+        )
+        assert r.status_code == 200
+        assert aiorun(_refcount(bob_ids[2])) == 1
+        assert _bob_reads(bob_ids[2]) == b"shared"
+
+    def test_share_deleted_item(self):
+        client = TestClient(app)
+
+        alice = User(config_file=Path("tests/alice.topsecret"))
+        bob = User(config_file=Path("tests/bob.topsecret"))
+
+        challenge_str = alice.build_challenge()
+        r = client.post(
+            "/item/", json=alice.encrypt_for_db(b"deleted"), headers={"Challenge": challenge_str}
+        )
+        item_id = r.json()["id"]
+        share = ShareModel(
+            item_id=item_id, recipient_id=bob.id, **alice.generate_kfrags_for_db(bob.public_key)
+        )
+
+        async def _share_after_delete():
+            con = models.get_connection()
+            async with con() as db:
+                db_items = await crud.get_user_items_by_id(db, alice.id, [item_id])
+                sender = UserModel.fromORM(await crud.get_user(db, alice.id))
+
+                # The item and its blob are deleted while the share is re-encrypted
+                challenge_str = alice.build_challenge()
+                r = client.delete(f"/item/{item_id}", headers={"Challenge": challenge_str})
+                assert r.status_code == 200
+
+                return await crud.post_shared_items(db, sender, [share], db_items)
+
+        before = client.get("/item/", headers={"Challenge": bob.build_challenge()}).json()
+        assert aiorun(_share_after_delete()) is None
+        # No item referencing the deleted blob has been created
+        after = client.get("/item/", headers={"Challenge": bob.build_challenge()}).json()
+        assert after == before
+
 
 if __name__ == "__main__":
     TestShare.setUpClass()
     a = TestShare()
     a.test_legacy()
+    a.test_share_batch()
+    a.test_share_threshold()
+    a.test_share_job()
+    a.test_share_job_reclaimed()
+    a.test_share_without_copy()
+    a.test_share_deleted_item()
     # a.test_share()
     # a.test_share_errors()
@@ -0,0 +1,61 @@
+from io import BytesIO
+import unittest
+
+from umbral import Capsule, pre
+
+from network.frontend.User import User
+from network.streaming import is_stream
+from network.transcoding import encrypted_to_raw
+
+
+class TestStreaming(unittest.TestCase):
+    def test_stream(self):
+        alice = User()
+        plaintext = bytes(range(256)) * 40 + b"tail"
+
+        for source in [plaintext, BytesIO(plaintext), [plaintext[:1000], plaintext[1000:]]]:
+            raw = b"".join(alice.encrypt_stream(source, chunk_size=1000))
+            assert is_stream(raw)
+
+            pieces = [raw[i : i + 77] for i in range(0, len(raw), 77)]
+            chunks = list(alice.decrypt_stream(pieces))
+            assert len(chunks) == 11
+            assert b"".join(chunks) == plaintext
+
+        raw = b"".join(alice.encrypt_stream(b""))
+        assert b"".join(alice.decrypt_stream(raw)) == b""
+
+        u_item = alice.encrypt(plaintext)
+        assert not is_stream(encrypted_to_raw(u_item.capsule, u_item.ciphertext))
+
+    def test_stream_errors(self):
+        alice = User()
+        frames = list(alice.encrypt_stream(b"x" * 3000, chunk_size=1000))
+
+        # Truncated stream
+        with self.assertRaises(ValueError):
+            b"".join(alice.decrypt_stream(b"".join(frames[:-1])))
+
+        # Reordered chunks
+        with self.assertRaises(ValueError):
+            b"".join(alice.decrypt_stream(b"".join([frames[0], frames[2], frames[1], frames[3]])))
+
+    def test_shared_stream(self):
+        alice = User()
+        bob = User()
+        plaintext = b"Je suis un poney" * 1000
+
+        raw = b"".join(alice.encrypt_stream(plaintext, chunk_size=1024))
+        capsule = Capsule.from_bytes(raw[4 : 4 + int.from_bytes(raw[:4], "little")])
+
+        kfrag = alice.generate_kfrags(bob.public_key, threshold=1, shares=1)[0]
+        cfrag = pre.reencrypt(capsule=capsule, kfrag=kfrag)
+        chunks = bob.decrypt_stream(raw, cfrag=cfrag, sender_pkey=alice.public_key)
+        assert b"".join(chunks) == plaintext
+
+
+if __name__ == "__main__":
+    a = TestStreaming()
+    a.test_stream()
+    a.test_stream_errors()
+    a.test_shared_stream()
@@ -0,0 +1,93 @@
+from base64 import b64encode
+from pathlib import Path
+import struct
+import unittest
+
+from umbral import SecretKey, Signer, encrypt, generate_kfrags, pre
+
+from network.frontend.User import User
+from network.transcoding import (
+    cfrag_to_json,
+    db_bytes_to_cfrag,
+    db_bytes_to_encrypted,
+    db_bytes_to_kfrag,
+    encrypted_to_json,
+    kfrag_to_json,
+)
+
+
+def legacy_pack(*chunks: bytes) -> str:
+    # Reference implementation of the database format, as first written
+    fmt = "<"
+    args = []
+    for chunk in chunks:
+        fmt += "I" + len(chunk) * "B"
+        args.append(len(chunk))
+        args.extend(chunk)
+    return b64encode(struct.pack(fmt, *args)).decode(encoding="ascii")
+
+
+class TestTranscoding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.alice_sk = SecretKey.random()
+        cls.bob_sk = SecretKey.random()
+        signer = Signer(SecretKey.random())
+        cls.kfrag = generate_kfrags(
+            delegating_sk=cls.alice_sk,
+            receiving_pk=cls.bob_sk.public_key(),
+            signer=signer,
+            threshold=1,
+            shares=1,
+        )[0]
+
+    def test_encrypted(self):
+        for size in [0, 1, 100, 10_000, 1_000_000]:
+            plaintext = bytes(range(256)) * (size // 256) + bytes(size % 256)
+            capsule, ciphertext = encrypt(self.alice_sk.public_key(), plaintext)
+
+            db_data = encrypted_to_json(capsule, ciphertext)["encrypted_data"]
+            assert db_data == legacy_pack(bytes(capsule), ciphertext)
+
+            capsule2, ciphertext2 = db_bytes_to_encrypted(db_data)
+            assert bytes(capsule2) == bytes(capsule)
+            assert ciphertext2 == ciphertext
+            # The ciphertext is not copied out of the decoded value
+            assert isinstance(ciphertext2, memoryview)
+
+    def test_frags(self):
+        db_kfrag = kfrag_to_json(self.kfrag)["kfrag"]
+        assert db_kfrag == legacy_pack(bytes(self.kfrag))
+        assert bytes(db_bytes_to_kfrag(db_kfrag)) == bytes(self.kfrag)
+
+        capsule, _ = encrypt(self.alice_sk.public_key(), b"Je suis un poney")
+        cfrag = pre.reencrypt(capsule=capsule, kfrag=self.kfrag)
+        db_cfrag = cfrag_to_json(cfrag)["cfrag"]
+        assert db_cfrag == legacy_pack(bytes(cfrag))
+        assert bytes(db_bytes_to_cfrag(db_cfrag)) == bytes(cfrag)
+
+    def test_topsecret_file(self):
+        path = Path("tests/transcoding.topsecret")
+
+        user = User()
+        user.id = 42
+        user.to_topsecret_file(path)
+
+        pkey = user.private_key.to_secret_bytes()
+        skey = user.signing_key.to_secret_bytes()
+        fmt = "<II" + len(pkey) * "B" + "I" + len(skey) * "B"
+        legacy = struct.pack(fmt, user.id, len(pkey), *pkey, len(skey), *skey)
+        assert path.read_bytes() == legacy
+
+        user2 = User(config_file=path)
+        assert user2.id == user.id
+        assert bytes(user2.public_key) == bytes(user.public_key)
+        assert bytes(user2.verifying_key) == bytes(user.verifying_key)
+
+
+if __name__ == "__main__":
+    TestTranscoding.setUpClass()
+    a = TestTranscoding()
+    a.test_encrypted()
+    a.test_frags()
+    a.test_topsecret_file()
@@ -0,0 +1,47 @@
+import unittest
+
+from network.backend.models import DbUser
+from network.backend.user_cache import UserCache
+from network.frontend.User import User
+
+
+class TestUserCache(unittest.TestCase):
+    def build_db_user(self, user_id: int, admin: bool = False) -> DbUser:
+        data = User().to_json()
+        return DbUser(
+            id=user_id,
+            admin=admin,
+            public_key=data["public_key"],
+            verifying_key=data["verifying_key"],
+        )
+
+    def test_lru(self):
+        cache = UserCache(maxsize=2, ttl=60)
+
+        cache.put(self.build_db_user(1))
+        cache.put(self.build_db_user(2, admin=True))
+        assert cache.get(2).admin
+
+        # User 1 is the least recently used
+        cache.get(2)
+        cache.put(self.build_db_user(3))
+        assert len(cache) == 2
+        assert cache.get(1) is None
+        assert cache.get(2) is not None
+
+        cache.invalidate(2)
+        assert cache.get(2) is None
+
+    def test_ttl(self):
+        cache = UserCache(maxsize=2, ttl=-1)
+
+        entry = cache.put(self.build_db_user(1))
+        assert bytes(entry.verifying_key) != b""
+        assert cache.get(1) is None
+        assert len(cache) == 0
+
+
+if __name__ == "__main__":
+    a = TestUserCache()
+    a.test_lru()
+    a.test_ttl()